@@ -0,0 +1,3 @@
+from strawman import create_asgi_app
+
+app = application = create_asgi_app()
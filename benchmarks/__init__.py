@@ -0,0 +1,9 @@
+"""Authorization Benchmarks.
+
+Micro and macro benchmarks of token verification, rule matching and response
+processing against synthetic data. Run the suite with::
+
+    python -m benchmarks.run --database-url sqlite:// --users 100000
+
+See ``python -m benchmarks.run --help`` for the available parameters.
+"""
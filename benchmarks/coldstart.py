@@ -0,0 +1,141 @@
+"""Cold-Start Benchmark.
+
+Measures the time from a fresh interpreter to the first authorized response,
+with and without warm startup. Each run is a separate process, so nothing is
+shared between runs except the database and the policy snapshot directory.
+Run it with::
+
+    python -m benchmarks.coldstart --runs 20 --users 10000
+
+Each child process reports how long importing the application, ``create_app``
+and the first request took; the parent also records the wall-clock time of the
+whole process.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+
+# Startup configurations compared, as environment overrides.
+MODES = [
+    ('cold', {'WARM_STARTUP': 'false'}),
+    ('warm', {'WARM_STARTUP': 'true'}),
+    ('warm-snapshot', {'WARM_STARTUP': 'true', 'POLICY_SNAPSHOT_DIR': '{snapshot_dir}'})
+]
+
+
+def child(user_id: str, token: str):
+    """Start the application and serve one request, reporting the time each step took."""
+
+    start = perf_counter()
+    from strawman import create_app
+    imported = perf_counter()
+    app = create_app()
+    created = perf_counter()
+    response = app.test_client().get('http://localhost:8000/users/{}'.format(user_id),
+                                     headers={'Authorization': 'Bearer {}'.format(token)})
+    served = perf_counter()
+
+    from benchmarks.run import peak_rss_kb
+    print(json.dumps({
+        'status': response.status_code,
+        'import_ms': (imported - start) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': (served - created) * 1000,
+        'cold_start_to_first_request_ms': (served - start) * 1000,
+        'peak_rss_kb': peak_rss_kb()
+    }))
+
+
+def run_child(database_url: str, user_id: str, overrides: dict):
+    from benchmarks.fixtures import BENCHMARK_TOKEN
+
+    environment = dict(os.environ, SQLALCHEMY_DATABASE_URI=database_url, **overrides)
+    start = perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.coldstart', '--child', user_id, BENCHMARK_TOKEN], env=environment)
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['process_ms'] = (perf_counter() - start) * 1000
+    return result
+
+
+def summarize(mode: str, samples: list):
+    """Reduce the child reports of one mode to the median and 99th percentile of each timing."""
+
+    from benchmarks.run import percentile
+
+    summary = {'benchmark': 'cold_start[{}]'.format(mode), 'runs': len(samples),
+               'statuses': sorted(set(sample['status'] for sample in samples))}
+    for key in ['import_ms', 'create_app_ms', 'first_request_ms', 'cold_start_to_first_request_ms', 'process_ms']:
+        values = sorted(sample[key] for sample in samples)
+        summary['{}_p50'.format(key)] = percentile(values, 50)
+        summary['{}_p99'.format(key)] = percentile(values, 99)
+    summary['peak_rss_kb'] = max(sample['peak_rss_kb'] for sample in samples)
+    return summary
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the time from process start to the first response.')
+    parser.add_argument('--child', nargs=2, metavar=('USER_ID', 'TOKEN'), help=argparse.SUPPRESS)
+    parser.add_argument('--database-url', help='A database reachable from every run. Its contents are replaced. '
+                                               'Defaults to a temporary SQLite file.')
+    parser.add_argument('--users', type=int, default=10000, help='The number of synthetic users.')
+    parser.add_argument('--scopes-per-client', type=int, default=6, help='The number of scopes of the client.')
+    parser.add_argument('--rules-per-scope', type=int, default=2, help='The minimum number of rules per scope.')
+    parser.add_argument('--complexity', type=int, default=0,
+                        help='Extra redaction filters and access policies added to each rule with any.')
+    parser.add_argument('--runs', type=int, default=10, help='The number of processes started per mode.')
+    parser.add_argument('--output', help='Write the results to this file rather than standard output.')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    options = parse_arguments(arguments)
+    if options.child is not None:
+        child(*options.child)
+        return
+
+    from sqlalchemy import select
+    from strawman import create_app
+    from strawman.db import db, User
+    from benchmarks.fixtures import populate
+    from benchmarks.run import prepare_database
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = options.database_url or 'sqlite:///{}'.format(os.path.join(directory, 'coldstart.db'))
+        app = create_app(database_url=database_url)
+        prepare_database(app)
+        with app.app_context():
+            populate(options.users, options.scopes_per_client, options.rules_per_scope, options.complexity)
+            user_id = db.session.execute(select([User.id]).order_by(User.id).limit(1)).scalar()
+            db.session.remove()
+
+        results = []
+        for mode, overrides in MODES:
+            overrides = {key: value.format(snapshot_dir=os.path.join(directory, 'snapshots'))
+                         for key, value in overrides.items()}
+            samples = [run_child(database_url, user_id, overrides) for _ in range(options.runs)]
+            results.append(summarize(mode, samples))
+
+    document = json.dumps({
+        'parameters': {
+            'users': options.users,
+            'scopes_per_client': options.scopes_per_client,
+            'rules_per_scope': options.rules_per_scope,
+            'complexity': options.complexity
+        },
+        'results': results
+    }, indent=2)
+    if options.output:
+        with open(options.output, 'w') as output:
+            output.write(document + '\n')
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Synthetic Benchmark Data.
+
+Scopes are generated from the scope shapes used by the test suite. Each
+generated scope is a copy of one of those shapes, padded with rules for
+unrelated resources and given extra redaction filters and access policies
+according to the requested complexity.
+"""
+
+import copy
+import json
+import random
+from datetime import datetime, timedelta
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.postgresql.json import JSONB
+
+from strawman.db import db, Client, Role, User, Token
+from tests.conftest import ALL_SCOPES
+
+# The bearer token issued to the benchmark client.
+BENCHMARK_TOKEN = 'benchmark-token'
+
+FIRST_NAMES = ['John', 'Mary', 'Anthony', 'Linda', 'James', 'Patricia', 'Robert', 'Jennifer']
+MIDDLE_NAMES = ['Evan', 'Jane', 'Paul', None]
+LAST_NAMES = ['Doe', 'Smith', 'Johnson', 'Williams', 'Brown', 'Jones']
+SUFFIXES = ['Jr', 'Sr', 'III', None, None, None]
+
+# Fields that extra redaction filters are applied to, in turn.
+REDACTABLE_FIELDS = ['firstname', 'middlename', 'lastname', 'suffix', 'ssn', 'date_registered']
+
+
+@compiles(JSONB, 'sqlite')
+def _compile_jsonb_sqlite(element, compiler, **kw):
+    # lets SQLite stand in for PostgreSQL
+    return 'JSON'
+
+
+def generate_scope(index: int, rules_per_scope: int, complexity: int):
+    """Generate a scope from one of the test suite's scope shapes.
+    Args:
+        index (int): The index of the scope; selects the shape and makes the name unique.
+        rules_per_scope (int): The minimum number of rules in the scope's ruleset.
+        complexity (int): The number of redaction filters and access policies added to each rule with any.
+    Returns:
+        dict: The scope document.
+    """
+
+    scope = copy.deepcopy(ALL_SCOPES[index % len(ALL_SCOPES)]['scope'])
+    scope['scope'] = '{}:bench-{}'.format(scope['scope'], index)
+
+    for entry in scope['ruleset']:
+        rule = entry['rule']
+        if 'redacted_fields' not in rule and 'access_policies' not in rule:
+            continue
+        for level in range(complexity):
+            rule.setdefault('redacted_fields', []).append({
+                'field': REDACTABLE_FIELDS[level % len(REDACTABLE_FIELDS)],
+                'filter': "(age >= {} and age < {}) or suffix == 'Jr'".format(21 + level, 30 + level)
+            })
+            rule.setdefault('access_policies', []).append({
+                'description': 'generated policy {}'.format(level),
+                'filter': 'age == {} and lastname != null'.format(90 + level)
+            })
+
+    # unrelated resources are declared first so matching has to look past them
+    padding = [
+        {
+            'rule': {
+                'resource': 'http://localhost:8000/resource{}-{}/[\\w]+'.format(index, position),
+                'allowed_methods': ['GET']
+            }
+        }
+        for position in range(rules_per_scope - len(scope['ruleset']))
+    ]
+    scope['ruleset'] = padding + scope['ruleset']
+    return scope
+
+
+def generate_scopes(scopes_per_client: int, rules_per_scope: int, complexity: int):
+    """Generate the scopes assigned to the benchmark client.
+    Args:
+        scopes_per_client (int): The number of scopes.
+        rules_per_scope (int): The minimum number of rules in each scope's ruleset.
+        complexity (int): The number of redaction filters and access policies added to each rule with any.
+    Returns:
+        list: The scope documents.
+    """
+
+    return [generate_scope(index, rules_per_scope, complexity) for index in range(scopes_per_client)]
+
+
+def generate_users(count: int, seed: int = 0):
+    """Generate user rows for bulk insertion.
+    Args:
+        count (int): The number of users.
+        seed (int): The seed of the random generator, so runs are repeatable.
+    Returns:
+        generator: The column values of each user.
+    """
+
+    rng = random.Random(seed)
+    registered = datetime(2019, 1, 1)
+    for _ in range(count):
+        yield {
+            'id': '{:032x}'.format(rng.getrandbits(128)),
+            'firstname': rng.choice(FIRST_NAMES),
+            'middlename': rng.choice(MIDDLE_NAMES),
+            'lastname': rng.choice(LAST_NAMES),
+            'suffix': rng.choice(SUFFIXES),
+            'ssn': '{:09d}'.format(rng.randrange(10 ** 9)),
+            'age': rng.randrange(100),
+            'date_registered': registered + timedelta(minutes=rng.randrange(525600))
+        }
+
+
+def populate(users: int, scopes_per_client: int, rules_per_scope: int, complexity: int, seed: int = 0,
+             batch_size: int = 10000):
+    """Replace the contents of the database with a synthetic data set.
+
+    Every user, client, token and role in the database is deleted first, so the
+    database should be dedicated to benchmarking.
+
+    Args:
+        users (int): The number of users.
+        scopes_per_client (int): The number of scopes assigned to the benchmark client.
+        rules_per_scope (int): The minimum number of rules in each scope's ruleset.
+        complexity (int): The number of redaction filters and access policies added to each rule with any.
+        seed (int): The seed of the random generator.
+        batch_size (int): The number of users inserted per statement.
+    Returns:
+        list: The scope documents assigned to the benchmark client.
+    """
+
+    for table in [Token.__table__, db.metadata.tables['roles'], Client.__table__, Role.__table__, User.__table__]:
+        db.session.execute(table.delete())
+
+    scopes = generate_scopes(scopes_per_client, rules_per_scope, complexity)
+    client = Client(id='benchmark-client', client_name='Benchmark Client')
+    client.roles = [Role(role=scope['scope'], description='a benchmark role', rules=json.dumps(scope))
+                    for scope in scopes]
+    db.session.add(client)
+    db.session.add(Token(token=BENCHMARK_TOKEN, client_id=client.id))
+
+    batch = []
+    for user in generate_users(users, seed):
+        batch.append(user)
+        if len(batch) == batch_size:
+            db.session.execute(User.__table__.insert(), batch)
+            batch = []
+    if len(batch) > 0:
+        db.session.execute(User.__table__.insert(), batch)
+    db.session.commit()
+    return scopes
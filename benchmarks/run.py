@@ -0,0 +1,202 @@
+"""Benchmark Runner.
+
+Populates a database with synthetic data, runs each benchmark and writes the
+results as JSON. Every result records the median and 99th percentile latency,
+the throughput, and the peak resident set size of the process so far.
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import resource
+from time import perf_counter
+from flask_migrate import upgrade
+from sqlalchemy import select
+
+from strawman import create_app
+from strawman.db import db, User
+from strawman.middleware import can_access, verify_client_token_and_scopes, process_response, paginate_response,\
+    stream_response, compile_rule, policy_cache, token_cache, decision_cache, invalidate_token
+from strawman.middleware.auth_middleware import load_client_policies, match_rule, walk_rules
+from benchmarks.fixtures import BENCHMARK_TOKEN, populate
+
+BASE_URL = 'http://localhost:8000'
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of the process in kilobytes."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(samples: list, percent: float):
+    """Return the nearest-rank percentile of sorted samples."""
+
+    rank = max(int(round(percent / 100.0 * len(samples))) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+def measure(name: str, operation, iterations: int, warmup: int = 1, **parameters):
+    """Time repeated calls of an operation.
+    Args:
+        name (str): The name of the benchmark.
+        operation (function): The operation to time; called without arguments.
+        iterations (int): The number of timed calls.
+        warmup (int): The number of untimed calls made first.
+        parameters (dict): Extra values recorded with the result.
+    Returns:
+        dict: The benchmark result.
+    """
+
+    for _ in range(warmup):
+        operation()
+    samples = []
+    for _ in range(iterations):
+        start = perf_counter()
+        operation()
+        samples.append(perf_counter() - start)
+    samples.sort()
+    result = {
+        'benchmark': name,
+        'iterations': iterations,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'ops_per_sec': iterations / sum(samples) if sum(samples) > 0 else None,
+        'peak_rss_kb': peak_rss_kb()
+    }
+    result.update(parameters)
+    return result
+
+
+def micro_benchmarks(app, user_id: str, iterations: int):
+    """Benchmark token verification and rule matching on a single request."""
+
+    results = []
+    headers = {'Authorization': 'Bearer {}'.format(BENCHMARK_TOKEN)}
+    urls = ['/users', '/users/{}'.format(user_id), '/unknown']
+
+    policies = load_client_policies(BENCHMARK_TOKEN)
+    index = policy_cache.index_for(policies)
+    for path in urls:
+        url = BASE_URL + path
+        results.append(measure('rule_matching', lambda: index.match(url), iterations, path=path))
+        results.append(measure('rule_walk', lambda: walk_rules(policies, url, 'GET'), iterations, path=path))
+        results.append(measure('decision_lookup', lambda: match_rule(policies, url, 'GET'), iterations, path=path))
+
+    for path in urls:
+        with app.test_request_context(path, base_url=BASE_URL, headers=headers):
+            results.append(measure('verify_client_token_and_scopes',
+                                   lambda: verify_client_token_and_scopes(BENCHMARK_TOKEN), iterations, path=path))
+
+            def uncached():
+                invalidate_token(BENCHMARK_TOKEN)
+                decision_cache.clear()
+                return verify_client_token_and_scopes(BENCHMARK_TOKEN)
+            results.append(measure('verify_client_token_and_scopes[uncached]', uncached, iterations, path=path))
+
+            results.append(measure('can_access', can_access, iterations, path=path))
+    return results
+
+
+def response_benchmarks(scopes: list, user_id: str, iterations: int, macro_iterations: int, batch_size: int):
+    """Benchmark response processing under each distinct rule of the benchmark scopes."""
+
+    results = []
+    seen = set()
+    for scope in scopes:
+        for entry in scope['ruleset']:
+            rule = compile_rule(entry)
+            key = json.dumps(rule.source, sort_keys=True)
+            if rule.resource.startswith(BASE_URL + '/resource') or key in seen:
+                continue
+            seen.add(key)
+            parameters = {'scope': scope['scope'], 'resource': rule.resource}
+            results.append(measure('process_response[id]', lambda: process_response(rule, User, id=user_id),
+                                   iterations, **parameters))
+            results.append(measure('process_response[sql-redaction,id]',
+                                   lambda: process_response(rule, User, id=user_id, redact_in_sql=True),
+                                   iterations, **parameters))
+            results.append(measure('paginate_response', lambda: paginate_response(rule, User, 100), iterations,
+                                   limit=100, **parameters))
+            results.append(measure('process_response[collection]', lambda: process_response(rule, User),
+                                   macro_iterations, warmup=0, **parameters))
+            results.append(measure('stream_response', lambda: sum(1 for _ in stream_response(
+                rule, User, batch_size=batch_size)), macro_iterations, warmup=0, batch_size=batch_size, **parameters))
+    return results
+
+
+def prepare_database(app):
+    """Create the schema: from the models on SQLite, and by running the migrations elsewhere."""
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            db.create_all()
+        else:
+            upgrade(directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations'))
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark authorization and response processing.')
+    parser.add_argument('--database-url', default=os.getenv('BENCHMARK_DATABASE_URL', 'sqlite://'),
+                        help='The database to benchmark against. Its contents are replaced. Defaults to in-memory '
+                             'SQLite.')
+    parser.add_argument('--users', type=int, default=10000, help='The number of synthetic users.')
+    parser.add_argument('--scopes-per-client', type=int, default=6, help='The number of scopes of the client.')
+    parser.add_argument('--rules-per-scope', type=int, default=2, help='The minimum number of rules per scope.')
+    parser.add_argument('--complexity', type=int, default=0,
+                        help='Extra redaction filters and access policies added to each rule with any.')
+    parser.add_argument('--iterations', type=int, default=1000, help='Timed calls of each micro benchmark.')
+    parser.add_argument('--macro-iterations', type=int, default=3, help='Timed calls of each full-table benchmark.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows per batch when streaming.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the data generator.')
+    parser.add_argument('--output', help='Write the results to this file rather than standard output.')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    options = parse_arguments(arguments)
+    app = create_app(database_url=options.database_url)
+    prepare_database(app)
+
+    with app.app_context():
+        scopes = populate(options.users, options.scopes_per_client, options.rules_per_scope, options.complexity,
+                          options.seed)
+        user_id = db.session.execute(select([User.id]).order_by(User.id).limit(1)).scalar()
+        token_cache.clear()
+        policy_cache.clear()
+        decision_cache.clear()
+
+        results = micro_benchmarks(app, user_id, options.iterations)
+        results += response_benchmarks(scopes, user_id, options.iterations, options.macro_iterations,
+                                       options.batch_size)
+
+        report = {
+            'parameters': {
+                'database': db.engine.dialect.name,
+                'users': options.users,
+                'scopes_per_client': options.scopes_per_client,
+                'rules_per_scope': options.rules_per_scope,
+                'complexity': options.complexity,
+                'seed': options.seed
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform()
+            },
+            'results': results
+        }
+
+    document = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as output:
+            output.write(document + '\n')
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""notify policy changes
+
+Revision ID: b2fe27546233
+Revises: a59023e183e8
+Create Date: 2026-10-18 09:12:40.381952
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2fe27546233'
+down_revision = 'a59023e183e8'
+branch_labels = None
+depends_on = None
+
+# Each trigger passes the column identifying the cache entries a change affects.
+TRIGGERS = [
+    ('oauth2_roles', 'UPDATE OR DELETE', 'id'),
+    ('roles', 'INSERT OR UPDATE OR DELETE', 'client_id'),
+    ('tokens', 'UPDATE OR DELETE', 'token')
+]
+
+
+def upgrade():
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_policy_change() RETURNS trigger AS $$
+        DECLARE
+            key_column TEXT := TG_ARGV[0];
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify('policy_changes', json_build_object(
+                    'table', TG_TABLE_NAME, 'key', to_jsonb(OLD) ->> key_column)::text);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND
+                                    to_jsonb(NEW) ->> key_column IS DISTINCT FROM to_jsonb(OLD) ->> key_column) THEN
+                PERFORM pg_notify('policy_changes', json_build_object(
+                    'table', TG_TABLE_NAME, 'key', to_jsonb(NEW) ->> key_column)::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table, events, key_column in TRIGGERS:
+        op.execute("""
+            CREATE TRIGGER {table}_notify_policy_change AFTER {events} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE notify_policy_change('{key_column}');
+        """.format(table=table, events=events, key_column=key_column))
+
+
+def downgrade():
+    for table, _, _ in TRIGGERS:
+        op.execute('DROP TRIGGER IF EXISTS {table}_notify_policy_change ON {table};'.format(table=table))
+    op.execute('DROP FUNCTION IF EXISTS notify_policy_change();')
@@ -0,0 +1,67 @@
+"""hash and expire tokens
+
+Revision ID: b960b68fdd16
+Revises: b2fe27546233
+Create Date: 2026-10-18 10:41:07.559213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b960b68fdd16'
+down_revision = 'b2fe27546233'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('tokens', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('tokens', sa.Column('expires_at', sa.TIMESTAMP(), nullable=True))
+    # sha256() is built into PostgreSQL 11 and later
+    op.execute("UPDATE tokens SET token_hash = encode(sha256(convert_to(token, 'UTF8')), 'hex')")
+    op.drop_constraint('tokens_pkey', 'tokens', type_='primary')
+    op.drop_column('tokens', 'token')
+    op.alter_column('tokens', 'token_hash', nullable=False)
+    op.create_primary_key('tokens_pkey', 'tokens', ['token_hash'])
+
+    op.create_index(op.f('ix_tokens_client_id'), 'tokens', ['client_id'], unique=False)
+    op.create_index(op.f('ix_tokens_expires_at'), 'tokens', ['expires_at'], unique=False)
+    op.create_index(op.f('ix_clients_client_id'), 'clients', ['client_id'], unique=False)
+    op.create_index('ix_roles_role_id', 'roles', ['role_id'], unique=False)
+
+    # notifications identify tokens by their hash
+    op.execute('DROP TRIGGER IF EXISTS tokens_notify_policy_change ON tokens;')
+    op.execute("""
+        CREATE TRIGGER tokens_notify_policy_change AFTER UPDATE ON tokens
+        FOR EACH ROW EXECUTE PROCEDURE notify_policy_change('token_hash');
+    """)
+    # cached tokens are checked against their expiry, so purging expired tokens sends no notifications
+    op.execute("""
+        CREATE TRIGGER tokens_notify_policy_delete AFTER DELETE ON tokens
+        FOR EACH ROW WHEN (OLD.expires_at IS NULL OR OLD.expires_at > now() AT TIME ZONE 'UTC')
+        EXECUTE PROCEDURE notify_policy_change('token_hash');
+    """)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER IF EXISTS tokens_notify_policy_delete ON tokens;')
+    op.execute('DROP TRIGGER IF EXISTS tokens_notify_policy_change ON tokens;')
+    op.drop_index('ix_roles_role_id', table_name='roles')
+    op.drop_index(op.f('ix_clients_client_id'), table_name='clients')
+    op.drop_index(op.f('ix_tokens_expires_at'), table_name='tokens')
+    op.drop_index(op.f('ix_tokens_client_id'), table_name='tokens')
+
+    # the original token values cannot be recovered from their hashes, so existing tokens stop working
+    op.add_column('tokens', sa.Column('token', sa.String(), nullable=True))
+    op.execute('UPDATE tokens SET token = token_hash')
+    op.drop_constraint('tokens_pkey', 'tokens', type_='primary')
+    op.drop_column('tokens', 'expires_at')
+    op.drop_column('tokens', 'token_hash')
+    op.alter_column('tokens', 'token', nullable=False)
+    op.create_primary_key('tokens_pkey', 'tokens', ['token'])
+    op.execute("""
+        CREATE TRIGGER tokens_notify_policy_change AFTER UPDATE OR DELETE ON tokens
+        FOR EACH ROW EXECUTE PROCEDURE notify_policy_change('token');
+    """)
@@ -1,2 +1,2 @@
 from strawman.db import db
-from strawman.app import create_app
+from strawman.app import create_app, create_asgi_app
@@ -1 +1,3 @@
 from strawman.api.api import user_bp
+from strawman.api.metrics import metrics_bp
+from strawman.api.authorize import authorize_bp
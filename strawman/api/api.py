@@ -1,13 +1,16 @@
 """Strawman API"""
 
 import json
-from flask import Blueprint
+from flask import Blueprint, current_app, request, make_response
 from flask_restful import Api, Resource
+from flask_restful.representations.json import output_json
 from sqlalchemy import text
 from strawman.db import db, User
 from strawman.middleware import protected_resource, can_access,\
-    process_request, process_response
-from strawman.utilities import ResponseBody
+    process_request, process_response, paginate_response, stream_response, InvalidCursorError, RestrictedFieldError
+from strawman.middleware.request_body import buffer_body
+from strawman.utilities import ResponseBody, timings
+from strawman.utilities.responses import Envelope, encode_envelope
 
 
 class UserResource(Resource):
@@ -17,23 +20,78 @@ class UserResource(Resource):
         self.response_body = ResponseBody()
 
     def get(self, id: str = None):
-        is_valid_request, scope = can_access()
+        is_valid_request, rule = can_access()
         if is_valid_request:
-
-            return self.response_body.get_one_response(result=all_users)
+            stream = request.args.get('stream')
+            if id is None and (stream in ('json', 'ndjson') or request.accept_mimetypes.best == 'application/x-ndjson'):
+                results = stream_response(rule, User, batch_size=current_app.config['STREAM_BATCH_SIZE'],
+                                          redact_in_sql=current_app.config['REDACT_IN_SQL'],
+                                          vectorized=current_app.config['VECTORIZED_EXPORTS'])
+                return self.response_body.stream_all_response(results=results, ndjson=stream != 'json')
+            if id is None:
+                try:
+                    limit = min(int(request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT'])),
+                                current_app.config['PAGE_SIZE_MAX'])
+                    results, next_cursor = paginate_response(
+                        rule, User, limit=max(limit, 1), cursor=request.args.get('cursor'),
+                        redact_in_sql=current_app.config['REDACT_IN_SQL'])
+                except (ValueError, InvalidCursorError):
+                    return self.response_body.custom_response(
+                        status='Error', code=400, messages=['Invalid pagination limit or cursor.'])
+                return self.response_body.get_page_response(results=results, next_cursor=next_cursor)
+            results = process_response(rule, User, id, redact_in_sql=current_app.config['REDACT_IN_SQL'])
+            if len(results) == 0:
+                return self.response_body.not_found_response(id)
+            return self.response_body.get_one_response(result=results[0])
         else:
             return self.response_body.custom_response(
                 status='Unauthorized', code=401,
                 messages=['This client is not authorized to access this resource. If you feel this is an error, please contact your administrator.'])
 
+    def check_request_body(self):
+        """Authorize a request with a body and reject bodies that include restricted fields.
+        Returns:
+            dict, int: The error response, or None if the request may proceed.
+        """
+
+        is_valid_request, rule = can_access()
+        if not is_valid_request:
+            return self.response_body.custom_response(
+                status='Unauthorized', code=401,
+                messages=['This client is not authorized to access this resource. If you feel this is an error, please contact your administrator.'])
+        buffer_size = current_app.config['REQUEST_BODY_BUFFER_SIZE']
+        if request.content_length is None:
+            # the length of a chunked body is only known once it has been read
+            body = buffer_body(request.stream, buffer_size)
+        elif request.content_length <= buffer_size:
+            body = request.get_data(cache=True)
+        else:
+            body = request.stream
+        if isinstance(body, bytes) and len(body) == 0:
+            return self.response_body.empty_request_body_response()
+        try:
+            # small bodies are checked in one pass; larger ones are decoded from the stream a record at a time
+            process_request(rule, body)
+        except RestrictedFieldError as error:
+            return self.response_body.custom_response(status='Error', code=400, messages=[str(error)])
+        except ValueError:
+            return self.response_body.custom_response(status='Error', code=400, messages=['Malformed request body.'])
+        return None
+
     def post(self, id=None):
-        pass
+        rejected = self.check_request_body()
+        if rejected is not None:
+            return rejected
 
     def put(self, id: str = None):
-        pass
+        rejected = self.check_request_body()
+        if rejected is not None:
+            return rejected
 
     def patch(self, id: str = None):
-        pass
+        rejected = self.check_request_body()
+        if rejected is not None:
+            return rejected
 
     def delete(self, id: str = None):
         pass
@@ -41,4 +99,19 @@ class UserResource(Resource):
 
 user_bp = Blueprint('user_ep', __name__)
 user_api = Api(user_bp)
+
+
+@user_api.representation('application/json')
+def timed_output_json(data, code, headers=None):
+    """Encode a JSON response, timing the encoding."""
+
+    with timings.span('encode'):
+        if isinstance(data, Envelope) and not current_app.debug:
+            # response bodies are serialized from their templates; debug mode indents them instead
+            response = make_response(encode_envelope(data) + '\n', code)
+            response.headers.extend(headers or {})
+            return response
+        return output_json(data, code, headers)
+
+
 user_api.add_resource(UserResource, '/users', '/users/<string:id>')
@@ -0,0 +1,179 @@
+"""Strawman ASGI API
+
+An asynchronous variant of the user API for ASGI servers such as uvicorn. It
+authorizes requests with the same compiled policies and caches as the Flask
+API and returns the same ``ResponseBody`` envelopes, but awaits database round
+trips instead of blocking a worker on them.
+
+The API is read-only: users are only served to GET requests, and every other
+method is answered with 405 once its request body has been read and discarded.
+"""
+
+import re
+import asyncio
+from collections import namedtuple
+from urllib.parse import parse_qs
+from werkzeug.sansio.utils import get_current_url
+from strawman.db import User
+from strawman.middleware.async_middleware import async_can_access, async_process_response, async_paginate_response
+from strawman.middleware.pagination import InvalidCursorError
+from strawman.utilities import ResponseBody, timings
+from strawman.utilities.responses import encode_envelope
+
+# /users and /users/<id>, with an optional trailing slash.
+USER_ROUTE = re.compile(r'^/users(?:/([^/]+))?/?$')
+
+AsgiRequest = namedtuple('AsgiRequest', ['method', 'url', 'headers', 'args'])
+
+
+def asgi_request(scope: dict):
+    """Describe an HTTP request from its ASGI connection scope.
+
+    The URL is built by Werkzeug as it builds ``request.url``, so rules match the
+    same URLs under both APIs.
+
+    Args:
+        scope (dict): The ASGI connection scope.
+    Returns:
+        AsgiRequest: The method, full URL, headers (lower-cased names) and first value of each query argument.
+    """
+
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    host = headers.get('host')
+    if host is None and scope.get('server') is not None:
+        host = '{}:{}'.format(*scope['server'])
+    query_string = scope.get('query_string', b'')
+    url = get_current_url(scope.get('scheme', 'http'), host or 'localhost', scope.get('root_path', ''), scope['path'],
+                          query_string)
+    query_string = query_string.decode('latin-1')
+    args = {key: values[0] for key, values in parse_qs(query_string, keep_blank_values=True).items()}
+    return AsgiRequest(scope['method'], url, headers, args)
+
+
+async def drain_body(receive):
+    """Read and discard the body of an HTTP request.
+
+    A request is only answered once its body has been received, so that the
+    server does not reset a connection on which a client is still sending.
+
+    Args:
+        receive (function): The ASGI receive callable of the request.
+    """
+
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request' or not message.get('more_body', False):
+            return
+
+
+class AsyncUserResource(object):
+    """An asynchronous user resource.
+
+    Attributes:
+        database (obj): The asynchronous database.
+        config (dict): The application configuration.
+    """
+
+    def __init__(self, database, config: dict):
+        self.database = database
+        self.config = config
+        self.response_body = ResponseBody()
+
+    async def get(self, request: AsgiRequest, id: str = None):
+        is_valid_request, rule = await async_can_access(
+            self.database, request.headers.get('authorization'), request.url, request.method)
+        if not is_valid_request:
+            return self.response_body.custom_response(
+                status='Unauthorized', code=401,
+                messages=['This client is not authorized to access this resource. If you feel this is an error, please contact your administrator.'])
+        if id is None:
+            try:
+                limit = min(int(request.args.get('limit', self.config['PAGE_SIZE_DEFAULT'])),
+                            self.config['PAGE_SIZE_MAX'])
+                results, next_cursor = await async_paginate_response(
+                    self.database, rule, User, limit=max(limit, 1), cursor=request.args.get('cursor'),
+                    redact_in_sql=self.config['REDACT_IN_SQL'])
+            except (ValueError, InvalidCursorError):
+                return self.response_body.custom_response(
+                    status='Error', code=400, messages=['Invalid pagination limit or cursor.'])
+            return self.response_body.get_page_response(results=results, next_cursor=next_cursor)
+        results = await async_process_response(self.database, rule, User, id,
+                                               redact_in_sql=self.config['REDACT_IN_SQL'])
+        if len(results) == 0:
+            return self.response_body.not_found_response(id)
+        return self.response_body.get_one_response(result=results[0])
+
+
+class StrawmanASGI(object):
+    """The ASGI application serving the user API.
+
+    The database is connected on lifespan startup and disconnected on shutdown;
+    servers without lifespan support connect it on the first request.
+
+    Attributes:
+        database (obj): The asynchronous database.
+        config (dict): The application configuration.
+    """
+
+    def __init__(self, database, config: dict):
+        self.database = database
+        self.config = config
+        self.users = AsyncUserResource(database, config)
+        self._connected = False
+        self._connecting = None
+
+    async def connect(self):
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if not self._connected:
+                await self.database.connect()
+                self._connected = True
+
+    async def disconnect(self):
+        if self._connected:
+            await self.database.disconnect()
+            self._connected = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.connect()
+                except Exception as error:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.disconnect()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        await self.connect()
+        request = asgi_request(scope)
+        route = USER_ROUTE.match(scope['path'])
+        if route is None:
+            body, code = self.users.response_body.custom_response(
+                status='Error', code=404, messages=['The requested URL was not found on the server.'])
+        elif request.method == 'GET':
+            body, code = await self.users.get(request, route.group(1))
+        else:
+            await drain_body(receive)
+            body, code = self.users.response_body.method_not_allowed_response()
+
+        with timings.span('encode'):
+            content = (encode_envelope(body) + '\n').encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': code,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode('ascii'))]
+        })
+        await send({'type': 'http.response.body', 'body': content})
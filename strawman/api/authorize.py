@@ -0,0 +1,50 @@
+"""Batch Authorization API"""
+
+from flask import Blueprint, current_app, request
+from flask_restful import Api, Resource
+from strawman.api.api import timed_output_json
+from strawman.middleware.auth_middleware import can_access
+from strawman.middleware.decisions import authorize_batch
+from strawman.utilities import ResponseBody
+
+
+class BatchAuthorizationResource(Resource):
+    """Authorization decisions for many requests at once, for API gateways.
+
+    The gateway authenticates with its own bearer token, whose client must hold
+    a rule allowing ``POST`` on this endpoint.
+    """
+
+    def __init__(self):
+        self.response_body = ResponseBody()
+
+    def post(self):
+        if not can_access()[0]:
+            return self.response_body.custom_response(
+                status='Unauthorized', code=401,
+                messages=['This client is not authorized to access this resource. If you feel this is an error, please contact your administrator.'])
+
+        body = request.get_json(silent=True)
+        if not body:
+            return self.response_body.empty_request_body_response()
+
+        items = body.get('requests') if isinstance(body, dict) else None
+        if not isinstance(items, list) or not all(
+                isinstance(item, dict) and all(isinstance(item.get(key), str) for key in ('token', 'url', 'method'))
+                for item in items):
+            return self.response_body.custom_response(
+                status='Error', code=400, messages=['Each request must have a token, url and method.'])
+        if len(items) > current_app.config['AUTHORIZE_BATCH_MAX']:
+            return self.response_body.custom_response(
+                status='Error', code=400,
+                messages=['At most {} requests may be authorized at once.'.format(
+                    current_app.config['AUTHORIZE_BATCH_MAX'])])
+
+        decisions = authorize_batch([(item['token'], item['url'], item['method']) for item in items])
+        return self.response_body.get_all_response(results=decisions, message='Successfully authorized requests')
+
+
+authorize_bp = Blueprint('authorize_ep', __name__)
+authorize_api = Api(authorize_bp)
+authorize_api.representation('application/json')(timed_output_json)
+authorize_api.add_resource(BatchAuthorizationResource, '/authorize/batch')
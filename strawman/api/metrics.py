@@ -0,0 +1,13 @@
+"""Metrics Endpoint"""
+
+from flask import Blueprint, Response
+from strawman.utilities import timings
+
+metrics_bp = Blueprint('metrics_ep', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Expose the request phase histograms in the Prometheus text format."""
+
+    return Response(timings.render(), mimetype='text/plain; version=0.0.4')
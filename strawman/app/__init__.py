@@ -1 +1 @@
-from strawman.app.app import create_app
+from strawman.app.app import create_app, create_asgi_app
@@ -1 +1,7 @@
-from strawman.db.models import db, User, Role, Client, Token
+from strawman.db.models import db, User, Role, Client, Token, hash_token
+from strawman.db.engines import REPLICA_BIND, engine_options, discard_connections_after_fork, has_replica,\
+    read_engine, read_connection
+from strawman.db.queries import TOKEN_POLICY_QUERY, TOKENS_POLICY_QUERY, TOKEN_VERSION_QUERY, TOKENS_VERSION_QUERY,\
+    load_token_policies, load_tokens_policies, purge_expired_tokens
+from strawman.db.maintenance import TokenPurger
+from strawman.db.async_database import AsyncpgDatabase, ThreadPoolDatabase, create_async_database
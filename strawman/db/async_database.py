@@ -0,0 +1,156 @@
+"""Asynchronous Database Access.
+
+The asynchronous authorization path executes the same SQLAlchemy Core
+statements as the synchronous one through one of two backends:
+
+- ``AsyncpgDatabase`` compiles statements for PostgreSQL and runs them on an
+  asyncpg connection pool, so no thread is blocked while a query is in flight.
+- ``ThreadPoolDatabase`` runs statements on a regular SQLAlchemy engine in a
+  thread pool. It works with any database SQLAlchemy supports and is used when
+  asyncpg is not installed.
+
+asyncpg is an optional dependency.
+"""
+
+import re
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
+
+from strawman.utilities.cache import LRUCache
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover
+    asyncpg = None
+
+# Compiled statements render parameters as :1, :2, ...; asyncpg expects $1, $2, ...
+_NUMERIC_PARAMETER = re.compile(r'(?<![:\w]):(\d+)')
+
+_POSTGRES_DIALECT = postgresql.dialect(paramstyle='numeric')
+
+
+def _row_type(statement):
+    return namedtuple('Row', [column.key for column in statement.columns], rename=True)
+
+
+class AsyncpgDatabase(object):
+    """Executes Core statements on an asyncpg connection pool.
+
+    Attributes:
+        url (str): The PostgreSQL database URL.
+        min_size (int): The number of connections opened when the pool is created.
+        max_size (int): The maximum number of connections in the pool.
+    """
+
+    def __init__(self, url: str, min_size: int = 1, max_size: int = 10):
+        if asyncpg is None:
+            raise ImportError('The asyncpg database backend requires asyncpg.')
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+        # the asyncpg form and row type of each distinct SQL text; most requests repeat a few of them
+        self._rewritten = LRUCache(maxsize=128)
+
+    async def connect(self):
+        url = make_url(self.url)
+        self._pool = await asyncpg.create_pool(
+            host=url.host, port=url.port, user=url.username, password=url.password, database=url.database,
+            min_size=self.min_size, max_size=self.max_size)
+
+    async def disconnect(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def compile(self, statement):
+        """Compile a statement to PostgreSQL with asyncpg parameter markers.
+        Args:
+            statement (obj): The Core statement.
+        Returns:
+            str, tuple, dict, type: The SQL text, the parameter names in order, the bound parameter values and the
+            row type of the results.
+        """
+
+        compiled = statement.compile(dialect=_POSTGRES_DIALECT)
+        entry = self._rewritten.get(compiled.string)
+        if entry is None:
+            # statements are rebuilt on every request, so the rewrite is cached by SQL text, not by statement
+            entry = (_NUMERIC_PARAMETER.sub(r'$\1', compiled.string), _row_type(statement))
+            self._rewritten.set(compiled.string, entry)
+        return entry[0], tuple(compiled.positiontup), compiled.params, entry[1]
+
+    async def fetch_all(self, statement, parameters: dict = None):
+        """Execute a statement and fetch every row.
+        Args:
+            statement (obj): The Core statement.
+            parameters (dict): Values for the statement's unbound parameters.
+        Returns:
+            list: The rows, as named tuples.
+        """
+
+        sql, names, bound, row_type = self.compile(statement)
+        values = dict(bound, **(parameters or {}))
+        async with self._pool.acquire() as connection:
+            records = await connection.fetch(sql, *[values[name] for name in names])
+        return [row_type(*record.values()) for record in records]
+
+
+class ThreadPoolDatabase(object):
+    """Executes Core statements on a SQLAlchemy engine in a thread pool.
+
+    Attributes:
+        url (str): The database URL.
+        max_workers (int): The number of threads, and so the number of statements executed at once.
+    """
+
+    def __init__(self, url: str, max_workers: int = 10):
+        self.url = url
+        self.max_workers = max_workers
+        self._engine = None
+        self._executor = None
+
+    async def connect(self):
+        self._engine = create_engine(self.url)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='database')
+
+    async def disconnect(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._engine.dispose()
+            self._executor = None
+            self._engine = None
+
+    def _fetch_all(self, statement, parameters: dict):
+        with self._engine.connect() as connection:
+            return connection.execute(statement, **parameters).fetchall()
+
+    async def fetch_all(self, statement, parameters: dict = None):
+        """Execute a statement and fetch every row.
+        Args:
+            statement (obj): The Core statement.
+            parameters (dict): Values for the statement's unbound parameters.
+        Returns:
+            list: The rows.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._fetch_all, statement, parameters or {})
+
+
+def create_async_database(url: str, pool_size: int = 10):
+    """Choose the asynchronous backend for a database.
+    Args:
+        url (str): The database URL.
+        pool_size (int): The maximum number of concurrent connections.
+    Returns:
+        obj: An AsyncpgDatabase for PostgreSQL when asyncpg is installed, otherwise a ThreadPoolDatabase.
+    """
+
+    if asyncpg is not None and make_url(url).get_backend_name() == 'postgresql':
+        return AsyncpgDatabase(url, max_size=pool_size)
+    return ThreadPoolDatabase(url, max_workers=pool_size)
@@ -0,0 +1,105 @@
+"""Database Engines and Read Routing.
+
+Every gunicorn worker process owns its own connection pool, so pool settings
+are per worker: a deployment opens up to ``workers * (pool_size + max_overflow)``
+connections to each database.
+
+Read-only lookups made while authorizing and answering requests -- token and
+role resolution and the response queries -- can be routed to a read replica
+bound as ``replica``. Everything else, including every write, uses the primary.
+"""
+
+import os
+from flask import current_app
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+
+from strawman.db.models import db
+
+# The name of the read replica in SQLALCHEMY_BINDS.
+REPLICA_BIND = 'replica'
+
+
+def engine_options(url: str, pool_size: int = 5, max_overflow: int = 10, pool_timeout: float = 30,
+                   pool_recycle: int = 1800, pool_pre_ping: bool = True, statement_timeout: int = 0):
+    """Build the engine options for a database.
+    Args:
+        url (str): The database URL.
+        pool_size (int): The number of connections kept open per process.
+        max_overflow (int): The number of connections opened beyond ``pool_size`` under load, closed when returned.
+        pool_timeout (float): The seconds to wait for a connection when the pool is exhausted.
+        pool_recycle (int): The age in seconds after which a connection is replaced; -1 keeps connections forever.
+        pool_pre_ping (bool): Test connections when they are checked out, replacing those the server has closed.
+        statement_timeout (int): The milliseconds after which PostgreSQL cancels a statement; 0 disables the timeout.
+    Returns:
+        dict: Keyword arguments for ``create_engine``. SQLite databases are not pooled by size, so they only get
+        ``pool_pre_ping``.
+    """
+
+    options = {'pool_pre_ping': pool_pre_ping}
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return options
+    options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+                   pool_recycle=pool_recycle)
+    if backend == 'postgresql' and statement_timeout > 0:
+        options['connect_args'] = {'options': '-c statement_timeout={:d}'.format(statement_timeout)}
+    return options
+
+
+def discard_connections_after_fork(engine):
+    """Keep a process from using pooled connections it inherited from its parent.
+
+    Under ``gunicorn --preload`` the master may open connections, for example
+    during warm startup, before forking workers. A connection inherited this way
+    is dropped without being closed, which would end the parent's session, and
+    the checkout is retried with a new connection.
+
+    Args:
+        engine (Engine): The engine whose pool is protected.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def record_process(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def check_process(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get('pid') != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('Connection record belongs to process {}, attempting to check out in '
+                                         'process {}.'.format(connection_record.info.get('pid'), os.getpid()))
+
+
+def has_replica(app=None):
+    """Whether read-only lookups are routed to a read replica.
+    Args:
+        app (Flask): The application; defaults to the current application.
+    Returns:
+        bool: True if a replica is bound.
+    """
+
+    app = app or current_app
+    return REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def read_engine():
+    """The engine for read-only lookups.
+    Returns:
+        Engine: The replica's engine if a replica is bound, otherwise the primary's.
+    """
+
+    return db.get_engine(bind=REPLICA_BIND if has_replica() else None)
+
+
+def read_connection():
+    """The session's connection to the database read-only lookups are routed to.
+
+    The connection belongs to the current session transaction, so it is
+    returned to its pool when the session is removed at the end of the request.
+
+    Returns:
+        Connection: A connection to the replica if one is bound, otherwise to the primary.
+    """
+
+    return db.session.connection(bind=read_engine())
@@ -0,0 +1,62 @@
+"""Background Database Maintenance."""
+
+import logging
+import threading
+
+from strawman.db.models import db
+from strawman.db.queries import purge_expired_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenPurger(object):
+    """Periodically deletes expired tokens on a background thread.
+
+    Attributes:
+        app (obj): The Flask application whose database is purged.
+        interval (float): The number of seconds between purges.
+        batch_size (int): The maximum number of tokens deleted per transaction.
+    """
+
+    def __init__(self, app, interval: float = 300, batch_size: int = 1000):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start purging on a daemon thread."""
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name='token-purger', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Ask the purger to stop, and wait for it to do so."""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.purge()
+
+    def purge(self):
+        """Delete every expired token.
+        Returns:
+            int: The number of tokens deleted.
+        """
+
+        with self.app.app_context():
+            try:
+                return purge_expired_tokens(self.batch_size)
+            except Exception:
+                logger.exception('Purging expired tokens failed.')
+                db.session.rollback()
+                return 0
+            finally:
+                db.session.remove()
@@ -1,5 +1,6 @@
 """Database Models."""
 
+import hashlib
 from uuid import uuid4
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
@@ -12,7 +13,8 @@ ma = Marshmallow()
 
 roles = db.Table('roles',
                  db.Column('client_id', db.String, db.ForeignKey('clients.id'), primary_key=True),
-                 db.Column('role_id', db.String, db.ForeignKey('oauth2_roles.id'), primary_key=True))
+                 db.Column('role_id', db.String, db.ForeignKey('oauth2_roles.id'), primary_key=True),
+                 db.Index('ix_roles_role_id', 'role_id'))
 
 
 class User(db.Model):
@@ -71,16 +73,36 @@ class Client(db.Model):
     __tablename__ = 'clients'
     id = db.Column(db.String, primary_key=True)
     client_name = db.Column(db.String)
-    client_id = db.Column(db.String)
+    client_id = db.Column(db.String, index=True)
     client_secret = db.Column(db.String)
     roles = db.relationship('Role', secondary=roles, lazy='subquery',
                             backref=db.backref('clients', lazy=True))
     tokens = db.relationship('Token')
 
 
+def hash_token(token: str):
+    """Compute the lookup key a bearer token is stored under.
+    Args:
+        token (str): The bearer token.
+    Returns:
+        str: The hex-encoded SHA-256 digest of the token.
+    """
+
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
 class Token(db.Model):
-    """A mock token."""
+    """A mock token.
+
+    Only the SHA-256 hash of the token is stored; it is the lookup key.
+    """
 
     __tablename__ = 'tokens'
-    token = db.Column(db.String, primary_key=True)
-    client_id = db.Column(db.String, db.ForeignKey('clients.id'))
+    token_hash = db.Column(db.String(64), primary_key=True)
+    client_id = db.Column(db.String, db.ForeignKey('clients.id'), index=True)
+    expires_at = db.Column(db.TIMESTAMP, index=True)
+
+    def __init__(self, token: str, client_id: str = None, expires_at: datetime = None):
+        self.token_hash = hash_token(token)
+        self.client_id = client_id
+        self.expires_at = expires_at
@@ -0,0 +1,116 @@
+"""Prepared Database Queries."""
+
+from datetime import datetime
+from sqlalchemy import select, bindparam
+
+from strawman.db.models import db, roles, Role, Client, Token, hash_token
+from strawman.db.engines import has_replica, read_connection
+
+# Compiled forms of the statements below, reused across executions.
+_compiled_cache = {}
+
+_TOKEN_VERSION_COLUMNS = [
+    Client.__table__.c.id.label('client_id'),
+    Token.__table__.c.expires_at,
+    Role.__table__.c.id.label('role_id'),
+    Role.__table__.c.date_last_updated
+]
+
+_TOKEN_POLICY_COLUMNS = _TOKEN_VERSION_COLUMNS + [Role.__table__.c.rules]
+
+_TOKEN_POLICY_JOIN = Token.__table__ \
+    .join(Client.__table__, Token.__table__.c.client_id == Client.__table__.c.id) \
+    .outerjoin(roles, roles.c.client_id == Client.__table__.c.id) \
+    .outerjoin(Role.__table__, Role.__table__.c.id == roles.c.role_id)
+
+# Resolve a bearer token hash to its expiry, its client and the rules of every role held by the client in one
+# round trip.
+TOKEN_POLICY_QUERY = select(_TOKEN_POLICY_COLUMNS).select_from(_TOKEN_POLICY_JOIN) \
+    .where(Token.__table__.c.token_hash == bindparam('token_hash'))
+
+# TOKEN_POLICY_QUERY for many token hashes at once, identifying the token of each row.
+TOKENS_POLICY_QUERY = select([Token.__table__.c.token_hash] + _TOKEN_POLICY_COLUMNS).select_from(_TOKEN_POLICY_JOIN) \
+    .where(Token.__table__.c.token_hash.in_(bindparam('token_hashes', expanding=True)))
+
+# TOKEN_POLICY_QUERY and TOKENS_POLICY_QUERY without the rules documents, for processes that compile roles from a
+# policy snapshot and only need their versions.
+TOKEN_VERSION_QUERY = select(_TOKEN_VERSION_COLUMNS).select_from(_TOKEN_POLICY_JOIN) \
+    .where(Token.__table__.c.token_hash == bindparam('token_hash'))
+
+TOKENS_VERSION_QUERY = select([Token.__table__.c.token_hash] + _TOKEN_VERSION_COLUMNS).select_from(_TOKEN_POLICY_JOIN) \
+    .where(Token.__table__.c.token_hash.in_(bindparam('token_hashes', expanding=True)))
+
+
+def load_token_policies(token: str, with_rules: bool = True):
+    """Load the client and role rules associated with a bearer token.
+    Args:
+        token (str): The bearer token.
+        with_rules (bool): Load the rules document of each role; otherwise only the role versions are loaded.
+    Returns:
+        list: One row of ``client_id``, ``expires_at``, ``role_id``, ``date_last_updated`` and ``rules`` (if
+        requested) per role held by the client. A client without roles yields a single row with empty role columns;
+        an unknown token yields no rows.
+    """
+
+    query = TOKEN_POLICY_QUERY if with_rules else TOKEN_VERSION_QUERY
+    token_hash = hash_token(token)
+    connection = read_connection().execution_options(compiled_cache=_compiled_cache)
+    rows = connection.execute(query, token_hash=token_hash).fetchall()
+    if len(rows) == 0 and has_replica():
+        # a token issued moments ago may not have reached the replica yet
+        connection = db.session.connection().execution_options(compiled_cache=_compiled_cache)
+        rows = connection.execute(query, token_hash=token_hash).fetchall()
+    return rows
+
+
+def load_tokens_policies(token_hashes, with_rules: bool = True):
+    """Load the client and role rules associated with many bearer tokens in one query.
+    Args:
+        token_hashes (iterable): The hashes of the bearer tokens.
+        with_rules (bool): Load the rules document of each role; otherwise only the role versions are loaded.
+    Returns:
+        dict: The rows of ``load_token_policies`` for each token hash, with an additional ``token_hash`` column.
+        Unknown tokens are absent.
+    """
+
+    query = TOKENS_POLICY_QUERY if with_rules else TOKENS_VERSION_QUERY
+    token_hashes = list(token_hashes)
+    policies = {}
+    if len(token_hashes) == 0:
+        return policies
+    connection = read_connection().execution_options(compiled_cache=_compiled_cache)
+    for row in connection.execute(query, token_hashes=token_hashes):
+        policies.setdefault(row.token_hash, []).append(row)
+    missing = [token_hash for token_hash in token_hashes if token_hash not in policies]
+    if len(missing) > 0 and has_replica():
+        # tokens issued moments ago may not have reached the replica yet
+        connection = db.session.connection().execution_options(compiled_cache=_compiled_cache)
+        for row in connection.execute(query, token_hashes=missing):
+            policies.setdefault(row.token_hash, []).append(row)
+    return policies
+
+
+def purge_expired_tokens(batch_size: int = 1000, now: datetime = None):
+    """Delete expired tokens in batches, committing after each batch.
+
+    Small batches keep each transaction short, so the purge never holds locks
+    on a large part of the table. Deleting an expired token sends no change
+    notification; cached tokens are already checked against their expiry.
+
+    Args:
+        batch_size (int): The maximum number of tokens deleted per transaction.
+        now (datetime): The time tokens are compared against; defaults to the current UTC time.
+    Returns:
+        int: The number of tokens deleted.
+    """
+
+    tokens = Token.__table__
+    expired = select([tokens.c.token_hash]).where(tokens.c.expires_at <= (now or datetime.utcnow())) \
+        .limit(batch_size)
+    purged = 0
+    while True:
+        deleted = db.session.execute(tokens.delete().where(tokens.c.token_hash.in_(expired))).rowcount
+        db.session.commit()
+        purged += deleted
+        if deleted < batch_size:
+            return purged
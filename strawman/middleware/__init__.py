@@ -1,2 +1,14 @@
 from strawman.middleware.auth_middleware import protected_resource, can_access,\
-    process_request, process_response
+    process_request, process_response, response_query, paginate_response, stream_response,\
+    verify_client_token_and_scopes, invalidate_token, token_cache, decision_cache, invalidate_role_decisions
+from strawman.middleware.policy import CompiledRule, CompiledPolicy, PolicyCache, policy_cache,\
+    compile_rule, compile_policy, merge_rules
+from strawman.middleware.matcher import RuleIndex
+from strawman.middleware.pagination import InvalidCursorError
+from strawman.middleware.request_body import RestrictedFieldError
+from strawman.middleware.invalidation import PolicyChangeListener, handle_notification, start_policy_listener
+from strawman.middleware.snapshot import PolicySnapshot, SnapshotStore, SnapshotError, build_snapshot, write_snapshot,\
+    current_generation, open_snapshot, preload_policies
+from strawman.middleware.async_middleware import async_can_access, async_verify_client_token_and_scopes,\
+    async_load_client_policies, async_process_response, async_paginate_response
+from strawman.middleware.decisions import authorize_batch, load_clients_policies, rule_effects
@@ -0,0 +1,101 @@
+"""Asynchronous Auth Middleware.
+
+Coroutine counterparts of the request authorization and response functions in
+``auth_middleware``. They build the same statements, share the token and policy
+caches and match requests with the same compiled rule index; only the database
+round trips are awaited, on a database from ``strawman.db.async_database``.
+"""
+
+from strawman.utilities import timings
+from strawman.db import hash_token, TOKEN_POLICY_QUERY, TOKEN_VERSION_QUERY
+from strawman.middleware.policy import policy_cache
+from strawman.middleware.auth_middleware import response_query, page_query, cached_client_policies,\
+    client_policies_from_rows, policies_cached, match_rule, bearer_token
+
+
+async def async_load_client_policies(database, token: str):
+    """Resolve a bearer token to the compiled policies of the client holding it.
+    Args:
+        database (obj): The asynchronous database.
+        token (str): The bearer token.
+    Returns:
+        list: The client's compiled policies, or None if the token or client is unknown or the token has expired.
+    """
+
+    token_hash = hash_token(token)
+    cached, policies = cached_client_policies(token_hash)
+    if cached:
+        return policies
+    if policy_cache.snapshots is not None:
+        # roles are compiled from the snapshot, so their rules are only loaded when it lacks one of them
+        rows = await database.fetch_all(TOKEN_VERSION_QUERY, {'token_hash': token_hash})
+        if policies_cached(rows):
+            return client_policies_from_rows(token_hash, rows)
+    rows = await database.fetch_all(TOKEN_POLICY_QUERY, {'token_hash': token_hash})
+    return client_policies_from_rows(token_hash, rows)
+
+
+async def async_verify_client_token_and_scopes(database, token: str, url: str, method: str):
+    """Decide whether a bearer token permits a request, and which rule governs it.
+    Args:
+        database (obj): The asynchronous database.
+        token (str): The bearer token.
+        url (str): The full URL of the request.
+        method (str): The HTTP method of the request.
+    Returns:
+        bool, CompiledRule: Whether access is allowed, and the effective rule governing it (None if denied).
+    """
+
+    with timings.span('token'):
+        client_scopes = await async_load_client_policies(database, token)
+    return match_rule(client_scopes, url, method)
+
+
+async def async_can_access(database, authorization: str, url: str, method: str):
+    """Authorize a request from its Authorization header.
+    Args:
+        database (obj): The asynchronous database.
+        authorization (str): The value of the Authorization header, or None.
+        url (str): The full URL of the request.
+        method (str): The HTTP method of the request.
+    Returns:
+        bool, CompiledRule: Whether access is allowed, and the effective rule governing it (None if denied).
+    """
+
+    token = bearer_token(authorization)
+    if token is None:
+        return False, None
+
+    try:
+        return await async_verify_client_token_and_scopes(database, token, url, method)
+    except Exception:
+        return False, None
+
+
+async def async_process_response(database, ruleset, model, id=None, redact_in_sql=False):
+    statement, redact_batch = response_query(ruleset, model, id, redact_in_sql)
+    with timings.span('sql'):
+        rows = await database.fetch_all(statement)
+    with timings.span('redact'):
+        return redact_batch(rows)
+
+
+async def async_paginate_response(database, ruleset, model, limit: int, cursor: str = None, redact_in_sql=False):
+    """Retrieve one page of a rule's view of a model using keyset pagination.
+    Args:
+        database (obj): The asynchronous database.
+        ruleset (CompiledRule or dict): The rule governing the response.
+        model (obj): The SQLAlchemy model being queried.
+        limit (int): The maximum number of rows on the page.
+        cursor (str): The cursor returned with the previous page, or None for the first page.
+        redact_in_sql (bool): Apply redaction in the database rather than in Python.
+    Returns:
+        list, str: The response dicts of the page, and the cursor of the next page or None if this is the last.
+    Raises:
+        InvalidCursorError: If the cursor is malformed or was issued under a different rule.
+    """
+
+    statement, finish_page = page_query(ruleset, model, limit, cursor, redact_in_sql)
+    with timings.span('sql'):
+        rows = await database.fetch_all(statement)
+    return finish_page(rows)
@@ -2,131 +2,418 @@
 
 import re
 import json
+from datetime import datetime
 from functools import wraps
 from flask import request
-from sqlalchemy import text
-
-from strawman.utilities import ResponseBody
-from strawman.db import Client, Role, User, Token
-
-
-def process_request(rules):
-    pass
-
-
-def process_response(ruleset, model, id=None):
-    responses = []
-    restricted_fields = []
-    redacted_fields = []
-    filters = []
-    filter = 'not '
-
-    if 'restricted_fields' in ruleset.keys():
-        for restricted_field in ruleset['restricted_fields']:
-            if restricted_field['response']:
-                restricted_fields.append(restricted_field['field'])
-
-    if 'redacted_fields' in ruleset.keys():
-        for redacted_field in ruleset['redacted_fields']:
-            redacted_fields.append(redacted_field['field'])
-
-    if 'access_policies' in ruleset.keys():
-        filters = ruleset['access_policies']
-        for idx, filter_part in enumerate(filters):
-            filter += filter_part['filter']
-            if idx < len(filters) - 1:
-                filter += ' and not '
-
-    results = model.query.filter(text(filter)).all()
-    for result in results:
-        result_map = {}
-
-        # This is horrible, define variables dynamically first so we can eval
-        for field in result.__dict__.keys():
-            locals()[field] = getattr(result, field)
-
-        for field in result.__dict__.keys():
-            if field != '_sa_instance_state':
-                if field in redacted_fields and field not in restricted_field:
-                    index = redacted_fields.index(field)
-                    filter = ruleset['redacted_fields'][index]['filter']
-                    if filter == '*' or (eval(filter)):
-                        result_map[field] = '**********'
-                    else:
-                        result_map[field] = getattr(result, field)
-                elif field not in restricted_fields:
-                    result_map[field] = getattr(result, field)
-        responses.append(result_map)
-    return responses
+from sqlalchemy import select
+
+from strawman.utilities import ResponseBody, LRUCache, timings
+from strawman.db import db, hash_token, load_token_policies, read_engine
+from strawman.middleware.policy import compile_rule, merge_rules, policy_cache
+from strawman.middleware.vectorized import vectorized_query
+from strawman.middleware.request_body import CHUNK_SIZE, RestrictedFieldError, iter_records, first_restricted_field
+from strawman.middleware.pagination import rule_fingerprint, encode_cursor, decode_cursor
+from strawman.middleware.redaction import model_columns, projected_fields, redaction_columns, row_filter,\
+    batch_redactor, sql_redactor
+
+# Bearer token hash -> (client id, ((role id, role version), ...), expiry)
+token_cache = LRUCache(maxsize=10000, ttl=300)
+
+# (((role id, role version), ...), url, method) -> (allowed, governing rule)
+decision_cache = LRUCache(maxsize=100000)
+
+
+def process_request(ruleset, body, chunk_size: int = CHUNK_SIZE):
+    """Reject a request body that includes a field the rule restricts from requests.
+
+    Bodies given as file-like objects are decoded one record at a time and stop
+    being read at the first restricted field, so bulk uploads are checked in
+    bounded memory. Nothing is decoded when the rule restricts no request fields.
+
+    Args:
+        ruleset (CompiledRule or dict): The rule governing the request.
+        body (bytes, str, dict, list or file): The request body, a single record or a list of records.
+        chunk_size (int): The number of bytes read at a time from file-like bodies.
+    Raises:
+        RestrictedFieldError: For the first restricted field found.
+        ValueError: If the body is empty, malformed or holds records that are not objects.
+    """
+
+    restricted_fields = compile_rule(ruleset).restricted_request_fields
+    if len(restricted_fields) == 0:
+        return
+    if hasattr(body, 'read'):
+        records = iter_records(body, chunk_size)
+    else:
+        if isinstance(body, (str, bytes)):
+            body = json.loads(body)
+        records = body if isinstance(body, list) else [body]
+    for record in records:
+        field = first_restricted_field(record, restricted_fields)
+        if field is not None:
+            raise RestrictedFieldError(field)
+
+
+def response_query(ruleset, model, id=None, redact_in_sql=False):
+    """Build the statement for a rule's view of a model and the function that redacts its rows.
+    Args:
+        ruleset (CompiledRule or dict): The rule governing the response.
+        model (obj): The SQLAlchemy model being queried.
+        id (str): The identifier of a single record to retrieve.
+        redact_in_sql (bool): Apply redaction in the database rather than in Python.
+    Returns:
+        Select, function: The Core statement selecting the permitted rows and columns as plain tuples, and a function
+        turning a batch of its rows into response dicts.
+    """
+
+    rule = compile_rule(ruleset)
+    columns = model_columns(model)
+
+    if redact_in_sql:
+        # the database returns rows with restricted fields removed and redactions applied
+        projection = redaction_columns(rule, model)
+        statement = select(projection)
+        redact_batch = sql_redactor(projection)
+    else:
+        # select only the columns the rule allows, and redact them column by column
+        fetched_fields, visible_fields = projected_fields(rule, model)
+        statement = select([columns[field] for field in fetched_fields])
+        redact_batch = batch_redactor(rule, fetched_fields, visible_fields)
+
+    access_filter = row_filter(rule.access_policies, model)
+    if access_filter is not None:
+        statement = statement.where(access_filter)
+    if id is not None:
+        statement = statement.where(columns['id'] == id)
+    return statement, redact_batch
+
+
+def process_response(ruleset, model, id=None, redact_in_sql=False):
+    statement, redact_batch = response_query(ruleset, model, id, redact_in_sql)
+    with timings.span('sql'):
+        rows = db.session.execute(statement, bind=read_engine()).fetchall()
+    with timings.span('redact'):
+        return redact_batch(rows)
+
+
+def page_query(ruleset, model, limit: int, cursor: str = None, redact_in_sql=False):
+    """Build the statement for one page of a rule's view of a model and the function that turns its rows into a page.
+    Args:
+        ruleset (CompiledRule or dict): The rule governing the response.
+        model (obj): The SQLAlchemy model being queried.
+        limit (int): The maximum number of rows on the page.
+        cursor (str): The cursor returned with the previous page, or None for the first page.
+        redact_in_sql (bool): Apply redaction in the database rather than in Python.
+    Returns:
+        Select, function: The Core statement, and a function turning its rows into the response dicts of the page
+        and the cursor of the next page (None if this is the last).
+    Raises:
+        InvalidCursorError: If the cursor is malformed or was issued under a different rule.
+    """
+
+    rule = compile_rule(ruleset)
+    fingerprint = rule_fingerprint(rule)
+    primary_key = model.__mapper__.primary_key[0]
+    statement, redact_batch = response_query(rule, model, redact_in_sql=redact_in_sql)
+
+    # the primary key is selected last so it is available even when restricted from the response
+    statement = statement.column(primary_key.label('cursor_key'))
+    if cursor is not None:
+        statement = statement.where(primary_key > decode_cursor(cursor, fingerprint))
+
+    def finish_page(rows):
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][-1], fingerprint)
+        with timings.span('redact'):
+            return redact_batch(rows), next_cursor
+
+    return statement.order_by(primary_key).limit(limit + 1), finish_page
+
+
+def paginate_response(ruleset, model, limit: int, cursor: str = None, redact_in_sql=False):
+    """Retrieve one page of a rule's view of a model using keyset pagination.
+    Args:
+        ruleset (CompiledRule or dict): The rule governing the response.
+        model (obj): The SQLAlchemy model being queried.
+        limit (int): The maximum number of rows on the page.
+        cursor (str): The cursor returned with the previous page, or None for the first page.
+        redact_in_sql (bool): Apply redaction in the database rather than in Python.
+    Returns:
+        list, str: The response dicts of the page, and the cursor of the next page or None if this is the last.
+    Raises:
+        InvalidCursorError: If the cursor is malformed or was issued under a different rule.
+    """
+
+    statement, finish_page = page_query(ruleset, model, limit, cursor, redact_in_sql)
+    with timings.span('sql'):
+        rows = db.session.execute(statement, bind=read_engine()).fetchall()
+    return finish_page(rows)
+
+
+def stream_response(ruleset, model, batch_size: int = 1000, redact_in_sql=False, vectorized=False):
+    """Yield the rows of a rule's view of a model without materializing the whole result.
+
+    Rows are read from a server-side cursor and redacted one batch at a time, so
+    memory use is bounded by the batch size rather than the size of the table.
+
+    Args:
+        ruleset (CompiledRule or dict): The rule governing the response.
+        model (obj): The SQLAlchemy model being queried.
+        batch_size (int): The number of rows fetched and redacted at a time.
+        redact_in_sql (bool): Apply redaction in the database rather than in Python.
+        vectorized (bool): Apply access policies and redaction with the NumPy engine. Takes precedence over
+            redact_in_sql.
+    Returns:
+        generator: The response dicts, one per row.
+    """
+
+    if vectorized:
+        statement, redact_batch = vectorized_query(ruleset, model)
+    else:
+        statement, redact_batch = response_query(ruleset, model, redact_in_sql=redact_in_sql)
+    result = db.session.execute(statement.execution_options(stream_results=True), bind=read_engine())
+    try:
+        while True:
+            with timings.span('sql'):
+                batch = result.fetchmany(batch_size)
+            if len(batch) == 0:
+                break
+            with timings.span('redact'):
+                responses = redact_batch(batch)
+            for response in responses:
+                yield response
+    finally:
+        result.close()
+
+
+def load_client_policies(token: str):
+    """Resolve a bearer token to the compiled policies of the client holding it.
+
+    Tokens are cached under their hash with the client identifier, role versions
+    and expiry they resolved to, so repeated requests only touch the database when
+    the token is unknown, expired from the cache, or one of its roles has been
+    recompiled since. Expired tokens are rejected from the cached expiry.
+
+    Args:
+        token (str): The bearer token.
+    Returns:
+        list: The client's compiled policies, or None if the token or client is unknown or the token has expired.
+    """
+
+    token_hash = hash_token(token)
+    cached, policies = cached_client_policies(token_hash)
+    if cached:
+        return policies
+
+    if policy_cache.snapshots is not None:
+        # roles are compiled from the snapshot, so their rules are only loaded when it lacks one of them
+        rows = load_token_policies(token, with_rules=False)
+        if policies_cached(rows):
+            return client_policies_from_rows(token_hash, rows)
+
+    # resolve the token, its expiry, its client and the client's roles in a single query
+    return client_policies_from_rows(token_hash, load_token_policies(token))
+
+
+def cached_client_policies(token_hash: str):
+    """Resolve a bearer token hash from the token cache alone.
+    Args:
+        token_hash (str): The hash of the bearer token.
+    Returns:
+        bool, list: Whether the cache decided the lookup, and the client's compiled policies (None if the cached
+        token has expired). A token that is not cached, or whose roles have been recompiled since, is undecided.
+    """
+
+    entry = token_cache.get(token_hash)
+    if entry is None:
+        return False, None
+    if entry[2] is not None and entry[2] <= datetime.utcnow():
+        token_cache.invalidate(token_hash)
+        return True, None
+    policies = [policy_cache.get(role_id, version) for role_id, version in entry[1]]
+    if None in policies:
+        return False, None
+    return True, policies
+
+
+def policies_cached(rows):
+    """Check that the policy cache holds the roles of token policy rows loaded without their rules.
+
+    Roles missing from the cache are compiled from its policy snapshot when it
+    holds their current version.
+
+    Args:
+        rows (list): The rows of ``TOKEN_VERSION_QUERY`` for a token.
+    Returns:
+        bool: True if every role is cached at its current version.
+    """
+
+    return all(policy_cache.get(row.role_id, row.date_last_updated) is not None
+               for row in rows if row.role_id is not None)
+
+
+def client_policies_from_rows(token_hash: str, rows):
+    """Compile and cache the policies of a bearer token from the rows of the token policy query.
+    Args:
+        token_hash (str): The hash of the bearer token.
+        rows (list): The rows of ``TOKEN_POLICY_QUERY`` for the token, or of ``TOKEN_VERSION_QUERY`` if
+            ``policies_cached`` holds for them.
+    Returns:
+        list: The client's compiled policies, or None if the token or client is unknown, the token has expired or
+        a role loaded without its rules is no longer cached.
+    """
+
+    if len(rows) == 0:
+        return None
+    client_id, expires_at = rows[0].client_id, rows[0].expires_at
+    if expires_at is not None and expires_at <= datetime.utcnow():
+        return None
+
+    # get scopes held by client, in a stable order so clients holding the same roles share decisions
+    rows = sorted((row for row in rows if row.role_id is not None), key=lambda row: row.role_id)
+    if len(rows) > 0 and not hasattr(rows[0], 'rules'):
+        policies = [policy_cache.get(row.role_id, row.date_last_updated) for row in rows]
+        if None in policies:
+            return None
+    else:
+        policies = [policy_cache.load(row.role_id, row.date_last_updated, row.rules) for row in rows]
+    token_cache.set(token_hash, (
+        client_id, tuple((policy.role_id, policy.version) for policy in policies), expires_at))
+    return policies
+
+
+def invalidate_token(token: str):
+    """Revoke any cached verification of a bearer token.
+    Args:
+        token (str): The bearer token.
+    Returns:
+        bool: True if a cached entry was dropped.
+    """
+
+    return token_cache.invalidate(hash_token(token))
 
 
 def verify_client_token_and_scopes(token: str):
-    # determine if the token is valid
-    token = Token.query.filter_by(token=token).first()
-    if not token:
-        return False
-
-    # determine which client currently holds the token
-    client_id = token.client_id
-    client = Client.query.filter_by(id=client_id).first()
-    if not client:
-        return False
-
-    # get scopes held by client
-    client_scopes = client.roles
-    if len(client_scopes) == 0:
-        return False
-
-    # determine if scopes allow the kind of access requested
-    #
-    method_allowed = False
-    candidate_rules = []
-    for scope in client_scopes:
-        rules = json.loads(scope.rules)
-        for rule in rules['ruleset']:
-            _rule = rule['rule']
-            # evaluate the resource to see if the rule applies
-            if re.match(_rule['resource'], request.url):
-                # check if method is allowed
-                if request.method in _rule['allowed_methods'] or _rule['allowed_methods'][0] == '*':
-                    method_allowed = True
-                    candidate_rules.append(rule)
-                else:
-                    # important because we prefer to err on the side of no access if a contradictory rule is found
-                    method_allowed = False
-                    break
-    return method_allowed, candidate_rules[0]
+    with timings.span('token'):
+        client_scopes = load_client_policies(token)
+    return match_rule(client_scopes, request.url, request.method)
+
+
+def invalidate_role_decisions(role_id: str):
+    """Forget every cached decision made under a role.
+    Args:
+        role_id (str): The identifier of the role.
+    Returns:
+        int: The number of decisions dropped.
+    """
+
+    return decision_cache.invalidate_where(lambda key, decision: any(entry[0] == role_id for entry in key[0]))
+
+
+def resource_url(url: str):
+    """Strip the query string and fragment from a URL.
+    Args:
+        url (str): The full URL of a request.
+    Returns:
+        str: The URL of the requested resource.
+    """
+
+    return url.partition('?')[0].partition('#')[0]
+
+
+def match_rule(client_scopes, url: str, method: str):
+    """Decide whether a client's policies permit a request, and which rule governs it.
+
+    Rules govern resources, so they are matched against the URL without its
+    query string or fragment. Decisions are cached per combination of role
+    versions, resource URL and method, so clients holding the same roles share
+    them, and requests for other pages of the same resource reuse them. A role
+    that is recompiled has a new version, so decisions made under the old
+    version are never reused.
+
+    Args:
+        client_scopes (list): The client's compiled policies.
+        url (str): The full URL of the request.
+        method (str): The HTTP method of the request.
+    Returns:
+        bool, CompiledRule: Whether access is allowed, and the effective rule governing it (None if denied).
+    """
+
+    if not client_scopes:
+        return False, None
+
+    url = resource_url(url)
+    key = (tuple((policy.role_id, policy.version) for policy in client_scopes), url, method.upper())
+    with timings.span('match'):
+        decision = decision_cache.get(key)
+        if decision is None:
+            decision = walk_rules(client_scopes, url, method)
+            decision_cache.set(key, decision)
+    return decision
+
+
+def walk_rules(client_scopes, url: str, method: str):
+    """Decide a request from the rules of a client's policies that match its URL.
+
+    A request is allowed when at least one rule matches it and every matching
+    rule allows its method; we prefer to err on the side of no access if a
+    contradictory rule is found. The matching rules are merged into one effective
+    rule, computed once per combination of roles and matching rules.
+
+    Args:
+        client_scopes (list): The client's compiled policies.
+        url (str): The full URL of the request.
+        method (str): The HTTP method of the request.
+    Returns:
+        bool, CompiledRule: Whether access is allowed, and the effective rule governing it (None if denied).
+    """
+
+    index = policy_cache.index_for(client_scopes)
+    positions = index.match_positions(url)
+    if len(positions) == 0 or not all(index.entries[position][1].allows(method) for position in positions):
+        return False, None
+
+    rule = index.effective_rules.get(positions)
+    if rule is None:
+        rule = index.effective_rules.setdefault(
+            positions, merge_rules(index.entries[position][1] for position in positions))
+    return True, rule
+
+
+def bearer_token(authorization: str):
+    """Extract the token from an Authorization header.
+    Args:
+        authorization (str): The value of the header, or None.
+    Returns:
+        str: The bearer token, or None if the header is missing or not a bearer credential.
+    """
+
+    if not authorization:
+        return None
+
+    token = re.split('\\s+', authorization.strip())
+    if len(token) != 2 or str(token[0]).upper() != 'BEARER':
+        return None
+    return token[1]
 
 
 def can_access():
-    token = None
-    try:
-        token = request.headers.get('Authorization', None)
-        if token:
-            token = re.split('\\s+', token)
-            if len(token) != 2:
-                print('Invalid Bearer Token Header')
-            if str(token[0]).upper() == 'BEARER':
-                token = token[1]
-                if not verify_client_token_and_scopes(token):
-                    raise Exception('Invalid Token or Scope')
-            else:
-                raise Exception('No Bearer Token')
-        else:
-            raise Exception('No Access Token')
-    except Exception as e:
+    token = bearer_token(request.headers.get('Authorization', None))
+    if token is None:
         return False, None
 
-    if token:
+    try:
         return verify_client_token_and_scopes(token)
-    else:
+    except Exception:
         return False, None
 
 
 def protected_resource():
     def wrap(f):
         def wrapped_f(*args, **kwargs):
-            if can_access():
+            if can_access()[0]:
                 return f(*args, **kwargs)
             else:
                 return ResponseBody().custom_response(
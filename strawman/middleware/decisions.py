@@ -0,0 +1,88 @@
+"""Batch Authorization Decisions.
+
+Gateways ask for decisions on many ``(token, url, method)`` requests at once.
+Each distinct token is resolved once, from the token cache or from a single
+query for every token missing from it (two when a policy snapshot lacks some
+of their roles), and each request is then matched against the client's
+compiled rule index.
+"""
+
+from strawman.utilities import timings
+from strawman.db import hash_token, load_tokens_policies
+from strawman.middleware.policy import policy_cache
+from strawman.middleware.auth_middleware import cached_client_policies, client_policies_from_rows, policies_cached,\
+    match_rule
+
+
+def load_clients_policies(tokens):
+    """Resolve many bearer tokens to the compiled policies of the clients holding them.
+    Args:
+        tokens (iterable): The bearer tokens; repeated tokens are resolved once.
+    Returns:
+        dict: The client's compiled policies for each token, or None if the token or client is unknown or the token
+        has expired.
+    """
+
+    hashes = {token: hash_token(token) for token in set(tokens)}
+    policies = {}
+    undecided = set()
+    for token_hash in set(hashes.values()):
+        cached, token_policies = cached_client_policies(token_hash)
+        if cached:
+            policies[token_hash] = token_policies
+        else:
+            undecided.add(token_hash)
+
+    if policy_cache.snapshots is not None and len(undecided) > 0:
+        # roles are compiled from the snapshot, so rules are only loaded for tokens holding a role it lacks
+        rows = load_tokens_policies(undecided, with_rules=False)
+        for token_hash in list(undecided):
+            if policies_cached(rows.get(token_hash, [])):
+                policies[token_hash] = client_policies_from_rows(token_hash, rows.get(token_hash, []))
+                undecided.discard(token_hash)
+
+    rows = load_tokens_policies(undecided)
+    for token_hash in undecided:
+        policies[token_hash] = client_policies_from_rows(token_hash, rows.get(token_hash, []))
+    return {token: policies[token_hash] for token, token_hash in hashes.items()}
+
+
+def rule_effects(rule):
+    """Describe the restrictions a rule places on requests it governs.
+    Args:
+        rule (CompiledRule): The rule governing a request.
+    Returns:
+        dict: The fields restricted from request and response bodies, the redacted fields with their filters, and the
+        access policies.
+    """
+
+    return {
+        'restricted_fields': {
+            'request': sorted(rule.restricted_request_fields),
+            'response': sorted(rule.restricted_response_fields)
+        },
+        'redacted_fields': [{'field': field, 'filter': redaction_filter}
+                            for field, redaction_filter in rule.redacted_fields],
+        'access_policies': list(rule.access_policies)
+    }
+
+
+def authorize_batch(requests):
+    """Decide a batch of requests.
+    Args:
+        requests (list): ``(token, url, method)`` tuples.
+    Returns:
+        list: A decision per request, in order: whether it is allowed and, if so, the effects of the governing rule.
+    """
+
+    with timings.span('token'):
+        policies = load_clients_policies(token for token, _, _ in requests)
+
+    decisions = []
+    for token, url, method in requests:
+        allowed, rule = match_rule(policies[token], url, method)
+        decision = {'allowed': allowed}
+        if allowed:
+            decision.update(rule_effects(rule))
+        decisions.append(decision)
+    return decisions
@@ -0,0 +1,445 @@
+"""Filter Expressions.
+
+Redaction and access policy filters are written in a small expression language:
+
+    age >= 18 and age < 46
+    field6 != null
+    not (age < 18 or suffix is null)
+    *
+
+Expressions are parsed once into a tree of immutable nodes and compiled either
+into Python closures that evaluate the filter against row tuples, or into
+SQLAlchemy clauses with the same semantics.
+"""
+
+import re
+import operator
+from functools import lru_cache
+from collections import namedtuple
+from sqlalchemy import and_, or_, true, false
+
+
+class ExpressionError(ValueError):
+    """Raised when a filter expression cannot be parsed."""
+
+
+class _Node(object):
+    """Expression tree nodes compare equal only to nodes of the same kind."""
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + tuple(self))
+
+
+class Wildcard(_Node, namedtuple('Wildcard', [])):
+    """Matches every row (``*``)."""
+    __slots__ = ()
+
+
+class Field(_Node, namedtuple('Field', ['name'])):
+    """A reference to a row field."""
+    __slots__ = ()
+
+
+class Literal(_Node, namedtuple('Literal', ['value'])):
+    """A constant number, string, boolean or null."""
+    __slots__ = ()
+
+
+class Compare(_Node, namedtuple('Compare', ['op', 'left', 'right'])):
+    """A comparison between two operands."""
+    __slots__ = ()
+
+
+class And(_Node, namedtuple('And', ['operands'])):
+    """A conjunction of expressions."""
+    __slots__ = ()
+
+
+class Or(_Node, namedtuple('Or', ['operands'])):
+    """A disjunction of expressions."""
+    __slots__ = ()
+
+
+class Not(_Node, namedtuple('Not', ['operand'])):
+    """The negation of an expression."""
+    __slots__ = ()
+
+
+# Comparison operators and their Python implementations.
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+# Alternate spellings of the comparison operators.
+_OPERATOR_ALIASES = {'=': '==', '<>': '!='}
+
+_KEYWORDS = {'and', 'or', 'not', 'is', 'null', 'none', 'true', 'false'}
+
+_TOKENS = re.compile(r'''
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?)
+        |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+        |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+        |(?P<operator>==|!=|<>|<=|>=|<|>|=)
+        |(?P<punctuation>[()*])
+    )''', re.VERBOSE)
+
+
+def _tokenize(expression: str):
+    """Split an expression into ``(kind, value)`` tokens."""
+
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKENS.match(expression, position)
+        if match is None:
+            raise ExpressionError('Unexpected character {!r} in filter {!r}.'.format(
+                expression[position:].strip()[:1], expression))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value.lower() in _KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """A recursive descent parser for filter expressions."""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def advance(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, kind: str, value: str = None):
+        token_kind, token_value = self.peek()
+        if token_kind == kind and (value is None or token_value == value):
+            self.position += 1
+            return True
+        return False
+
+    def error(self, message: str):
+        return ExpressionError('{} in filter {!r}.'.format(message, self.expression))
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            raise self.error('Empty expression')
+        node = self.parse_or()
+        if self.position < len(self.tokens):
+            raise self.error('Unexpected {!r}'.format(self.peek()[1]))
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.accept('keyword', 'or'):
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.accept('keyword', 'and'):
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def parse_not(self):
+        if self.accept('keyword', 'not'):
+            return Not(self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+        kind, value = self.peek()
+        if kind == 'operator':
+            self.advance()
+            return Compare(_OPERATOR_ALIASES.get(value, value), left, self.parse_operand())
+        if self.accept('keyword', 'is'):
+            op = '!=' if self.accept('keyword', 'not') else '=='
+            if not (self.accept('keyword', 'null') or self.accept('keyword', 'none')):
+                raise self.error('Expected null after is')
+            return Compare(op, left, Literal(None))
+        return left
+
+    def parse_operand(self):
+        kind, value = self.advance()
+        if kind == 'number':
+            return Literal(float(value) if '.' in value else int(value))
+        if kind == 'string':
+            return Literal(re.sub(r'\\(.)', r'\1', value[1:-1]))
+        if kind == 'name':
+            return Field(value)
+        if kind == 'keyword' and value in ('null', 'none'):
+            return Literal(None)
+        if kind == 'keyword' and value in ('true', 'false'):
+            return Literal(value == 'true')
+        if kind == 'punctuation' and value == '*':
+            return Wildcard()
+        if kind == 'punctuation' and value == '(':
+            node = self.parse_or()
+            if not self.accept('punctuation', ')'):
+                raise self.error('Expected )')
+            return node
+        raise self.error('Unexpected {!r}'.format(value) if kind else 'Unexpected end of expression')
+
+
+@lru_cache(maxsize=1024)
+def parse(expression: str):
+    """Parse a filter expression.
+    Args:
+        expression (str): The filter expression.
+    Returns:
+        tuple: The root node of the expression tree.
+    Raises:
+        ExpressionError: If the expression is malformed.
+    """
+
+    return _Parser(expression).parse()
+
+
+def fields(node):
+    """Collect the names of the fields an expression refers to.
+    Args:
+        node (tuple): The root node of an expression tree.
+    Returns:
+        frozenset: The referenced field names.
+    """
+
+    if isinstance(node, str):
+        node = parse(node)
+    if isinstance(node, Field):
+        return frozenset([node.name])
+    if isinstance(node, Compare):
+        return fields(node.left) | fields(node.right)
+    if isinstance(node, (And, Or)):
+        return frozenset().union(*(fields(operand) for operand in node.operands))
+    if isinstance(node, Not):
+        return fields(node.operand)
+    return frozenset()
+
+
+def _compile_value(node, columns: dict):
+    """Compile an operand into a closure returning its value for a row."""
+
+    if isinstance(node, Field):
+        if node.name not in columns:
+            raise ExpressionError('Unknown field {!r}.'.format(node.name))
+        return operator.itemgetter(columns[node.name])
+    if isinstance(node, Literal):
+        value = node.value
+        return lambda row: value
+    predicate = _compile(node, columns)
+    return predicate
+
+
+def _compile_compare(node: Compare, columns: dict):
+    """Compile a comparison into a predicate closure.
+
+    Ordering comparisons against null are false, mirroring SQL semantics.
+    """
+
+    compare = OPERATORS[node.op]
+    if isinstance(node.right, Literal) and isinstance(node.left, Field):
+        value = node.right.value
+        get = _compile_value(node.left, columns)
+        if node.op in ('==', '!='):
+            return lambda row: compare(get(row), value)
+        if value is None:
+            return lambda row: False
+
+        def compare_field_to_literal(row):
+            current = get(row)
+            return current is not None and compare(current, value)
+        return compare_field_to_literal
+
+    left = _compile_value(node.left, columns)
+    right = _compile_value(node.right, columns)
+    if node.op in ('==', '!='):
+        return lambda row: compare(left(row), right(row))
+
+    def compare_values(row):
+        left_value = left(row)
+        right_value = right(row)
+        return left_value is not None and right_value is not None and compare(left_value, right_value)
+    return compare_values
+
+
+def _compile(node, columns: dict):
+    """Compile an expression node into a predicate closure."""
+
+    if isinstance(node, Wildcard):
+        return lambda row: True
+    if isinstance(node, Compare):
+        return _compile_compare(node, columns)
+    if isinstance(node, And):
+        predicates = tuple(_compile(operand, columns) for operand in node.operands)
+        return lambda row: all(predicate(row) for predicate in predicates)
+    if isinstance(node, Or):
+        predicates = tuple(_compile(operand, columns) for operand in node.operands)
+        return lambda row: any(predicate(row) for predicate in predicates)
+    if isinstance(node, Not):
+        predicate = _compile(node.operand, columns)
+        return lambda row: not predicate(row)
+    value = _compile_value(node, columns)
+    return lambda row: bool(value(row))
+
+
+@lru_cache(maxsize=1024)
+def compile_predicate(expression, columns: tuple):
+    """Compile a filter expression into a predicate over row tuples.
+    Args:
+        expression (str or tuple): The filter expression or an already parsed expression tree.
+        columns (tuple): The field names of the row tuples, in order.
+    Returns:
+        function: A function taking a row tuple and returning True if the filter applies.
+    Raises:
+        ExpressionError: If the expression is malformed or refers to an unknown field.
+    """
+
+    if isinstance(expression, str):
+        expression = parse(expression)
+    return _compile(expression, {name: index for index, name in enumerate(columns)})
+
+
+# The comparison that holds exactly when another does not, for non-null operands.
+_NEGATED_OPERATORS = {'==': '!=', '!=': '==', '<': '>=', '<=': '>', '>': '<=', '>=': '<'}
+
+# The comparison with its operands swapped.
+_REFLECTED_OPERATORS = {'==': '==', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+def _clause_value(node, columns):
+    """Resolve a comparison operand to a column or a Python value."""
+
+    if isinstance(node, Field):
+        if node.name not in columns:
+            raise ExpressionError('Unknown field {!r}.'.format(node.name))
+        return columns[node.name]
+    if isinstance(node, Literal):
+        return node.value
+    raise ExpressionError('Only fields and constants can be compared in SQL filters.')
+
+
+def _compile_clause_comparison(op: str, left, right, null_safe: bool = True):
+    """Compile a non-negated comparison between resolved operands."""
+
+    compare = OPERATORS[op]
+    if not hasattr(left, 'is_'):
+        # both operands are constants
+        if op in ('==', '!='):
+            return true() if compare(left, right) else false()
+        return true() if left is not None and right is not None and compare(left, right) else false()
+    if right is None:
+        if op == '==':
+            return left.is_(None)
+        if op == '!=':
+            return left.isnot(None)
+        return false()
+    if hasattr(right, 'is_'):
+        if null_safe and op == '==':
+            return left.isnot_distinct_from(right)
+        if null_safe and op == '!=':
+            return left.is_distinct_from(right)
+        return compare(left, right)
+    if null_safe and op == '!=':
+        # null differs from every constant
+        return or_(left.is_(None), left != right)
+    return compare(left, right)
+
+
+def _compile_clause(node, columns, negated: bool = False, null_safe: bool = True):
+    """Compile an expression node into a clause, pushing negations down to the comparisons.
+
+    Keeping negation at the leaves means a null comparison can only ever make a
+    clause false, matching the two-valued semantics of the Python predicates.
+    Without ``null_safe`` the comparisons are left as they are in SQL, so the
+    clause only holds where the (negated) expression is definitely true.
+    """
+
+    if isinstance(node, Wildcard):
+        return false() if negated else true()
+    if isinstance(node, Not):
+        return _compile_clause(node.operand, columns, not negated, null_safe)
+    if isinstance(node, (And, Or)):
+        clauses = [_compile_clause(operand, columns, negated, null_safe) for operand in node.operands]
+        return (or_ if isinstance(node, And) == negated else and_)(*clauses)
+    if isinstance(node, Compare):
+        op = node.op
+        if negated:
+            op = _NEGATED_OPERATORS[op]
+            if null_safe and op not in ('==', '!='):
+                # a negated ordering comparison also holds when either side is null
+                if Literal(None) in (node.left, node.right):
+                    return true()
+                nulls = [_clause_value(operand, columns).is_(None) for operand in (node.left, node.right)
+                         if isinstance(operand, Field)]
+                clause = _compile_clause_comparison(
+                    *_resolve_operands(op, node.left, node.right, columns))
+                return or_(*(nulls + [clause])) if nulls else clause
+        return _compile_clause_comparison(*_resolve_operands(op, node.left, node.right, columns), null_safe)
+    if isinstance(node, Literal):
+        return true() if bool(node.value) != negated else false()
+    raise ExpressionError('Fields must be compared to a value in SQL filters.')
+
+
+def _resolve_operands(op: str, left, right, columns):
+    """Resolve comparison operands, moving a column to the left-hand side."""
+
+    if not isinstance(left, Field) and isinstance(right, Field):
+        op, left, right = _REFLECTED_OPERATORS[op], right, left
+    return op, _clause_value(left, columns), _clause_value(right, columns)
+
+
+def compile_clause(expression, columns, null_safe: bool = True):
+    """Compile a filter expression into an SQLAlchemy clause.
+    Args:
+        expression (str or tuple): The filter expression or an already parsed expression tree.
+        columns (dict): A mapping of field names to SQLAlchemy columns.
+        null_safe (bool): Compare nulls as the Python predicates do. If False, a comparison with a null field is
+            unknown as in SQL, and the clause is only true for rows where the expression is definitely true.
+    Returns:
+        obj: A boolean clause that is true for exactly the rows the Python predicate applies to.
+    Raises:
+        ExpressionError: If the expression is malformed, refers to an unknown field or cannot be expressed in SQL.
+    """
+
+    if isinstance(expression, str):
+        expression = parse(expression)
+    return _compile_clause(expression, columns, null_safe=null_safe)
+
+
+def any_of(expressions):
+    """Combine several filter expressions into one that applies if any of them does.
+    Args:
+        expressions (list): Filter expressions or parsed expression trees.
+    Returns:
+        tuple: The root node of the combined expression tree.
+    """
+
+    nodes = tuple(parse(expression) if isinstance(expression, str) else expression for expression in expressions)
+    if any(isinstance(node, Wildcard) for node in nodes):
+        return Wildcard()
+    return nodes[0] if len(nodes) == 1 else Or(nodes)
@@ -0,0 +1,140 @@
+"""Cross-Worker Cache Invalidation.
+
+Triggers on ``oauth2_roles``, ``roles`` and ``tokens`` publish a notification on
+the ``policy_changes`` channel for every changed row, carrying the table name and
+the key of the row. Each worker process runs a listener on its own PostgreSQL
+connection and evicts exactly the cached entries the change affects:
+
+- a changed or deleted role evicts its compiled policy, which is not compiled
+  from a policy snapshot again (cached tokens then reload it from the database
+  on their next use);
+- a change to the roles granted to a client evicts that client's tokens;
+- a changed or deleted token evicts that token, identified by its hash. Tokens
+  deleted after they expire send no notification, since cached tokens are
+  checked against their expiry anyway.
+
+Whenever the listener (re)connects, both caches are cleared, since
+notifications sent while it was disconnected are lost.
+"""
+
+import json
+import select
+import logging
+import threading
+
+from strawman.db import db
+from strawman.middleware.auth_middleware import token_cache, decision_cache, invalidate_role_decisions
+from strawman.middleware.policy import policy_cache
+
+# The channel the database triggers notify.
+CHANNEL = 'policy_changes'
+
+logger = logging.getLogger(__name__)
+
+
+def handle_notification(payload: str):
+    """Evict the cache entries affected by a policy change notification.
+    Args:
+        payload (str): The notification payload, a JSON object with the changed table and row key.
+    Returns:
+        int: The number of token cache entries evicted.
+    """
+
+    change = json.loads(payload)
+    table, key = change.get('table'), change.get('key')
+    if table == 'oauth2_roles':
+        policy_cache.revoke(key)
+        invalidate_role_decisions(key)
+        return 0
+    if table == 'roles':
+        return token_cache.invalidate_where(lambda token, entry: entry[0] == key)
+    if table == 'tokens':
+        return int(token_cache.invalidate(key))
+    return 0
+
+
+class PolicyChangeListener(object):
+    """Listens for policy change notifications on a background thread.
+
+    Attributes:
+        engine (obj): The SQLAlchemy engine of a PostgreSQL database.
+        timeout (float): The number of seconds to wait for a notification before checking for a stop request.
+        reconnect_delay (float): The number of seconds to wait before reconnecting after a connection failure.
+    """
+
+    def __init__(self, engine, timeout: float = 5.0, reconnect_delay: float = 1.0):
+        self.engine = engine
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start listening on a daemon thread."""
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name='policy-change-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the listener to stop, and wait for it to do so."""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + 1)
+            self._thread = None
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.listen()
+            except Exception:
+                logger.exception('Policy change listener failed; reconnecting.')
+            self._stopped.wait(self.reconnect_delay)
+
+    def listen(self):
+        """Listen for notifications until stopped or the connection fails."""
+
+        connection = self.engine.raw_connection()
+        # a dedicated connection that is closed rather than returned to the pool
+        connection.detach()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute('LISTEN {}'.format(CHANNEL))
+
+            # changes made before LISTEN took effect are not delivered
+            token_cache.clear()
+            policy_cache.clear()
+            decision_cache.clear()
+
+            while not self._stopped.is_set():
+                if select.select([dbapi_connection], [], [], self.timeout) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    try:
+                        handle_notification(notification.payload)
+                    except (ValueError, AttributeError):
+                        logger.warning('Ignoring malformed policy change notification %r.', notification.payload)
+        finally:
+            connection.close()
+
+
+def start_policy_listener(app):
+    """Start a policy change listener for an application's database.
+    Args:
+        app (obj): The Flask application.
+    Returns:
+        PolicyChangeListener: The running listener, or None if the database is not PostgreSQL.
+    """
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return None
+    listener = PolicyChangeListener(engine)
+    listener.start()
+    return listener
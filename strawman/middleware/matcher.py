@@ -0,0 +1,156 @@
+"""Resource Matching Index.
+
+Rather than trying every rule's resource pattern against a URL, the rules held
+by a client are indexed by the literal prefix of their patterns. Walking the URL
+through a character trie finds every rule whose prefix applies; purely literal
+rules match outright, and the regular expression remainders hanging off each
+trie node are evaluated together with a single combined expression.
+"""
+
+import re
+
+# Characters that end the literal prefix of a regular expression.
+_METACHARACTERS = frozenset('.^$*+?{}[]|()')
+
+# Characters that make the preceding character optional or repeated.
+_QUANTIFIERS = frozenset('*+?{')
+
+# Backreferences and conditional groups refer to groups by number (or name), and cannot be relocated into a combined
+# expression where the numbering shifts.
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(\w')
+
+
+def literal_prefix(pattern: str):
+    """Split a regular expression into its literal prefix and remainder.
+    Args:
+        pattern (str): The regular expression.
+    Returns:
+        str, str: The literal text every match must start with and the unparsed remainder of the pattern.
+    """
+
+    if '|' in pattern:
+        return '', pattern
+
+    prefix = []
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        start = position
+        if char == '\\':
+            if position + 1 >= len(pattern) or pattern[position + 1].isalnum():
+                break
+            char = pattern[position + 1]
+            position += 2
+        elif char in _METACHARACTERS:
+            break
+        else:
+            position += 1
+        if position < len(pattern) and pattern[position] in _QUANTIFIERS:
+            position = start
+            break
+        prefix.append(char)
+    return ''.join(prefix), pattern[position:]
+
+
+class _TrieNode(object):
+    """A node in the resource prefix trie."""
+
+    __slots__ = ('children', 'literal', 'partial', 'fallback', 'combined')
+
+    def __init__(self):
+        self.children = {}
+        self.literal = []
+        self.partial = []
+        self.fallback = []
+        self.combined = None
+
+
+class RuleIndex(object):
+    """Index the compiled rules of one or more policies by resource.
+
+    Attributes:
+        entries (tuple): ``(scope_index, rule)`` pairs in declaration order.
+        effective_rules (dict): The effective rule of each combination of matching rules seen so far, keyed by
+            their positions in ``entries``.
+    """
+
+    def __init__(self, policies):
+        self.entries = tuple(
+            (scope_index, rule) for scope_index, policy in enumerate(policies) for rule in policy.rules)
+        self.effective_rules = {}
+        self._root = _TrieNode()
+        for position, (scope_index, rule) in enumerate(self.entries):
+            prefix, remainder = literal_prefix(rule.resource)
+            node = self._root
+            for char in prefix:
+                node = node.children.setdefault(char, _TrieNode())
+            if not remainder:
+                node.literal.append(position)
+            elif _BACKREFERENCE.search(remainder):
+                node.fallback.append(position)
+            else:
+                node.partial.append((position, remainder))
+        self._compile(self._root)
+
+    def _compile(self, node: _TrieNode):
+        """Build the combined remainder expression of every node in the trie.
+        Args:
+            node (_TrieNode): The node to compile.
+        """
+
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children.values())
+            if not node.partial:
+                continue
+            combined = ''.join(
+                '(?:(?=(?P<_r{}>{}))|)'.format(position, remainder) for position, remainder in node.partial)
+            try:
+                node.combined = re.compile(combined)
+                node.partial = tuple('_r{}'.format(position) for position, _ in node.partial)
+            except re.error:
+                node.fallback.extend(position for position, _ in node.partial)
+                node.partial = ()
+
+    def _collect(self, node: _TrieNode, url: str, depth: int, positions: list):
+        """Append the positions of the rules at a trie node that match a URL."""
+
+        positions.extend(node.literal)
+        if node.combined is not None:
+            match = node.combined.match(url, depth)
+            for group in node.partial:
+                if match.start(group) != -1:
+                    positions.append(int(group[2:]))
+        for position in node.fallback:
+            if self.entries[position][1].matches(url):
+                positions.append(position)
+
+    def match(self, url: str):
+        """Find every rule whose resource pattern matches a URL.
+        Args:
+            url (str): The URL of the request.
+        Returns:
+            list: ``(scope_index, rule)`` pairs in declaration order.
+        """
+
+        return [self.entries[position] for position in self.match_positions(url)]
+
+    def match_positions(self, url: str):
+        """Find the position in ``entries`` of every rule whose resource pattern matches a URL.
+        Args:
+            url (str): The URL of the request.
+        Returns:
+            tuple: The positions, in ascending order.
+        """
+
+        positions = []
+        node = self._root
+        self._collect(node, url, 0, positions)
+        for depth, char in enumerate(url, 1):
+            node = node.children.get(char)
+            if node is None:
+                break
+            self._collect(node, url, depth, positions)
+        positions.sort()
+        return tuple(positions)
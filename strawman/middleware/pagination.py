@@ -0,0 +1,66 @@
+"""Keyset Pagination Cursors.
+
+A cursor records the primary key of the last row on a page together with the
+fingerprint of the rule that produced it. The next page continues after that
+key, which keeps every page an index range scan, and a cursor is refused if
+the rule governing the request has changed since it was issued.
+"""
+
+import json
+import hashlib
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor is malformed or was issued under a different rule."""
+
+
+def rule_fingerprint(rule):
+    """Compute a short, stable digest of the parts of a rule that shape a result set.
+    Args:
+        rule (CompiledRule): The compiled rule.
+    Returns:
+        str: The fingerprint of the rule.
+    """
+
+    document = json.dumps([
+        rule.resource, sorted(rule.restricted_response_fields), list(rule.redacted_fields),
+        list(rule.access_policies)])
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(last_key, fingerprint: str):
+    """Create an opaque cursor pointing after a row.
+    Args:
+        last_key (any): The primary key of the last row returned.
+        fingerprint (str): The fingerprint of the rule the page was produced under.
+    Returns:
+        str: The cursor.
+    """
+
+    document = json.dumps([last_key, fingerprint], separators=(',', ':'))
+    return urlsafe_b64encode(document.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, fingerprint: str):
+    """Recover the primary key a cursor points after.
+    Args:
+        cursor (str): The cursor returned with a previous page.
+        fingerprint (str): The fingerprint of the rule governing the current request.
+    Returns:
+        any: The primary key of the last row of the previous page.
+    Raises:
+        InvalidCursorError: If the cursor is malformed or was issued under a different rule.
+    """
+
+    try:
+        last_key, cursor_fingerprint = json.loads(
+            urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise InvalidCursorError('Malformed pagination cursor.')
+    # cursors are not signed, so only a key of a type a primary key can have reaches the keyset comparison
+    if not isinstance(last_key, (str, int)) or isinstance(last_key, bool):
+        raise InvalidCursorError('Malformed pagination cursor.')
+    if cursor_fingerprint != fingerprint:
+        raise InvalidCursorError('The pagination cursor was issued under a different access policy.')
+    return last_key
@@ -0,0 +1,331 @@
+"""Compiled Scope Policies.
+
+Role rules are stored as JSON documents. Parsing them and compiling their
+resource patterns on every request is expensive, so each role is compiled once
+into an immutable policy object and cached per worker process, keyed by the
+role identifier and its last update timestamp.
+"""
+
+import re
+import json
+import threading
+from collections import namedtuple
+
+from strawman.middleware.matcher import RuleIndex
+from strawman.middleware.expressions import parse
+
+
+class CompiledRule(namedtuple('CompiledRule', [
+        'resource', 'pattern', 'allowed_methods', 'all_methods', 'restricted_request_fields',
+        'restricted_response_fields', 'redacted_fields', 'access_policies', 'source'])):
+    """A single scope rule with its patterns and field sets precomputed.
+
+    Attributes:
+        resource (str): The resource regular expression as written in the rule.
+        pattern (obj): The compiled resource regular expression.
+        allowed_methods (frozenset): Upper-cased HTTP methods allowed by the rule.
+        all_methods (bool): True if the rule allows every HTTP method (``*``).
+        restricted_request_fields (frozenset): Fields that may not appear in request bodies.
+        restricted_response_fields (frozenset): Fields stripped from responses.
+        redacted_fields (tuple): ``(field, filter)`` pairs in declaration order.
+        access_policies (tuple): Row filter expressions in declaration order.
+        source (dict): The original rule document.
+    """
+
+    __slots__ = ()
+
+    def allows(self, method: str):
+        """Determine whether the rule permits an HTTP method.
+        Args:
+            method (str): The HTTP method of the request.
+        Returns:
+            bool: True if the method is allowed.
+        """
+
+        return self.all_methods or method.upper() in self.allowed_methods
+
+    def matches(self, url: str):
+        """Determine whether the rule applies to a URL.
+        Args:
+            url (str): The URL of the request.
+        Returns:
+            bool: True if the resource pattern matches the start of the URL.
+        """
+
+        return self.pattern.match(url) is not None
+
+
+class CompiledPolicy(namedtuple('CompiledPolicy', ['role_id', 'version', 'scope', 'rules'])):
+    """The compiled form of a single role.
+
+    Attributes:
+        role_id (str): The identifier of the role.
+        version (any): The role's last update timestamp.
+        scope (str): The name of the scope described by the rules.
+        rules (tuple): The role's compiled rules in declaration order.
+    """
+
+    __slots__ = ()
+
+
+def compile_rule(rule: dict):
+    """Compile a single rule document.
+    Args:
+        rule (dict): Either a ruleset entry (``{'rule': {...}}``) or the rule body itself.
+    Returns:
+        CompiledRule: The compiled rule.
+    """
+
+    if isinstance(rule, CompiledRule):
+        return rule
+    if 'rule' in rule:
+        rule = rule['rule']
+
+    allowed_methods = rule.get('allowed_methods', [])
+    restricted_fields = rule.get('restricted_fields', [])
+    redacted_fields = tuple((field['field'], field['filter']) for field in rule.get('redacted_fields', []))
+    access_policies = tuple(policy['filter'] for policy in rule.get('access_policies', []))
+    for expression in [redaction_filter for _, redaction_filter in redacted_fields] + list(access_policies):
+        parse(expression)
+    return CompiledRule(
+        resource=rule['resource'],
+        pattern=re.compile(rule['resource']),
+        allowed_methods=frozenset(method.upper() for method in allowed_methods),
+        all_methods='*' in allowed_methods,
+        restricted_request_fields=frozenset(
+            field['field'] for field in restricted_fields if field.get('request')),
+        restricted_response_fields=frozenset(
+            field['field'] for field in restricted_fields if field.get('response')),
+        redacted_fields=redacted_fields,
+        access_policies=access_policies,
+        source=rule)
+
+
+def merge_rules(rules):
+    """Combine every rule governing a request into one effective rule.
+
+    The effective rule restricts the union of the fields the rules restrict,
+    redacts the union of their redactions and hides the rows any of their access
+    policies hide, so holding an additional scope never exposes more of a
+    response. Its parts are sorted, so the result does not depend on the order
+    of the rules.
+
+    Args:
+        rules (iterable): The compiled rules matching a request.
+    Returns:
+        CompiledRule: The effective rule; a single rule is returned unchanged.
+    """
+
+    rules = tuple(rules)
+    if len(rules) == 1:
+        return rules[0]
+
+    request_fields = frozenset().union(*[rule.restricted_request_fields for rule in rules])
+    response_fields = frozenset().union(*[rule.restricted_response_fields for rule in rules])
+    if all(rule.all_methods for rule in rules):
+        allowed_methods = ['*']
+    else:
+        allowed_methods = sorted(frozenset.intersection(*[
+            rule.allowed_methods for rule in rules if not rule.all_methods]))
+    resources = sorted(set(rule.resource for rule in rules))
+    resource = '|'.join('(?:{})'.format(resource) for resource in resources) if len(resources) > 1 else resources[0]
+    document = {
+        'resource': resource,
+        'allowed_methods': allowed_methods,
+        'restricted_fields': [{'field': field, 'request': field in request_fields, 'response': field in response_fields}
+                              for field in sorted(request_fields | response_fields)],
+        'redacted_fields': [{'field': field, 'filter': redaction_filter} for field, redaction_filter in sorted(set(
+            redaction for rule in rules for redaction in rule.redacted_fields))],
+        'access_policies': [{'filter': access_policy} for access_policy in sorted(set(
+            access_policy for rule in rules for access_policy in rule.access_policies))]
+    }
+    try:
+        return compile_rule(document)
+    except re.error:
+        # patterns that cannot be combined, such as ones repeating a group name; the resource is informational only,
+        # since requests have already been matched against the individual rules
+        document['resource'] = resources[0]
+        return compile_rule(document)
+
+
+def compile_policy(role_id: str, version, rules):
+    """Compile the rules document of a role.
+    Args:
+        role_id (str): The identifier of the role.
+        version (any): The role's last update timestamp.
+        rules (str or dict): The rules document, either serialized or already decoded.
+    Returns:
+        CompiledPolicy: The compiled policy.
+    """
+
+    if isinstance(rules, (str, bytes)):
+        rules = json.loads(rules)
+    rules = rules or {}
+    return CompiledPolicy(
+        role_id=role_id,
+        version=version,
+        scope=rules.get('scope'),
+        rules=tuple(compile_rule(rule) for rule in rules.get('ruleset', [])))
+
+
+def version_key(version):
+    """Represent a role version as it is stored in a policy snapshot.
+    Args:
+        version (any): The role's last update timestamp.
+    Returns:
+        str: The ISO 8601 representation of the version, or None.
+    """
+
+    if version is None:
+        return None
+    return version.isoformat() if hasattr(version, 'isoformat') else str(version)
+
+
+class PolicyCache(object):
+    """A per-process cache of compiled role policies.
+
+    Entries are keyed by role identifier and remember the ``date_last_updated``
+    they were compiled from. Looking up a newer version recompiles the role and
+    replaces the stale entry. Resource indexes built over a combination of
+    policies are cached alongside them.
+
+    When a snapshot store is attached, roles missing from the cache are compiled
+    from the current snapshot if it holds the requested version, and roles whose
+    version changes between snapshot generations are evicted. A revoked role is
+    not compiled from a snapshot again until its rules are loaded from the
+    database, since a change may not bump its version.
+
+    Attributes:
+        max_indexes (int): The number of resource indexes kept before the index cache is reset.
+        snapshots (SnapshotStore): The snapshot store consulted on misses, or None.
+    """
+
+    def __init__(self, max_indexes: int = 1024, snapshots=None):
+        self.max_indexes = max_indexes
+        self.snapshots = snapshots
+        self._policies = {}
+        self._indexes = {}
+        self._generation = None
+        self._revoked = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._policies)
+
+    def get(self, role_id: str, version):
+        """Retrieve a compiled policy if the cached version is current.
+        Args:
+            role_id (str): The identifier of the role.
+            version (any): The expected last update timestamp of the role.
+        Returns:
+            CompiledPolicy: The cached policy, or None if missing or stale.
+        """
+
+        snapshot = self.snapshots.current() if self.snapshots is not None else None
+        if snapshot is not None and snapshot.generation != self._generation:
+            self._swap(snapshot)
+
+        policy = self._policies.get(role_id)
+        if policy is not None and policy.version == version:
+            return policy
+        if snapshot is not None and role_id not in self._revoked:
+            rules = snapshot.rules(role_id, version)
+            if rules is not None:
+                policy = compile_policy(role_id, version, rules)
+                with self._lock:
+                    self._policies[role_id] = policy
+                return policy
+        return None
+
+    def attach_snapshots(self, snapshots):
+        """Consult a snapshot store on cache misses.
+        Args:
+            snapshots (SnapshotStore): The snapshot store, or None to detach.
+        """
+
+        self.snapshots = snapshots
+        self._generation = None
+
+    def _swap(self, snapshot):
+        # roles changed or removed in the new generation are compiled again on their next use
+        self._generation = snapshot.generation
+        for role_id, policy in list(self._policies.items()):
+            if snapshot.version(role_id) != version_key(policy.version):
+                self.invalidate(role_id)
+
+    def load(self, role_id: str, version, rules):
+        """Retrieve a compiled policy, compiling and caching it when required.
+        Args:
+            role_id (str): The identifier of the role.
+            version (any): The last update timestamp of the role.
+            rules (str or dict): The rules document of the role.
+        Returns:
+            CompiledPolicy: The compiled policy.
+        """
+
+        policy = self.get(role_id, version)
+        if policy is None:
+            policy = compile_policy(role_id, version, rules)
+            with self._lock:
+                self._policies[role_id] = policy
+                self._revoked.discard(role_id)
+        return policy
+
+    def for_role(self, role):
+        """Retrieve the compiled policy for a role model instance.
+        Args:
+            role (Role): The role to compile.
+        Returns:
+            CompiledPolicy: The compiled policy.
+        """
+
+        return self.load(role.id, role.date_last_updated, role.rules)
+
+    def index_for(self, policies):
+        """Retrieve the resource index covering a combination of policies.
+        Args:
+            policies (list): The compiled policies held by a client, in order.
+        Returns:
+            RuleIndex: The resource index of the policies' rules.
+        """
+
+        key = tuple((policy.role_id, policy.version) for policy in policies)
+        index = self._indexes.get(key)
+        if index is None:
+            index = RuleIndex(policies)
+            with self._lock:
+                if len(self._indexes) >= self.max_indexes:
+                    self._indexes.clear()
+                self._indexes[key] = index
+        return index
+
+    def invalidate(self, role_id: str):
+        """Evict a role, and every index built from it, from the cache.
+        Args:
+            role_id (str): The identifier of the role.
+        """
+
+        with self._lock:
+            self._policies.pop(role_id, None)
+            for key in [key for key in self._indexes if any(entry[0] == role_id for entry in key)]:
+                del self._indexes[key]
+
+    def revoke(self, role_id: str):
+        """Evict a role that changed, and stop compiling it from snapshots until its rules are loaded again.
+        Args:
+            role_id (str): The identifier of the role.
+        """
+
+        with self._lock:
+            self._revoked.add(role_id)
+        self.invalidate(role_id)
+
+    def clear(self):
+        """Evict every compiled policy and resource index."""
+
+        with self._lock:
+            self._policies.clear()
+            self._indexes.clear()
+
+
+policy_cache = PolicyCache()
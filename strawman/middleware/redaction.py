@@ -0,0 +1,198 @@
+"""Response Redaction and Row Policies.
+
+Redacted fields can either be rewritten in Python after rows are loaded, or
+pushed into the query itself so the database returns rows that are already
+redacted and sensitive values never leave it. Access policies are always
+applied in the query as clauses with bound parameters.
+"""
+
+from functools import lru_cache
+from itertools import compress
+from sqlalchemy import String, case, literal, null, true, false, type_coerce
+
+from strawman.middleware.expressions import Wildcard, Not, any_of, compile_clause, compile_predicate, fields
+
+# The value substituted for redacted fields.
+REDACTED_VALUE = '**********'
+
+# The label of the column flagging which values of a non-string field the database redacted.
+_REDACTED_FLAG = '{}:redacted'
+
+
+def model_columns(model):
+    """Map the attribute names of a model to its columns.
+    Args:
+        model (obj): The SQLAlchemy model.
+    Returns:
+        OrderedDict: The model's columns keyed by attribute name, in mapper order.
+    """
+
+    return model.__mapper__.columns
+
+
+def redaction_filters(rule):
+    """Group the redaction filters of a rule by field.
+    Args:
+        rule (CompiledRule): The compiled rule.
+    Returns:
+        dict: The combined filter expression tree of every redacted field.
+    """
+
+    filters = {}
+    for field, redaction_filter in rule.redacted_fields:
+        filters.setdefault(field, []).append(redaction_filter)
+    return {field: any_of(field_filters) for field, field_filters in filters.items()}
+
+
+@lru_cache(maxsize=1024)
+def row_filter(access_policies: tuple, model):
+    """Compile access policies into a row filter for a model.
+
+    An access policy describes rows the client may not see, so a row is returned
+    only when none of the policies apply to it. As in SQL, a policy that compares
+    a null field does not clear the row, so only rows every policy definitely
+    excludes are returned. Constants become bound parameters, so every rule
+    produces the same statement text on each request.
+
+    Args:
+        access_policies (tuple): The rule's access policy filter expressions.
+        model (obj): The SQLAlchemy model being queried.
+    Returns:
+        obj: The filter clause, or None if the rule has no access policies.
+    """
+
+    if len(access_policies) == 0:
+        return None
+    return compile_clause(Not(any_of(access_policies)), model_columns(model), null_safe=False)
+
+
+def projected_fields(rule, model):
+    """Determine which columns a rule allows to leave the database.
+
+    Fields restricted from responses are never selected unless a visible field's
+    redaction filter needs their value.
+
+    Args:
+        rule (CompiledRule): The compiled rule.
+        model (obj): The SQLAlchemy model being queried.
+    Returns:
+        tuple, tuple: The fields to select and the fields to include in responses, both in mapper order.
+    """
+
+    columns = model_columns(model)
+    filters = redaction_filters(rule)
+    visible = tuple(field for field in columns.keys() if field not in rule.restricted_response_fields)
+    required = set(visible)
+    for field in visible:
+        if field in filters:
+            required |= fields(filters[field])
+    return tuple(field for field in columns.keys() if field in required), visible
+
+
+def redaction_columns(rule, model):
+    """Build the projection of a rule's visible fields with redaction applied in SQL.
+
+    A redacted string field becomes ``CASE WHEN <filter> THEN '**********' ELSE <column> END``.
+    Other redacted fields keep their type: the value is replaced by NULL and a
+    flag column labelled ``<field>:redacted`` follows it, so ``sql_redactor``
+    can substitute the redacted value. Responses therefore have the same types
+    as when redaction is applied in Python.
+
+    Args:
+        rule (CompiledRule): The compiled rule.
+        model (obj): The SQLAlchemy model being queried.
+    Returns:
+        list: Labelled column expressions for every field not restricted from responses, and their flags.
+    """
+
+    columns = model_columns(model)
+    filters = redaction_filters(rule)
+    projection = []
+    for field, column in columns.items():
+        if field in rule.restricted_response_fields:
+            continue
+        if field not in filters:
+            projection.append(column.label(field))
+            continue
+        if isinstance(filters[field], Wildcard):
+            projection.append(literal(REDACTED_VALUE, String).label(field))
+            continue
+        clause = compile_clause(filters[field], columns)
+        if isinstance(column.type, String):
+            projection.append(case([(clause, literal(REDACTED_VALUE, String))], else_=column).label(field))
+            continue
+        projection.append(type_coerce(case([(clause, null())], else_=column), column.type).label(field))
+        projection.append(case([(clause, true())], else_=false()).label(_REDACTED_FLAG.format(field)))
+    return projection
+
+
+def sql_redactor(projection):
+    """Build a function that turns rows of a ``redaction_columns`` projection into response dicts.
+    Args:
+        projection (list): The projection built by ``redaction_columns``.
+    Returns:
+        function: A function turning a list of row tuples into a list of response dicts. Rows may carry extra
+        trailing values.
+    """
+
+    labels = [column.key for column in projection]
+    flags = {_REDACTED_FLAG.format(label) for label in labels}
+    visible = [(index, label) for index, label in enumerate(labels) if label not in flags]
+    flagged = [(index - 1, index) for index, label in enumerate(labels) if label in flags]
+
+    def redact_batch(rows):
+        responses = []
+        for row in rows:
+            response = {label: row[index] for index, label in visible}
+            for index, flag in flagged:
+                if row[flag]:
+                    response[labels[index]] = REDACTED_VALUE
+            responses.append(response)
+        return responses
+
+    return redact_batch
+
+
+def batch_redactor(rule, fetched_fields: tuple, visible_fields: tuple):
+    """Build a function that redacts batches of row tuples column by column.
+
+    For each batch, every distinct redaction filter is evaluated once per row to
+    produce a mask, even when it guards several fields; only the cells selected by
+    a mask are then rewritten.
+
+    Args:
+        rule (CompiledRule): The compiled rule.
+        fetched_fields (tuple): The field names of the row tuples, in order. Rows may carry extra trailing values.
+        visible_fields (tuple): The fields to include in responses, in order.
+    Returns:
+        function: A function turning a list of row tuples into a list of response dicts.
+    """
+
+    redactions = redaction_filters(rule)
+    predicates = {}
+    plan = []
+    for field in visible_fields:
+        expression = redactions.get(field)
+        if expression is not None and not isinstance(expression, Wildcard) and expression not in predicates:
+            predicates[expression] = compile_predicate(expression, fetched_fields)
+        plan.append((fetched_fields.index(field), expression))
+
+    def redact_batch(rows):
+        if len(rows) == 0 or len(plan) == 0:
+            return [{} for _ in rows]
+        columns = list(zip(*rows))
+        masks = {expression: [predicate(row) for row in rows] for expression, predicate in predicates.items()}
+        output = []
+        for index, expression in plan:
+            if expression is None:
+                output.append(columns[index])
+            elif isinstance(expression, Wildcard):
+                output.append((REDACTED_VALUE,) * len(rows))
+            else:
+                values = list(columns[index])
+                for position in compress(range(len(values)), masks[expression]):
+                    values[position] = REDACTED_VALUE
+                output.append(values)
+        return [dict(zip(visible_fields, values)) for values in zip(*output)]
+
+    return redact_batch
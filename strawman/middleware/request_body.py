@@ -0,0 +1,185 @@
+"""Request Body Decoding.
+
+Request bodies are either a single record (a JSON object) or a bulk upload (a
+JSON array of objects). Bulk uploads are decoded one record at a time from the
+request stream, so only the record being checked and one chunk of input are
+held in memory, and reading stops as soon as a record is rejected.
+"""
+
+import re
+import json
+import codecs
+
+# The number of bytes read from a request stream at a time.
+CHUNK_SIZE = 65536
+
+_NOT_WHITESPACE = re.compile(r'[^ \t\n\r]')
+
+
+class RestrictedFieldError(ValueError):
+    """Raised when a request body includes a field the governing rule restricts from requests.
+
+    Attributes:
+        field (str): The restricted field.
+    """
+
+    def __init__(self, field: str):
+        super(RestrictedFieldError, self).__init__('Field \'{}\' may not be included in requests.'.format(field))
+        self.field = field
+
+
+def first_restricted_field(record, restricted_fields: frozenset):
+    """Find the first key of a record that is restricted.
+    Args:
+        record (dict): A request record.
+        restricted_fields (frozenset): The fields restricted from requests.
+    Returns:
+        str: The first restricted key in the record's order, or None.
+    Raises:
+        ValueError: If the record is not a JSON object.
+    """
+
+    if not isinstance(record, dict):
+        raise ValueError('Request records must be JSON objects.')
+    for field in record:
+        if field in restricted_fields:
+            return field
+    return None
+
+
+class PrefixedStream(object):
+    """A binary stream yielding bytes already read from another stream, then the rest of that stream.
+
+    Attributes:
+        prefix (bytes): The bytes not yet returned from the start of the stream.
+        stream (obj): The binary file-like object the prefix was read from.
+    """
+
+    def __init__(self, prefix: bytes, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size: int = -1):
+        if len(self.prefix) == 0:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b''
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+
+def buffer_body(stream, size: int):
+    """Read the start of a request body of unknown length, such as a chunked one.
+    Args:
+        stream (obj): A binary file-like object holding the body.
+        size (int): The largest body held in memory.
+    Returns:
+        bytes or PrefixedStream: The whole body if it is at most ``size`` bytes long, otherwise a stream yielding
+        the whole body.
+    """
+
+    chunks = []
+    read = 0
+    while read <= size:
+        data = stream.read(size + 1 - read)
+        if len(data) == 0:
+            return b''.join(chunks)
+        chunks.append(data)
+        read += len(data)
+    return PrefixedStream(b''.join(chunks), stream)
+
+
+class _StreamReader(object):
+    """Decodes a byte stream into a text buffer on demand."""
+
+    def __init__(self, stream, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+
+    def fill(self, size: int):
+        """Read at least ``size`` more bytes unless the stream ends, discarding text already consumed."""
+
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        while size > 0 and not self.exhausted:
+            data = self.stream.read(self.chunk_size)
+            self.exhausted = len(data) == 0
+            self.buffer += self.decoder.decode(data, final=self.exhausted)
+            size -= len(data)
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end of the stream."""
+
+        while True:
+            match = _NOT_WHITESPACE.search(self.buffer, self.position)
+            if match is not None:
+                self.position = match.start()
+                return self.buffer[self.position]
+            self.position = len(self.buffer)
+            if self.exhausted:
+                return ''
+            self.fill(self.chunk_size)
+
+
+def iter_records(stream, chunk_size: int = CHUNK_SIZE):
+    """Decode the records of a JSON request body incrementally.
+    Args:
+        stream (obj): A binary file-like object holding the body.
+        chunk_size (int): The number of bytes read at a time.
+    Returns:
+        generator: The body itself if it is not an array, otherwise each element of the array in order.
+    Raises:
+        ValueError: If the body is empty or not valid JSON.
+    """
+
+    decoder = json.JSONDecoder()
+    reader = _StreamReader(stream, chunk_size)
+    first = reader.peek()
+    if first == '':
+        raise ValueError('Empty request body.')
+    if first != '[':
+        # a single record is decoded whole
+        reader.fill(float('inf'))
+        yield json.loads(reader.buffer)
+        return
+
+    reader.position += 1
+    expect_element = False
+    while True:
+        char = reader.peek()
+        if char == ']' and not expect_element:
+            reader.position += 1
+            if reader.peek() != '':
+                raise ValueError('Unexpected data after the request body.')
+            return
+        if char == '':
+            raise ValueError('Unterminated request body.')
+        while True:
+            try:
+                record, end = decoder.raw_decode(reader.buffer, reader.position)
+            except json.JSONDecodeError:
+                if reader.exhausted:
+                    raise
+                # the element continues past the buffer; at least double it so long elements are decoded few times
+                reader.fill(max(chunk_size, len(reader.buffer) - reader.position))
+                continue
+            if end < len(reader.buffer) or reader.exhausted or isinstance(record, (dict, list, str)):
+                break
+            # a number or literal at the end of the buffer may continue in the next chunk
+            reader.fill(chunk_size)
+        reader.position = end
+        yield record
+
+        char = reader.peek()
+        if char == ',':
+            reader.position += 1
+            expect_element = True
+        elif char == ']':
+            expect_element = False
+        else:
+            raise ValueError('Expected \',\' or \']\' in the request body.')
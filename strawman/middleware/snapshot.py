@@ -0,0 +1,269 @@
+"""Memory-Mapped Policy Snapshots.
+
+A snapshot is a read-only file holding the rules document of every role, built
+once (typically by the gunicorn master, or with ``flask snapshot-policies``) and
+memory-mapped by every worker, so the pages are shared through the OS page
+cache and workers compile roles from the map instead of querying for them.
+While a snapshot is attached, token lookups select only the ids and versions
+of a client's roles; rules are queried only for roles the snapshot lacks, such
+as roles changed since it was built. Each worker still holds its own compiled
+policies.
+
+The file is a fixed header (magic, format version, generation, index length),
+a compact JSON index mapping each role identifier to its version and the
+offset and length of its rules, and the concatenated rules documents. Each
+build is written to a new file named after its generation and published by
+atomically replacing the ``CURRENT`` pointer file; workers notice the new
+generation and swap to it between requests.
+"""
+
+import os
+import json
+import mmap
+import struct
+from time import monotonic
+from sqlalchemy import select
+
+from strawman.db import db, Role
+from strawman.middleware.policy import compile_policy, version_key, policy_cache
+
+MAGIC = b'SPOL'
+FORMAT_VERSION = 1
+
+# magic, format version, generation, index length
+_HEADER = struct.Struct('<4sHQI')
+
+# The file naming the current generation of a snapshot directory.
+POINTER_FILE = 'CURRENT'
+
+# The number of generations kept on disk, so workers can finish with the previous one.
+KEEP_GENERATIONS = 2
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is missing, truncated or of an unknown format."""
+
+
+def snapshot_path(directory: str, generation: int):
+    return os.path.join(directory, 'policies.{}.snapshot'.format(generation))
+
+
+def current_generation(directory: str):
+    """Read the current generation of a snapshot directory.
+    Args:
+        directory (str): The snapshot directory.
+    Returns:
+        int: The current generation, or None if no snapshot has been published.
+    """
+
+    try:
+        with open(os.path.join(directory, POINTER_FILE)) as pointer:
+            return int(pointer.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def _replace_atomically(path: str, data: bytes):
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, path)
+
+
+def write_snapshot(directory: str, roles, generation: int = None):
+    """Write and publish a new snapshot generation.
+
+    Every role is compiled first, so a snapshot containing an invalid rule is
+    never published.
+
+    Args:
+        directory (str): The snapshot directory.
+        roles (iterable): ``(role_id, version, rules)`` tuples; rules may be serialized or decoded.
+        generation (int): The generation to publish; defaults to one past the current generation.
+    Returns:
+        str: The path of the published snapshot.
+    """
+
+    if generation is None:
+        generation = (current_generation(directory) or 0) + 1
+
+    index = {}
+    blobs = []
+    offset = 0
+    for role_id, version, rules in roles:
+        if isinstance(rules, (str, bytes)):
+            rules = json.loads(rules)
+        compile_policy(role_id, version, rules)
+        blob = json.dumps(rules, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        index[role_id] = [version_key(version), offset, len(blob)]
+        blobs.append(blob)
+        offset += len(blob)
+
+    index_blob = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, generation, len(index_blob))
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, generation)
+    _replace_atomically(path, b''.join([header, index_blob] + blobs))
+    _replace_atomically(os.path.join(directory, POINTER_FILE), str(generation).encode('ascii'))
+
+    # workers that still map an older generation keep their pages after it is unlinked
+    for name in os.listdir(directory):
+        parts = name.split('.')
+        if len(parts) == 3 and parts[0] == 'policies' and parts[2] == 'snapshot' and parts[1].isdigit() and \
+                int(parts[1]) <= generation - KEEP_GENERATIONS:
+            os.remove(os.path.join(directory, name))
+    return path
+
+
+def build_snapshot(directory: str):
+    """Publish a snapshot of every role in the database; requires an application context.
+    Args:
+        directory (str): The snapshot directory.
+    Returns:
+        str: The path of the published snapshot.
+    """
+
+    rows = db.session.execute(select([Role.id, Role.date_last_updated, Role.rules])).fetchall()
+    return write_snapshot(directory, rows)
+
+
+def open_snapshot(directory: str):
+    """Map the current generation of a snapshot directory.
+    Args:
+        directory (str): The snapshot directory.
+    Returns:
+        PolicySnapshot: The current snapshot, or None if none has been published or it cannot be read.
+    """
+
+    generation = current_generation(directory)
+    if generation is None:
+        return None
+    try:
+        return PolicySnapshot(snapshot_path(directory, generation))
+    except (IOError, SnapshotError):
+        return None
+
+
+def preload_policies(directory: str = None):
+    """Compile every active role into the policy cache; requires an application context.
+
+    With a snapshot directory, roles are compiled from the current snapshot when
+    it holds the current version of every active role, which only takes a query
+    of role versions. Otherwise a new generation is published first.
+
+    Args:
+        directory (str): The snapshot directory, or None to load the rules from the database.
+    Returns:
+        int: The number of roles compiled.
+    """
+
+    active = Role.active.isnot(False)
+    if directory is None:
+        rows = db.session.execute(select([Role.id, Role.date_last_updated, Role.rules]).where(active)).fetchall()
+        for role_id, version, rules in rows:
+            policy_cache.load(role_id, version, rules)
+        return len(rows)
+
+    versions = db.session.execute(select([Role.id, Role.date_last_updated]).where(active)).fetchall()
+    snapshot = open_snapshot(directory)
+    if snapshot is None or any(snapshot.version(role_id) != version_key(version) for role_id, version in versions):
+        snapshot = PolicySnapshot(build_snapshot(directory))
+    for role_id, version in versions:
+        policy_cache.load(role_id, version, snapshot.rules(role_id))
+    return len(versions)
+
+
+class PolicySnapshot(object):
+    """A read-only, memory-mapped snapshot of role rules.
+
+    Attributes:
+        path (str): The snapshot file.
+        generation (int): The generation of the snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            try:
+                self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError('Empty policy snapshot {}.'.format(path))
+        try:
+            magic, format_version, self.generation, index_length = _HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            raise SnapshotError('Truncated policy snapshot {}.'.format(path))
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotError('Unrecognized policy snapshot {}.'.format(path))
+        self._data_offset = _HEADER.size + index_length
+        self._index = json.loads(self._map[_HEADER.size:self._data_offset].decode('utf-8'))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, role_id):
+        return role_id in self._index
+
+    def version(self, role_id: str):
+        """Return the stored version of a role, or None if the role is not in the snapshot."""
+
+        entry = self._index.get(role_id)
+        return entry[0] if entry is not None else None
+
+    def role_ids(self):
+        return list(self._index)
+
+    def rules(self, role_id: str, version=None):
+        """Read the rules document of a role.
+        Args:
+            role_id (str): The identifier of the role.
+            version (any): If given, the version the stored rules must have.
+        Returns:
+            dict: The rules document, or None if the role is missing or its stored version differs.
+        """
+
+        entry = self._index.get(role_id)
+        if entry is None or (version is not None and entry[0] != version_key(version)):
+            return None
+        start = self._data_offset + entry[1]
+        return json.loads(self._map[start:start + entry[2]].decode('utf-8'))
+
+    def close(self):
+        self._map.close()
+
+
+class SnapshotStore(object):
+    """Follows the current generation of a snapshot directory.
+
+    The pointer file is checked at most once per check interval; when it names
+    a new generation, the new snapshot is mapped and replaces the previous one
+    in a single assignment, so concurrent readers see one or the other.
+
+    Attributes:
+        directory (str): The snapshot directory.
+        check_interval (float): The minimum number of seconds between checks for a new generation.
+    """
+
+    def __init__(self, directory: str, check_interval: float = 1.0, timer=monotonic):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._timer = timer
+        self._snapshot = None
+        self._checked = None
+
+    def current(self):
+        """Return the current snapshot, swapping to a newer generation if one was published.
+        Returns:
+            PolicySnapshot: The current snapshot, or None if none has been published.
+        """
+
+        now = self._timer()
+        if self._checked is not None and now - self._checked < self.check_interval:
+            return self._snapshot
+        self._checked = now
+        generation = current_generation(self.directory)
+        if generation is not None and (self._snapshot is None or self._snapshot.generation != generation):
+            # a generation that has already been replaced fails to open; it is picked up on the next check
+            self._snapshot = open_snapshot(self.directory) or self._snapshot
+        return self._snapshot
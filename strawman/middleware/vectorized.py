@@ -0,0 +1,248 @@
+"""Vectorized Redaction Engine.
+
+An optional engine for bulk exports. Each batch of rows is transposed into
+columns, the columns referenced by filters are loaded into NumPy arrays, and the
+rule's access policies and redaction filters are evaluated as boolean masks over
+the whole batch at once. Access policies are applied here rather than in SQL,
+which suits full-table exports that scan every row anyway. Results are identical
+to those of the row-by-row engine.
+
+NumPy is an optional dependency; the engine raises ImportError when it is used
+without NumPy installed.
+"""
+
+import operator
+from sqlalchemy import select
+
+from strawman.middleware.expressions import ExpressionError, Wildcard, Field, Literal, Compare, And, Or, Not,\
+    any_of, fields
+from strawman.middleware.policy import compile_rule
+from strawman.middleware.redaction import REDACTED_VALUE, model_columns, projected_fields, redaction_filters
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# The comparison that holds exactly when the original does not.
+_NEGATED_OPERATORS = {'==': '!=', '!=': '==', '<': '>=', '<=': '>', '>': '<=', '>=': '<'}
+
+# Comparisons with the operands swapped.
+_REFLECTED_OPERATORS = {'==': '==', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+_ARRAY_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('The vectorized redaction engine requires NumPy.')
+
+
+class ColumnArray(object):
+    """A batch column as a NumPy array with a separate null mask.
+
+    Numeric columns are stored with a numeric dtype (nulls filled with zero); all
+    other columns keep their Python objects.
+
+    Attributes:
+        values (ndarray): The column values.
+        nulls (ndarray): True where the value is null.
+    """
+
+    __slots__ = ('values', 'nulls')
+
+    def __init__(self, column):
+        objects = numpy.empty(len(column), dtype=object)
+        objects[:] = column
+        self.nulls = numpy.fromiter((value is None for value in column), dtype=bool, count=len(column))
+        self.values = objects
+        present = objects[~self.nulls]
+        if len(present) > 0 and type(present[0]) in (int, float):
+            typed = numpy.array(present.tolist())
+            if typed.dtype.kind in 'iuf':
+                self.values = numpy.zeros(len(objects), dtype=typed.dtype)
+                self.values[~self.nulls] = typed
+
+
+def _where(compare, left: ColumnArray, right, present):
+    """Apply a comparison at the positions of a mask, leaving every other position False."""
+
+    result = numpy.zeros(len(present), dtype=bool)
+    right_values = right.values[present] if isinstance(right, ColumnArray) else right
+    result[present] = numpy.asarray(compare(left.values[present], right_values), dtype=bool)
+    return result
+
+
+def _compare(op: str, left, right, size: int):
+    """Evaluate a comparison between resolved operands as a boolean mask."""
+
+    compare = _ARRAY_OPERATORS[op]
+    if not isinstance(left, ColumnArray):
+        # both operands are constants
+        if op in ('==', '!='):
+            result = compare(left, right)
+        else:
+            result = left is not None and right is not None and compare(left, right)
+        return numpy.full(size, bool(result))
+    if isinstance(right, ColumnArray):
+        both = ~left.nulls & ~right.nulls
+        if op in ('==', '!='):
+            equal = (left.nulls & right.nulls) | _where(operator.eq, left, right, both)
+            return equal if op == '==' else ~equal
+        return _where(compare, left, right, both)
+    if right is None:
+        if op == '==':
+            return left.nulls.copy()
+        if op == '!=':
+            return ~left.nulls
+        return numpy.zeros(size, dtype=bool)
+    if op == '!=':
+        return left.nulls | _where(compare, left, right, ~left.nulls)
+    return _where(compare, left, right, ~left.nulls)
+
+
+def _operand(node, arrays: dict):
+    if isinstance(node, Field):
+        if node.name not in arrays:
+            raise ExpressionError('Unknown field {!r}.'.format(node.name))
+        return arrays[node.name]
+    if isinstance(node, Literal):
+        return node.value
+    raise ExpressionError('Only fields and constants can be compared in vectorized filters.')
+
+
+def evaluate_mask(node, arrays: dict, size: int):
+    """Evaluate an expression tree over a batch of columns.
+    Args:
+        node (tuple): The root node of the expression tree.
+        arrays (dict): The batch's ColumnArray objects keyed by field name.
+        size (int): The number of rows in the batch.
+    Returns:
+        ndarray: A boolean mask that is True for each row the filter applies to.
+    """
+
+    _require_numpy()
+    if isinstance(node, Wildcard):
+        return numpy.ones(size, dtype=bool)
+    if isinstance(node, Compare):
+        op, left, right = node.op, node.left, node.right
+        if not isinstance(left, Field) and isinstance(right, Field):
+            op, left, right = _REFLECTED_OPERATORS[op], right, left
+        return _compare(op, _operand(left, arrays), _operand(right, arrays), size)
+    if isinstance(node, And):
+        return numpy.logical_and.reduce([evaluate_mask(operand, arrays, size) for operand in node.operands])
+    if isinstance(node, Or):
+        return numpy.logical_or.reduce([evaluate_mask(operand, arrays, size) for operand in node.operands])
+    if isinstance(node, Not):
+        return ~evaluate_mask(node.operand, arrays, size)
+    if isinstance(node, Literal):
+        return numpy.full(size, bool(node.value))
+    column = _operand(node, arrays)
+    return _where(lambda values, _: values.astype(bool), column, None, ~column.nulls)
+
+
+def evaluate_definite_mask(node, arrays: dict, size: int, negated: bool = False):
+    """Evaluate an expression tree over a batch of columns the way SQL does.
+
+    A comparison with a null field is unknown rather than false, so the mask
+    matches the row filter the row-by-row engine compiles for access policies.
+
+    Args:
+        node (tuple): The root node of the expression tree.
+        arrays (dict): The batch's ColumnArray objects keyed by field name.
+        size (int): The number of rows in the batch.
+        negated (bool): Evaluate the negation of the expression.
+    Returns:
+        ndarray: A boolean mask that is True for each row the (negated) filter definitely applies to.
+    """
+
+    _require_numpy()
+    if isinstance(node, Wildcard):
+        return numpy.full(size, not negated)
+    if isinstance(node, Not):
+        return evaluate_definite_mask(node.operand, arrays, size, not negated)
+    if isinstance(node, (And, Or)):
+        reduce = numpy.logical_and.reduce if isinstance(node, And) != negated else numpy.logical_or.reduce
+        return reduce([evaluate_definite_mask(operand, arrays, size, negated) for operand in node.operands])
+    if isinstance(node, Compare):
+        op, left, right = node.op, node.left, node.right
+        if not isinstance(left, Field) and isinstance(right, Field):
+            op, left, right = _REFLECTED_OPERATORS[op], right, left
+        if negated:
+            op = _NEGATED_OPERATORS[op]
+        left, right = _operand(left, arrays), _operand(right, arrays)
+        if not isinstance(left, ColumnArray) or right is None:
+            # constant comparisons and null tests are never unknown
+            return _compare(op, left, right, size)
+        known = ~left.nulls & ~right.nulls if isinstance(right, ColumnArray) else ~left.nulls
+        return _compare(op, left, right, size) & known
+    if isinstance(node, Literal):
+        return numpy.full(size, bool(node.value) != negated)
+    column = _operand(node, arrays)
+    truthy = _where(lambda values, _: values.astype(bool), column, None, ~column.nulls)
+    return ~truthy & ~column.nulls if negated else truthy
+
+
+def vectorized_query(ruleset, model):
+    """Build the statement and batch function of the vectorized engine for a rule's view of a model.
+    Args:
+        ruleset (CompiledRule or dict): The rule governing the export.
+        model (obj): The SQLAlchemy model being exported.
+    Returns:
+        Select, function: The Core statement selecting the permitted columns of every row, and a function turning a
+        batch of its rows into the response dicts of the rows the access policies permit.
+    """
+
+    _require_numpy()
+    rule = compile_rule(ruleset)
+    columns = model_columns(model)
+    fetched_fields, visible_fields = projected_fields(rule, model)
+    access_policy = any_of(rule.access_policies) if len(rule.access_policies) > 0 else None
+    if access_policy is not None:
+        required = fields(access_policy)
+        fetched_fields += tuple(field for field in columns.keys() if field in required and field not in fetched_fields)
+
+    redactions = redaction_filters(rule)
+    plan = [(fetched_fields.index(field), redactions.get(field)) for field in visible_fields]
+    referenced = set()
+    for _, expression in plan:
+        if expression is not None:
+            referenced |= fields(expression)
+    if access_policy is not None:
+        referenced |= fields(access_policy)
+    for field in referenced:
+        if field not in columns:
+            raise ExpressionError('Unknown field {!r}.'.format(field))
+    referenced = [(fetched_fields.index(field), field) for field in fetched_fields if field in referenced]
+
+    def redact_batch(rows):
+        size = len(rows)
+        if size == 0:
+            return []
+        batch = list(zip(*rows))
+        arrays = {field: ColumnArray(batch[index]) for index, field in referenced}
+        keep = numpy.ones(size, dtype=bool)
+        if access_policy is not None:
+            keep = evaluate_definite_mask(access_policy, arrays, size, negated=True)
+        masks = {}
+        output = []
+        for index, expression in plan:
+            values = numpy.empty(size, dtype=object)
+            values[:] = batch[index]
+            if expression is not None:
+                if expression not in masks:
+                    masks[expression] = evaluate_mask(expression, arrays, size)
+                values[masks[expression]] = REDACTED_VALUE
+            output.append(values[keep].tolist())
+        if len(output) == 0:
+            return [{} for _ in range(int(keep.sum()))]
+        return [dict(zip(visible_fields, values)) for values in zip(*output)]
+
+    return select([columns[field] for field in fetched_fields]), redact_batch
@@ -1,2 +1,4 @@
 from strawman.utilities.postgres import PostgreSQLContainer
 from strawman.utilities.responses import ResponseBody
+from strawman.utilities.cache import LRUCache
+from strawman.utilities.timing import Timings, timings
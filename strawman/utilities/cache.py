@@ -0,0 +1,136 @@
+"""Bounded In-Process Caches."""
+
+import threading
+from time import monotonic
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A thread-safe least-recently-used cache with optional entry expiry.
+
+    Attributes:
+        maxsize (int): The maximum number of entries held before the least recently used is evicted.
+        ttl (float): The number of seconds an entry stays valid, or None to never expire entries.
+        hits (int): The number of lookups that found a valid entry.
+        misses (int): The number of lookups that found no entry or an expired one.
+        evictions (int): The number of entries dropped to stay within maxsize.
+        expirations (int): The number of entries dropped because they outlived the ttl.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, timer=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def configure(self, maxsize: int = None, ttl: float = None):
+        """Change the size and expiry limits, evicting entries that no longer fit.
+        Args:
+            maxsize (int): The new maximum number of entries.
+            ttl (float): The new entry lifetime in seconds.
+        """
+
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, default=None):
+        """Retrieve an entry and mark it as recently used.
+        Args:
+            key (any): The key of the entry.
+            default (any): The value returned when the key is missing or expired.
+        Returns:
+            any: The cached value or the default.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires <= self._timer():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store an entry, evicting the least recently used entry when full.
+        Args:
+            key (any): The key of the entry.
+            value (any): The value to cache.
+        """
+
+        expires = self._timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop an entry.
+        Args:
+            key (any): The key of the entry.
+        Returns:
+            bool: True if an entry was dropped.
+        """
+
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def invalidate_where(self, predicate):
+        """Drop every entry matching a predicate.
+        Args:
+            predicate (function): Called with the key and value of each entry; entries it returns True for are dropped.
+        Returns:
+            int: The number of entries dropped.
+        """
+
+        with self._lock:
+            keys = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Report the cache counters.
+        Returns:
+            dict: The size, capacity and hit/miss/eviction/expiration counters.
+        """
+
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
@@ -1,6 +1,17 @@
-"""Standardized Response Bodies."""
+"""Standardized Response Bodies.
 
-from collections import OrderedDict
+Each kind of response body has an immutable envelope template: its status,
+code and keys in order, with the serialized JSON of the fixed parts. Bodies
+are built directly from their template as fresh dictionaries, and
+``encode_envelope`` serializes them by joining the template's fragments with
+the encoded values, so the payload is encoded once with a shared encoder.
+"""
+
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+from flask import Response, stream_with_context
 
 # Collection of exceptions and associated error messages.
 EXCEPTION_TYPES = {
@@ -9,18 +20,119 @@ EXCEPTION_TYPES = {
 }
 
 
+# The number of encoded results written to the client at a time when streaming.
+STREAM_CHUNK_SIZE = 500
+
+
+def json_default(value):
+    """Encode values the standard JSON encoder does not support.
+    Args:
+        value (any): The value to encode.
+    Returns:
+        str: The ISO 8601 representation of dates and datetimes.
+    """
+
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+class EnvelopeTemplate(namedtuple('EnvelopeTemplate', ['status', 'code', 'keys', 'prefix', 'fragments'])):
+    """The immutable template of a kind of response body.
+
+    Attributes:
+        status (str): The status of the response.
+        code (int): The HTTP status code.
+        keys (tuple): The keys of the body after ``status`` and ``code``, in order.
+        prefix (str): The serialized opening of the body, up to and including the code.
+        fragments (tuple): The serialized separator and name of each key.
+    """
+
+    __slots__ = ()
+
+
+@lru_cache(maxsize=256)
+def envelope_template(status: str, code: int, keys: tuple):
+    """Retrieve the template of a kind of response body.
+    Args:
+        status (str): The status of the response.
+        code (int): The HTTP status code.
+        keys (tuple): The keys of the body after ``status`` and ``code``, in order.
+    Returns:
+        EnvelopeTemplate: The template.
+    """
+
+    return EnvelopeTemplate(
+        status=status,
+        code=code,
+        keys=keys,
+        prefix='{{"status": {}, "code": {}'.format(json.dumps(status), json.dumps(code)),
+        fragments=tuple(', {}: '.format(json.dumps(key)) for key in keys))
+
+
+class Envelope(OrderedDict):
+    """A response body built from an envelope template.
+
+    Attributes:
+        template (EnvelopeTemplate): The template the body was built from.
+    """
+
+    def __init__(self, template: EnvelopeTemplate, *values):
+        super(Envelope, self).__init__()
+        self.template = template
+        self['status'] = template.status
+        self['code'] = template.code
+        for key, value in zip(template.keys, values):
+            self[key] = value
+
+
+def build_envelope(status: str, code: int, keys: tuple, *values):
+    """Build a response body.
+    Args:
+        status (str): The status of the response.
+        code (int): The HTTP status code.
+        keys (tuple): The keys of the body after ``status`` and ``code``, in order.
+        values (any): The value of each key.
+    Returns:
+        Envelope, int: The response body and HTTP status code.
+    """
+
+    return Envelope(envelope_template(status, code, keys), *values), code
+
+
+# Encodes response bodies; the C encoder is used since the encoder is not indenting.
+_encoder = json.JSONEncoder(default=json_default)
+
+
+def encode_envelope(body):
+    """Serialize a response body to JSON.
+    Args:
+        body (dict): The response body; an Envelope whose fixed parts are unchanged is serialized from its template.
+    Returns:
+        str: The JSON document.
+    """
+
+    template = getattr(body, 'template', None)
+    if template is None or len(body) != len(template.keys) + 2 or body['status'] != template.status or \
+            body['code'] != template.code:
+        return _encoder.encode(body)
+    parts = [template.prefix]
+    for fragment, key in zip(template.fragments, template.keys):
+        parts.append(fragment)
+        parts.append(_encoder.encode(body[key]))
+    parts.append('}')
+    return ''.join(parts)
+
+
+_MESSAGES = ('messages',)
+_MESSAGES_RESPONSE = ('messages', 'response')
+_MESSAGES_REQUEST = ('messages', 'request')
+_MESSAGES_REQUEST_RESPONSE = ('messages', 'request', 'response')
+
+
 class ResponseBody(object):
     """A response body handler."""
 
-    def __init__(self):
-        self.base_response = OrderedDict({
-            'status': 'OK',
-            'code': 200,
-            'messages': [],
-            'request': [],
-            'response': []
-        })
-
     def get_all_response(self, results: list, message: str = 'Successfully retrieved resources'):
         """Retrieve a list of responses.
         Args:
@@ -30,11 +142,58 @@ class ResponseBody(object):
             dict, int: The response object and HTTP status code.
         """
 
-        response = self.base_response.copy()
-        del(response['request'])
-        response['messages'].append('{}.'.format(message))
-        response['response'] = results
-        return response, response['code']
+        return build_envelope('OK', 200, _MESSAGES_RESPONSE, ['{}.'.format(message)], results)
+
+    def get_page_response(self, results: list, next_cursor: str = None,
+                          message: str = 'Successfully retrieved resources'):
+        """Retrieve one page of a list of responses.
+        Args:
+            results (list): The results on the page.
+            next_cursor (str): The cursor of the next page, or None if this is the last page.
+            message (str): The message to include in the response.
+        Returns:
+            dict, int: The response object and HTTP status code.
+        """
+
+        return build_envelope('OK', 200, ('messages', 'response', 'next_cursor'), ['{}.'.format(message)], results,
+                              next_cursor)
+
+    def stream_all_response(self, results, message: str = 'Successfully retrieved resources', ndjson: bool = False):
+        """Stream a list of responses to the client as they are produced.
+
+        The response's Server-Timing header is set before the results are
+        produced, so it leaves out the phases timed while streaming them.
+
+        Args:
+            results (iterable): The results to return, typically a generator.
+            message (str): The message to include in the response.
+            ndjson (bool): Write one JSON document per line for each result instead of a response envelope.
+        Returns:
+            Response: The streaming HTTP response.
+        """
+
+        def generate():
+            if not ndjson:
+                template = envelope_template('OK', 200, _MESSAGES_RESPONSE)
+                # everything up to and including the opening bracket of the response list
+                yield '{}{}{}{}['.format(template.prefix, template.fragments[0],
+                                         _encoder.encode(['{}.'.format(message)]), template.fragments[1])
+            separator = '\n' if ndjson else ','
+            chunk = []
+            first = True
+            for result in results:
+                chunk.append(_encoder.encode(result))
+                if len(chunk) >= STREAM_CHUNK_SIZE:
+                    yield ('' if first or ndjson else separator) + separator.join(chunk) + ('\n' if ndjson else '')
+                    first = False
+                    chunk = []
+            if len(chunk) > 0:
+                yield ('' if first or ndjson else separator) + separator.join(chunk) + ('\n' if ndjson else '')
+            if not ndjson:
+                yield ']}'
+
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        return Response(stream_with_context(generate()), status=200, mimetype=mimetype)
 
     def get_one_response(self, result: dict, message: str = 'Successfully retrieved resource', request=None):
         """Retrieve a single response.
@@ -46,14 +205,9 @@ class ResponseBody(object):
             dict, int: The response object and HTTP status code.
         """
 
-        response = self.base_response.copy()
         if request is None:
-            del(response['request'])
-        else:
-            response['request'] = request
-        response['messages'].append('{}.'.format(message))
-        response['response'] = result
-        return response, response['code']
+            return build_envelope('OK', 200, _MESSAGES_RESPONSE, ['{}.'.format(message)], result)
+        return build_envelope('OK', 200, _MESSAGES_REQUEST_RESPONSE, ['{}.'.format(message)], request, result)
 
     def not_found_response(self, id: any):
         """Return an object not found message.
@@ -63,39 +217,21 @@ class ResponseBody(object):
             dict, int: The response object and HTTP status code.
         """
 
-        response = self.base_response.copy()
-        response['status'] = 'Error'
-        response['code'] = 404
-        response['messages'].append('No resource with identifier \'{}\' found.'.format(id))
-        del(response['response'])
-        del(response['request'])
-        return response, response['code']
+        return build_envelope('Error', 404, _MESSAGES, ['No resource with identifier \'{}\' found.'.format(id)])
 
     def method_not_allowed_response(self):
         """Return a method not allowed message.
         Returns:
             dict, int: The response object and HTTP status code.
         """
-        response = self.base_response.copy()
-        response['status'] = 'Error'
-        response['code'] = 405
-        response['messages'].append('Method not allowed.')
-        del(response['response'])
-        del(response['request'])
-        return response, response['code']
+        return build_envelope('Error', 405, _MESSAGES, ['Method not allowed.'])
 
     def empty_request_body_response(self):
         """Return an empty request body message.
         Returns:
             dict, int: The response object and HTTP status code.
         """
-        response = self.base_response.copy()
-        response['status'] = 'Error'
-        response['code'] = 400
-        response['messages'].append('Empty request body.')
-        del(response['response'])
-        del(response['request'])
-        return response, response['code']
+        return build_envelope('Error', 400, _MESSAGES, ['Empty request body.'])
 
     def custom_response(self, status='Error', code=400, messages=[], request=[], response=[]):
         """Return a custom response message.
@@ -109,17 +245,13 @@ class ResponseBody(object):
             dict, int: The response object and HTTP status code.
         """
 
-        custom_response = OrderedDict()
-        custom_response['status'] = status
-        custom_response['code'] = code
-        if len(messages) > 0:
-            custom_response['messages'] = messages
-        if len(request) > 0:
-            custom_response['request'] = request
-        if len(response) > 0:
-            custom_response['response'] = response
-
-        return custom_response, custom_response['code']
+        keys = []
+        values = []
+        for key, value in (('messages', messages), ('request', request), ('response', response)):
+            if len(value) > 0:
+                keys.append(key)
+                values.append(value)
+        return build_envelope(status, code, tuple(keys), *values)
 
     def exception_response(self, exception_name: str, code=400, request=[], resp=[]):
         """Returns a custom response from an exception.
@@ -133,24 +265,15 @@ class ResponseBody(object):
             dict, int: The response object and HTTP status code.
         """
 
-        response = self.base_response.copy()
-        response['status'] = 'Error'
-        response['code'] = code
-        if exception_name in EXCEPTION_TYPES:
-            response['messages'].append(EXCEPTION_TYPES[exception_name])
-        else:
-            response['messages'].append(EXCEPTION_TYPES['Unknown'])
+        keys = ['messages']
+        values = [[EXCEPTION_TYPES.get(exception_name, EXCEPTION_TYPES['Unknown'])]]
         if len(request) > 0:
-            response['request'].append(request)
-        else:
-            del(response['request'])
-
+            keys.append('request')
+            values.append([request])
         if len(resp) > 0:
-            response['response'].append(resp)
-        else:
-            del(response['response'])
-
-        return response, response['code']
+            keys.append('response')
+            values.append([resp])
+        return build_envelope('Error', code, tuple(keys), *values)
 
     def successful_creation_response(self, resource_name: str, resource_id, request=[]):
         """Returns a successful creation message for a given resource.
@@ -161,16 +284,10 @@ class ResponseBody(object):
         Returns:
             dict, int: The response object and HTTP status code.
         """
-        response = self.base_response.copy()
-        response['code'] = 201
-        response['messages'].append('Successfully created new {} record.'.format(resource_name))
+        messages = ['Successfully created new {} record.'.format(resource_name)]
         if len(request) > 0:
-            response['request'].append(request)
-        else:
-            del(response['request'])
-        response['response'].append({'id': resource_id})
-
-        return response, response['code']
+            return build_envelope('OK', 201, _MESSAGES_REQUEST_RESPONSE, messages, [request], [{'id': resource_id}])
+        return build_envelope('OK', 201, _MESSAGES_RESPONSE, messages, [{'id': resource_id}])
 
     def successful_update_response(self, resource_name: str, resource_id, request=[]):
         """Returns a successful creation message for a given resource.
@@ -181,17 +298,11 @@ class ResponseBody(object):
         Returns:
             dict, int: The response object and HTTP status code.
         """
-        response = self.base_response.copy()
-        response['code'] = 200
-        response['messages'].append('Successfully updated existing {} record.'.format(resource_name))
+        messages = ['Successfully updated existing {} record.'.format(resource_name)]
         if len(request) > 0:
             request['id'] = resource_id
-            response['request'].append(request)
-        else:
-            del(response['request'])
-        del response['response']
-
-        return response, response['code']
+            return build_envelope('OK', 200, _MESSAGES_REQUEST, messages, [request])
+        return build_envelope('OK', 200, _MESSAGES, messages)
 
     def successful_delete_response(self, resource_name: str, resource_id, resp=[]):
         """Returns a successful creation message for a given resource.
@@ -203,13 +314,7 @@ class ResponseBody(object):
         Returns:
             dict, int: The response object and HTTP status code.
         """
-        response = self.base_response.copy()
-        response['code'] = 200
-        response['messages'].append('Successfully deleted {} record.'.format(resource_name))
-        response['request'].append({'id': resource_id})
+        messages = ['Successfully deleted {} record.'.format(resource_name)]
         if len(resp) > 0:
-            response['response'].append(resp)
-        else:
-            del response['response']
-
-        return response, response['code']
+            return build_envelope('OK', 200, _MESSAGES_REQUEST_RESPONSE, messages, [{'id': resource_id}], [resp])
+        return build_envelope('OK', 200, _MESSAGES_REQUEST, messages, [{'id': resource_id}])
@@ -0,0 +1,190 @@
+"""Request Timing Instrumentation.
+
+Phases of request handling (token lookup, rule matching, SQL, redaction, JSON
+encoding) are wrapped in spans. When instrumentation is enabled, each span adds
+its duration to the current request's totals, reported in a ``Server-Timing``
+response header, and to a process-wide histogram per phase, rendered in the
+Prometheus text format. When it is disabled, a span is a shared object whose
+enter and exit do nothing.
+
+The header is written before a streamed response body is produced, so for
+streamed responses it only reports the phases completed before streaming
+starts, such as the token lookup and rule matching. The SQL and redaction
+spans of the stream itself are still added to the histograms.
+"""
+
+from time import perf_counter
+from threading import Lock
+from flask import g, has_request_context
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# The name of the metric phase durations are exported as.
+METRIC_NAME = 'strawman_phase_duration_seconds'
+
+
+class Histogram(object):
+    """A cumulative histogram of observed durations.
+
+    Attributes:
+        buckets (tuple): The upper bound of each bucket, in seconds.
+        counts (list): The number of observations in each bucket (not cumulative).
+        sum (float): The sum of all observations.
+        count (int): The number of observations.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def cumulative_counts(self):
+        """Return the number of observations at or below each bucket bound."""
+
+        with self._lock:
+            total = 0
+            counts = []
+            for count in self.counts:
+                total += count
+                counts.append(total)
+            return counts, self.sum, self.count
+
+
+class _Span(object):
+    __slots__ = ('timings', 'phase', 'start')
+
+    def __init__(self, timings, phase: str):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.phase, perf_counter() - self.start)
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Timings(object):
+    """Per-request and process-wide timings of request phases.
+
+    Attributes:
+        enabled (bool): Whether spans are timed.
+        histograms (dict): The histogram of each phase observed so far.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: tuple = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """Enable timing according to the application's REQUEST_TIMING setting and report it on responses."""
+
+        self.enabled = app.config.get('REQUEST_TIMING', False)
+        app.after_request(self.add_server_timing)
+
+    def span(self, phase: str):
+        """Time a phase of request handling.
+        Args:
+            phase (str): The name of the phase.
+        Returns:
+            obj: A context manager timing its body.
+        """
+
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, phase)
+
+    def record(self, phase: str, seconds: float):
+        """Add a duration to the current request's totals and the phase's histogram.
+        Args:
+            phase (str): The name of the phase.
+            seconds (float): The duration.
+        """
+
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(phase, Histogram(self.buckets))
+        histogram.observe(seconds)
+        if has_request_context():
+            totals = g.setdefault('_phase_timings', {})
+            totals[phase] = totals.get(phase, 0.0) + seconds
+
+    def server_timing(self):
+        """Format the current request's phase totals as a Server-Timing header value.
+        Returns:
+            str: The header value, or None if no phase was timed.
+        """
+
+        totals = g.get('_phase_timings') if has_request_context() else None
+        if not totals:
+            return None
+        return ', '.join('{};dur={:.3f}'.format(phase, seconds * 1000) for phase, seconds in totals.items())
+
+    def add_server_timing(self, response):
+        """Set the Server-Timing header of a response; registered as an after-request handler.
+
+        Phases timed while a streamed body is produced run after this handler and are not reported.
+        """
+
+        header = self.server_timing()
+        if header is not None:
+            response.headers['Server-Timing'] = header
+        return response
+
+    def render(self):
+        """Render the phase histograms in the Prometheus text exposition format.
+        Returns:
+            str: The metrics document.
+        """
+
+        lines = [
+            '# HELP {} Time spent in each phase of request handling.'.format(METRIC_NAME),
+            '# TYPE {} histogram'.format(METRIC_NAME)
+        ]
+        for phase in sorted(self.histograms):
+            counts, total, count = self.histograms[phase].cumulative_counts()
+            for bound, bucket_count in zip(self.histograms[phase].buckets, counts):
+                lines.append('{}_bucket{{phase="{}",le="{}"}} {}'.format(METRIC_NAME, phase, bound, bucket_count))
+            lines.append('{}_bucket{{phase="{}",le="+Inf"}} {}'.format(METRIC_NAME, phase, count))
+            lines.append('{}_sum{{phase="{}"}} {}'.format(METRIC_NAME, phase, total))
+            lines.append('{}_count{{phase="{}"}} {}'.format(METRIC_NAME, phase, count))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Discard all recorded histograms."""
+
+        with self._lock:
+            self.histograms = {}
+
+
+timings = Timings()
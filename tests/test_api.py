@@ -1,11 +1,200 @@
 """Test API with Scope Middleware."""
 
 import pytest
+import io
 import json
+import asyncio
 from flask import Response
-from expects import expect, be, equal, raise_error, be_above_or_equal, contain
+from expects import expect, be, equal, raise_error, be_above_or_equal, contain, have_key, be_none
+
+from strawman import db, create_asgi_app
+from strawman.db import User, Role, Client, Token
+from strawman.middleware import process_response
+
+
+async def asgi_get(application, path: str, query: str = '', token: str = None, method: str = 'GET', body: list = None):
+    """Send one request to an ASGI application and decode its JSON response.
+
+    The chunks of ``body`` are removed from the list as the application receives them.
+    """
+
+    headers = [(b'host', b'localhost:8000')]
+    if token is not None:
+        headers.append((b'authorization', 'Bearer {}'.format(token).encode('latin-1')))
+    scope = {'type': 'http', 'method': method, 'scheme': 'http', 'path': path, 'root_path': '',
+             'query_string': query.encode('latin-1'), 'headers': headers}
+    messages = []
+
+    async def receive():
+        if not body:
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        return {'type': 'http.request', 'body': body.pop(0), 'more_body': len(body) > 0}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'].decode('utf-8'))
+
+
+class Lifespan(object):
+    """Drive the lifespan protocol of an ASGI application."""
+
+    def __init__(self, application):
+        self.application = application
+        self.events = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        self.task = None
+
+    async def startup(self):
+        self.task = asyncio.ensure_future(self.application({'type': 'lifespan'}, self.events.get, self.sent.put))
+        await self.events.put({'type': 'lifespan.startup'})
+        return (await self.sent.get())['type']
+
+    async def shutdown(self):
+        await self.events.put({'type': 'lifespan.shutdown'})
+        message = await self.sent.get()
+        await self.task
+        return message['type']
 
 
 class TestSecuredAPI(object):
     def test_api_access(self, client):
         expect(1).to(be(1))
+
+
+class TestAsgiAPI(object):
+    def test_asgi_access(self, app, scopes):
+        with app.app_context():
+            client = Client(id='asgi-client', client_name='ASGI Client')
+            client.roles = Role.query.filter(Role.role == 'programs:read-only').all()
+            db.session.add(client)
+            db.session.add(Token(token='asgi-token', client_id=client.id))
+            user = User(firstname='Ada', lastname='Lovelace', age=12)
+            user.ssn = '123121234'
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            rule = scopes[1]['scope']['ruleset'][0]['rule']
+            expected = json.loads(json.dumps(process_response(rule, User), default=str))
+
+        application = create_asgi_app(database_url=app.config['SQLALCHEMY_DATABASE_URI'])
+
+        request_body = [b'{"firstname": ', b'"Jane"}']
+
+        async def exercise():
+            lifespan = Lifespan(application)
+            expect(await lifespan.startup()).to(equal('lifespan.startup.complete'))
+            try:
+                return [
+                    await asgi_get(application, '/users', 'limit=1000', token='asgi-token'),
+                    await asgi_get(application, '/users/{}'.format(user_id), token='asgi-token'),
+                    await asgi_get(application, '/users', token='unknown-token'),
+                    await asgi_get(application, '/users', token='asgi-token', method='POST', body=request_body)
+                ]
+            finally:
+                expect(await lifespan.shutdown()).to(equal('lifespan.shutdown.complete'))
+
+        page, one, unauthorized, not_allowed = asyncio.run(exercise())
+
+        # the same rule applies under the ASGI API as under the Flask API
+        expect(page[0]).to(equal(200))
+        expect(page[1]['next_cursor']).to(be_none)
+        expect(len(page[1]['response'])).to(equal(len(expected)))
+        for result in page[1]['response']:
+            expect(result).not_to(have_key('ssn'))
+            expect(expected).to(contain(result))
+        expect(one[0]).to(equal(200))
+        expect(one[1]['response']).not_to(have_key('ssn'))
+        expect(unauthorized[0]).to(equal(401))
+        expect(unauthorized[1]['status']).to(equal('Unauthorized'))
+        expect(not_allowed[0]).to(equal(405))
+        expect(request_body).to(equal([]))
+
+
+class TestBatchAuthorization(object):
+    def test_authorize_batch(self, app):
+        with app.app_context():
+            client = Client(id='batch-client', client_name='Batch Client')
+            client.roles = Role.query.filter(Role.role == 'programs:read-only').all()
+            db.session.add(client)
+            db.session.add(Token(token='batch-token', client_id=client.id))
+            gateway = Client(id='gateway-client', client_name='Gateway Client')
+            gateway.roles = Role.query.filter(Role.role == 'all:full-access').all()
+            db.session.add(gateway)
+            db.session.add(Token(token='gateway-token', client_id=gateway.id))
+            db.session.commit()
+
+        def post(body=None, token='gateway-token'):
+            headers = {'Authorization': 'Bearer {}'.format(token)} if token is not None else {}
+            return app.test_client().post('/authorize/batch', json=body, headers=headers)
+
+        batch = {'requests': [
+            {'token': 'batch-token', 'url': 'http://localhost:8000/users', 'method': 'GET'},
+            {'token': 'batch-token', 'url': 'http://localhost:8000/users', 'method': 'DELETE'},
+            {'token': 'unknown-token', 'url': 'http://localhost:8000/users', 'method': 'GET'},
+            {'token': 'batch-token', 'url': 'http://localhost:8000/programs', 'method': 'GET'}
+        ]}
+
+        # the caller must be allowed to POST to the endpoint
+        expect(post(batch, token=None).status_code).to(equal(401))
+        expect(post(batch, token='batch-token').status_code).to(equal(401))
+
+        response = post(batch)
+        expect(response.status_code).to(equal(200))
+        decisions = response.get_json()['response']
+        expect(len(decisions)).to(equal(4))
+        expect(decisions[0]['allowed']).to(equal(True))
+        expect(decisions[0]['restricted_fields']).to(equal({'request': ['ssn'], 'response': ['ssn']}))
+        expect(decisions[0]['redacted_fields']).to(equal([]))
+        for decision in decisions[1:]:
+            expect(decision).to(equal({'allowed': False}))
+
+        expect(post({'requests': [{'token': 'batch-token'}]}).status_code).to(equal(400))
+        expect(post().status_code).to(equal(400))
+
+
+class TestRequestRestrictions(object):
+    def test_restricted_request_fields(self, app):
+        with app.app_context():
+            client = Client(id='writer-client', client_name='Writer Client')
+            client.roles = Role.query.filter(Role.role == 'all:restrict-redact-filter').all()
+            db.session.add(client)
+            db.session.add(Token(token='writer-token', client_id=client.id))
+            db.session.commit()
+
+        test_client = app.test_client()
+
+        def send(method, body=None, token='writer-token', **kwargs):
+            headers = {'Authorization': 'Bearer {}'.format(token)} if token is not None else {}
+            return test_client.open('/users/abc', method=method, json=body, headers=headers,
+                                    base_url='http://localhost:8000', **kwargs)
+
+        expect(send('PUT', {'firstname': 'Ada'}).status_code).to(equal(200))
+        response = send('PATCH', {'firstname': 'Ada', 'id': 'def'})
+        expect(response.status_code).to(equal(400))
+        expect(response.get_json()['messages']).to(equal(['Field \'id\' may not be included in requests.']))
+        expect(send('PUT', data='{"firstname"', content_type='application/json').status_code).to(equal(400))
+        expect(send('PUT', {'firstname': 'Ada'}, token=None).status_code).to(equal(401))
+
+        # bodies larger than the buffer size are checked as they are streamed
+        buffer_size = app.config['REQUEST_BODY_BUFFER_SIZE']
+        app.config['REQUEST_BODY_BUFFER_SIZE'] = 16
+        try:
+            records = [{'firstname': 'Ada'}] * 100
+            expect(send('POST', records).status_code).to(equal(200))
+            expect(send('POST', records + [{'id': 'def'}]).status_code).to(equal(400))
+        finally:
+            app.config['REQUEST_BODY_BUFFER_SIZE'] = buffer_size
+
+        # chunked bodies have no length, and are buffered or streamed by their size
+        def send_chunked(body):
+            return send('POST', input_stream=io.BytesIO(body), content_type='application/json',
+                        environ_overrides={'CONTENT_LENGTH': None, 'wsgi.input_terminated': True})
+
+        response = send_chunked(b'')
+        expect(response.status_code).to(equal(400))
+        expect(response.get_json()['messages']).to(equal(['Empty request body.']))
+        expect(send_chunked(b'{"firstname": "Ada"}').status_code).to(equal(200))
+        expect(send_chunked(json.dumps([{'firstname': 'Ada'}] * 10000 + [{'id': 'def'}]).encode('utf-8'))
+               .status_code).to(equal(400))
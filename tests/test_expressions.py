@@ -0,0 +1,63 @@
+"""Test Filter Expressions."""
+
+from expects import expect, equal, be_true, be_false, raise_error
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+from strawman.middleware.expressions import ExpressionError, Wildcard, Field, Literal, Compare, And, Or, Not,\
+    parse, fields, compile_predicate, compile_clause, any_of
+
+COLUMNS = ('age', 'field6', 'suffix')
+
+
+class TestExpressions(object):
+    def test_parse(self):
+        expect(parse('*')).to(equal(Wildcard()))
+        expect(parse('field6 != null')).to(equal(Compare('!=', Field('field6'), Literal(None))))
+        expect(parse('age >= 18 and age < 46')).to(equal(
+            And((Compare('>=', Field('age'), Literal(18)), Compare('<', Field('age'), Literal(46))))))
+        expect(parse('not (age < 18 or suffix is not null)')).to(equal(
+            Not(Or((Compare('<', Field('age'), Literal(18)), Compare('!=', Field('suffix'), Literal(None)))))))
+        expect(fields('age >= 18 and suffix = \'Jr\'')).to(equal(frozenset(['age', 'suffix'])))
+
+        # nodes of different kinds never compare equal
+        expect(Field('age') == Literal('age')).to(be_false)
+
+    def test_malformed_expressions(self):
+        for expression in ['', 'age <', 'age < 18 and', '(age < 18', 'age ; 1', 'age is 3']:
+            expect(lambda: parse(expression)).to(raise_error(ExpressionError))
+        expect(lambda: compile_predicate('height > 3', COLUMNS)).to(raise_error(ExpressionError))
+
+    def test_compile_predicate(self):
+        adult = compile_predicate('age >= 18 and age < 46', COLUMNS)
+        expect(adult((18, None, None))).to(be_true)
+        expect(adult((46, None, None))).to(be_false)
+
+        present = compile_predicate('field6 != null', COLUMNS)
+        expect(present((18, 'value', None))).to(be_true)
+        expect(present((18, None, None))).to(be_false)
+
+        # ordering comparisons against null never apply
+        expect(compile_predicate('age < 18', COLUMNS)((None, None, None))).to(be_false)
+        expect(compile_predicate('*', COLUMNS)((None, None, None))).to(be_true)
+
+    def test_any_of(self):
+        expect(any_of(['age < 18', '*'])).to(equal(Wildcard()))
+        redact = compile_predicate(any_of(['age < 18', 'suffix == \'Jr\'']), COLUMNS)
+        expect(redact((30, None, 'Jr'))).to(be_true)
+        expect(redact((30, None, 'Sr'))).to(be_false)
+
+    def test_compile_clause(self):
+        table = Table('expression_test', MetaData(), Column('age', Integer), Column('suffix', String))
+        clause = compile_clause('age >= 18 and age < 46', table.c)
+        expect(str(clause)).to(equal('expression_test.age >= :age_1 AND expression_test.age < :age_2'))
+
+        # negations are pushed down so rows with null fields are handled as in Python
+        clause = compile_clause('not (age < 18 or suffix is null)', table.c)
+        expect(str(clause)).to(equal(
+            '(expression_test.age IS NULL OR expression_test.age >= :age_1) AND expression_test.suffix IS NOT NULL'))
+
+        # without null safety a comparison with a null field is unknown, as in SQL
+        clause = compile_clause('not (age < 18 or suffix is null or suffix != age)', table.c, null_safe=False)
+        expect(str(clause)).to(equal('expression_test.age >= :age_1 AND expression_test.suffix IS NOT NULL AND '
+                                     'expression_test.suffix = expression_test.age'))
+        expect(lambda: compile_clause('age', table.c)).to(raise_error(ExpressionError))
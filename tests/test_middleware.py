@@ -1,13 +1,22 @@
 """Test Auth Server Middleware."""
 
 import pytest
+import io
 import json
-from expects import expect, be, equal, raise_error, be_above_or_equal, contain, have_key
-from datetime import datetime
+from expects import expect, be, equal, raise_error, be_above_or_equal, be_below, contain, have_key, be_none, be_true,\
+    be_false
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, event
 
-from strawman import db
-from strawman.db import User
-from strawman.middleware import process_request, process_response
+from strawman import db, create_app
+from strawman.db import User, Role, Client, Token, hash_token, load_token_policies, purge_expired_tokens,\
+    engine_options, REPLICA_BIND
+from strawman.middleware import process_request, process_response, stream_response, compile_rule, policy_cache,\
+    token_cache, decision_cache, handle_notification, preload_policies, current_generation, RestrictedFieldError,\
+    build_snapshot, SnapshotStore, load_clients_policies
+from strawman.middleware.auth_middleware import load_client_policies, match_rule, walk_rules
+from strawman.middleware.request_body import iter_records
+from strawman.middleware.redaction import projected_fields, row_filter, batch_redactor
 
 
 class TestAuthMiddleware(object):
@@ -64,3 +73,319 @@ class TestAuthMiddleware(object):
                 if response['age'] == 45:
                     expect(response['date_registered']).to(equal('**********'))
             print(responses)
+
+    def test_load_token_policies(self, app):
+        with app.app_context():
+            client = Client(id='token-policy-client', client_name='Token Policy Client')
+            client.roles = Role.query.filter(Role.role.in_(['all:full-access', 'programs:read-only'])).all()
+            db.session.add(client)
+            db.session.add(Token(token='token-policy-token', client_id=client.id))
+            db.session.commit()
+
+            rows = load_token_policies('token-policy-token')
+            expect(len(rows)).to(equal(2))
+            for row in rows:
+                expect(row.client_id).to(equal('token-policy-client'))
+                expect(row.role_id).to(equal(Role.query.get(row.role_id).id))
+
+            expect(len(load_token_policies('unknown-token'))).to(equal(0))
+
+    def test_expired_tokens(self, app):
+        with app.app_context():
+            client = Client(id='expiring-client', client_name='Expiring Client')
+            client.roles = Role.query.filter(Role.role == 'all:full-access').all()
+            db.session.add(client)
+            db.session.add(Token(token='expired-token', client_id=client.id,
+                                 expires_at=datetime.utcnow() - timedelta(minutes=1)))
+            db.session.add(Token(token='expiring-token', client_id=client.id,
+                                 expires_at=datetime.utcnow() + timedelta(hours=1)))
+            db.session.commit()
+
+            # only a hash of the token is stored
+            expect(Token.query.get(hash_token('expiring-token')).client_id).to(equal('expiring-client'))
+
+            expect(load_client_policies('expired-token')).to(be_none)
+            expect(len(load_client_policies('expiring-token'))).to(equal(1))
+
+            # a cached token is rejected once it expires, without querying again
+            entry = token_cache.get(hash_token('expiring-token'))
+            token_cache.set(hash_token('expiring-token'), entry[:2] + (datetime.utcnow() - timedelta(seconds=1),))
+            expect(load_client_policies('expiring-token')).to(be_none)
+            expect(hash_token('expiring-token') in token_cache).to(be_false)
+
+            expect(purge_expired_tokens(batch_size=1)).to(equal(1))
+            expect(Token.query.get(hash_token('expired-token'))).to(be_none)
+            expect(Token.query.get(hash_token('expiring-token'))).not_to(be_none)
+
+    def test_process_request(self, scopes):
+        rule = compile_rule(scopes[1]['scope']['ruleset'][0])
+        process_request(rule, {'firstname': 'Ada'})
+        process_request(rule, b'[{"firstname": "Ada"}, {"lastname": "Lovelace"}]')
+        expect(lambda: process_request(rule, {'firstname': 'Ada', 'ssn': '123'})).to(raise_error(RestrictedFieldError))
+        expect(lambda: process_request(rule, '[{"firstname": "Ada"}, 1]')).to(raise_error(ValueError))
+        expect(lambda: process_request(rule, b'{"firstname": ')).to(raise_error(ValueError))
+
+        # bulk bodies are read a chunk at a time, and reading stops at the first restricted field
+        records = [{'firstname': 'Zoë {}'.format(index), 'age': index} for index in range(1000)]
+        body = json.dumps(records[:10] + [{'ssn': '123'}] + records, ensure_ascii=False).encode('utf-8')
+        stream = io.BytesIO(body)
+        expect(lambda: process_request(rule, stream, chunk_size=7)).to(
+            raise_error(RestrictedFieldError, 'Field \'ssn\' may not be included in requests.'))
+        expect(stream.tell()).to(be_below(len(body) // 10))
+
+        for body in ([], records, {'firstname': 'Ada'}):
+            encoded = json.dumps(body, indent=1, ensure_ascii=False).encode('utf-8')
+            expected = body if isinstance(body, list) else [body]
+            expect(list(iter_records(io.BytesIO(encoded), chunk_size=5))).to(equal(expected))
+        for malformed in (b'', b'[', b'[{"age": 1},]', b'[{"age": 1}] x', b'[{"age": 1} {"age": 2}]'):
+            expect(lambda: list(iter_records(io.BytesIO(malformed), chunk_size=3))).to(raise_error(ValueError))
+
+    def test_redaction_in_sql(self, app, scopes):
+        with app.app_context():
+            test_scope = scopes[len(scopes) - 1]['scope']['ruleset'][0]['rule']
+            responses = process_response(test_scope, User)
+            sql_responses = process_response(test_scope, User, redact_in_sql=True)
+            expect(len(sql_responses)).to(equal(len(responses)))
+
+            # the database returns the same records, with the same types, as redaction in Python
+            def key(response):
+                return json.dumps(response, sort_keys=True, default=str)
+
+            expect(sorted(sql_responses, key=key)).to(equal(sorted(responses, key=key)))
+            expect([response for response in sql_responses if 'id' in response]).to(equal([]))
+
+    def test_projected_fields(self, scopes):
+        # restricted fields are never selected
+        rule = compile_rule(scopes[1]['scope']['ruleset'][0])
+        selected, visible = projected_fields(rule, User)
+        expect(selected).to(equal(('id', 'firstname', 'middlename', 'lastname', 'suffix', 'age', 'date_registered')))
+        expect(visible).to(equal(selected))
+
+        # unless a visible field's redaction filter depends on them
+        rule = compile_rule({'resource': '.*', 'restricted_fields': [{'field': 'age', 'request': True, 'response': True}],
+                             'redacted_fields': [{'field': 'ssn', 'filter': 'age < 18'}]})
+        selected, visible = projected_fields(rule, User)
+        expect('age' in selected).to(be(True))
+        expect('age' in visible).to(be(False))
+
+    def test_row_filter(self):
+        clause = row_filter(('age < 18', 'age >= 65'), User)
+        expect(str(clause)).to(equal('users.age >= :age_1 AND users.age < :age_2'))
+        expect(clause.compile().params).to(equal({'age_1': 18, 'age_2': 65}))
+        expect(row_filter((), User)).to(be(None))
+
+    def test_stream_response(self, app, scopes):
+        with app.app_context():
+            test_scope = scopes[len(scopes) - 1]['scope']['ruleset'][0]['rule']
+            streamed = list(stream_response(test_scope, User, batch_size=1))
+            expect(streamed).to(equal(process_response(test_scope, User)))
+
+    def test_batch_redactor(self, scopes):
+        rule = compile_rule(scopes[len(scopes) - 1]['scope']['ruleset'][0])
+        fetched, visible = projected_fields(rule, User)
+        redact_batch = batch_redactor(rule, fetched, visible)
+        rows = [
+            ('John', 'Evan', 'Doe', None, '123456789', 45, None),
+            ('Anthony', 'Paul', 'Doe', 'Jr', '21771294', 20, None)
+        ]
+        responses = redact_batch(rows)
+        expect(responses[0]).to(equal({'firstname': 'John', 'middlename': 'Evan', 'lastname': 'Doe', 'suffix': None,
+                                       'ssn': '**********', 'age': 45, 'date_registered': '**********'}))
+        expect(responses[1]).to(equal({'firstname': '**********', 'middlename': '**********',
+                                       'lastname': '**********', 'suffix': '**********', 'ssn': '**********',
+                                       'age': 20, 'date_registered': None}))
+        expect(redact_batch([])).to(equal([]))
+
+    def test_vectorized_stream_response(self, app, scopes):
+        pytest.importorskip('numpy')
+        with app.app_context():
+            for scope in scopes:
+                for rule in scope['scope']['ruleset']:
+                    streamed = list(stream_response(rule['rule'], User, batch_size=2, vectorized=True))
+                    expected = process_response(rule['rule'], User)
+                    expect(sorted(streamed, key=repr)).to(equal(sorted(expected, key=repr)))
+
+    def test_access_policy_null_fields(self, app):
+        pytest.importorskip('numpy')
+        rule = {
+            'resource': 'http://localhost:8000/users/[\\w]+',
+            'allowed_methods': ['*'],
+            'restricted_fields': [],
+            'redacted_fields': [],
+            'access_policies': [{'description': 'juniors', 'filter': "suffix == 'Jr'"}]
+        }
+        with app.app_context():
+            for firstname, suffix in (('Null', None), ('Junior', 'Jr'), ('Senior', 'Sr')):
+                user = User(firstname=firstname, lastname='Doe', age=30)
+                user.suffix = suffix
+                db.session.add(user)
+            db.session.commit()
+
+            # a policy on a null field is unknown, so the row stays hidden as it does in SQL
+            for rows in (process_response(rule, User), list(stream_response(rule, User, vectorized=True))):
+                expect([row['firstname'] for row in rows]).to(equal(['Senior']))
+
+    def test_handle_notification(self, app):
+        with app.app_context():
+            role = Role.query.filter_by(role='all:full-access').first()
+            policy_cache.for_role(role)
+            token_cache.set('notified-token-1', ('notified-client', ((role.id, role.date_last_updated),), None))
+            token_cache.set('notified-token-2', ('notified-client', ((role.id, role.date_last_updated),), None))
+            token_cache.set('other-token', ('other-client', ((role.id, role.date_last_updated),), None))
+
+            handle_notification(json.dumps({'table': 'tokens', 'key': 'notified-token-1'}))
+            expect('notified-token-1' in token_cache).to(be_false)
+
+            expect(handle_notification(json.dumps({'table': 'roles', 'key': 'notified-client'}))).to(equal(1))
+            expect('notified-token-2' in token_cache).to(be_false)
+            expect('other-token' in token_cache).to(be_true)
+
+            handle_notification(json.dumps({'table': 'oauth2_roles', 'key': role.id}))
+            expect(policy_cache.get(role.id, role.date_last_updated)).to(be_none)
+            token_cache.invalidate('other-token')
+
+    def test_decision_cache(self, app):
+        with app.app_context():
+            roles = Role.query.filter(Role.role.in_(['programs:read-only', 'get:participants-redaction'])).all()
+            policies = [policy_cache.for_role(role) for role in roles]
+            decision_cache.clear()
+
+            decision = match_rule(policies, 'http://localhost:8000/users', 'get')
+            expect(decision).to(equal(walk_rules(policies, 'http://localhost:8000/users', 'GET')))
+            expect(len(decision_cache)).to(equal(1))
+
+            # the same roles, URL and method reuse the decision
+            hits = decision_cache.hits
+            expect(match_rule(policies, 'http://localhost:8000/users', 'GET')).to(equal(decision))
+            expect(decision_cache.hits).to(equal(hits + 1))
+            expect(match_rule(policies, 'http://localhost:8000/users', 'DELETE')).to(equal((False, None)))
+            expect(len(decision_cache)).to(equal(2))
+
+            # other pages of the same resource share its decision
+            for cursor in ['abc', 'def']:
+                expect(match_rule(policies, 'http://localhost:8000/users?cursor={}&limit=10'.format(cursor), 'GET'))\
+                    .to(equal(decision))
+            expect(decision_cache.hits).to(equal(hits + 3))
+            expect(len(decision_cache)).to(equal(2))
+
+            handle_notification(json.dumps({'table': 'oauth2_roles', 'key': roles[0].id}))
+            expect(len(decision_cache)).to(equal(0))
+
+    def test_token_lookup_from_snapshot(self, app, scopes, tmp_path):
+        with app.app_context():
+            role = Role(role='snapshot:read-only', description='a snapshot role', rules=json.dumps(scopes[1]['scope']))
+            client = Client(id='snapshot-client', client_name='Snapshot Client')
+            client.roles = [role]
+            db.session.add(client)
+            db.session.add(Token(token='snapshot-token', client_id=client.id))
+            db.session.commit()
+            role_id = role.id
+            build_snapshot(str(tmp_path))
+
+            statements = []
+
+            def record(connection, cursor, statement, parameters, context, executemany):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            policy_cache.attach_snapshots(SnapshotStore(str(tmp_path)))
+            try:
+                # roles are compiled from the snapshot, so only their versions are queried
+                policy_cache.clear()
+                token_cache.clear()
+                policies = load_client_policies('snapshot-token')
+                expect([policy.role_id for policy in policies]).to(equal([role_id]))
+                expect(len(statements)).to(equal(1))
+                expect(statements[0]).not_to(contain('rules'))
+
+                # a role changed since the snapshot was built is loaded with its rules
+                version = datetime.utcnow() + timedelta(seconds=1)
+                role.date_last_updated = version
+                db.session.commit()
+                policy_cache.clear()
+                token_cache.clear()
+                del statements[:]
+                policies = load_clients_policies(['snapshot-token'])['snapshot-token']
+                expect(policies[0].version).to(equal(version))
+                expect(len(statements)).to(equal(2))
+                expect(statements[1]).to(contain('rules'))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+                policy_cache.attach_snapshots(None)
+                policy_cache.clear()
+                token_cache.clear()
+
+    def test_notification_revokes_snapshot_rules(self, app, scopes, tmp_path):
+        with app.app_context():
+            role = Role(role='snapshot:revoked', description='a revoked role', rules=json.dumps(scopes[1]['scope']))
+            client = Client(id='revoked-client', client_name='Revoked Client')
+            client.roles = [role]
+            db.session.add(client)
+            db.session.add(Token(token='revoked-token', client_id=client.id))
+            db.session.commit()
+            role_id = role.id
+            build_snapshot(str(tmp_path))
+
+            policy_cache.attach_snapshots(SnapshotStore(str(tmp_path)))
+            try:
+                policy_cache.clear()
+                token_cache.clear()
+                expect(load_client_policies('revoked-token')[0].scope).to(equal(scopes[1]['scope']['scope']))
+
+                # the rules change without a new version, so the snapshot still holds the old rules at that version
+                Role.query.get(role_id).rules = json.dumps(scopes[0]['scope'])
+                db.session.commit()
+                handle_notification(json.dumps({'table': 'oauth2_roles', 'key': role_id}))
+                expect(load_client_policies('revoked-token')[0].scope).to(equal(scopes[0]['scope']['scope']))
+            finally:
+                policy_cache.attach_snapshots(None)
+                policy_cache.clear()
+                token_cache.clear()
+
+    def test_preload_policies(self, app, tmp_path):
+        with app.app_context():
+            policy_cache.clear()
+            count = preload_policies(str(tmp_path))
+            expect(count).to(equal(Role.query.filter(Role.active.isnot(False)).count()))
+            for role in Role.query.all():
+                expect(policy_cache.get(role.id, role.date_last_updated)).not_to(be_none)
+
+            # a snapshot holding the current version of every role is reused
+            preload_policies(str(tmp_path))
+            expect(current_generation(str(tmp_path))).to(equal(1))
+
+            policy_cache.clear()
+            expect(preload_policies()).to(equal(count))
+            expect(len(policy_cache)).to(equal(count))
+
+
+class TestDatabaseRouting(object):
+    def test_engine_options(self):
+        options = engine_options('postgresql://dev_user@localhost/authservice_dev', pool_size=8, max_overflow=2,
+                                 statement_timeout=5000)
+        expect(options['pool_size']).to(equal(8))
+        expect(options['max_overflow']).to(equal(2))
+        expect(options['pool_pre_ping']).to(be_true)
+        expect(options['connect_args']).to(equal({'options': '-c statement_timeout=5000'}))
+
+        # SQLite databases are not pooled by size
+        expect(engine_options('sqlite://', pool_size=8)).to(equal({'pool_pre_ping': True}))
+
+    def test_read_replica(self, scopes, tmp_path):
+        app = create_app(database_url='sqlite:///{}'.format(tmp_path / 'primary.db'),
+                         replica_url='sqlite:///{}'.format(tmp_path / 'replica.db'))
+        with app.app_context():
+            replica = db.get_engine(bind=REPLICA_BIND)
+            for engine in [db.engine, replica]:
+                User.__table__.create(engine)
+            replica.execute(User.__table__.insert(), id='replica', firstname='Read', lastname='Replica', age=40)
+
+            # responses are read from the replica
+            rule = scopes[0]['scope']['ruleset'][0]['rule']
+            expect([response['firstname'] for response in process_response(rule, User)]).to(equal(['Read']))
+
+            # writes go to the primary
+            db.session.add(User('Write', 'Primary', 41))
+            db.session.commit()
+            expect(db.engine.execute(select([func.count()]).select_from(User.__table__)).scalar()).to(equal(1))
+            expect(len(process_response(rule, User))).to(equal(1))
@@ -0,0 +1,39 @@
+"""Test Keyset Pagination."""
+
+from expects import expect, equal, raise_error, contain
+
+from strawman.db import User
+from strawman.middleware import InvalidCursorError, compile_rule, paginate_response, process_response
+from strawman.middleware.pagination import rule_fingerprint, encode_cursor, decode_cursor
+
+
+class TestPagination(object):
+    def test_cursor_round_trip(self, scopes):
+        rule = compile_rule(scopes[len(scopes) - 1]['scope']['ruleset'][0])
+        fingerprint = rule_fingerprint(rule)
+        cursor = encode_cursor('abc123', fingerprint)
+        expect(decode_cursor(cursor, fingerprint)).to(equal('abc123'))
+
+        # cursors cannot be replayed under a different rule or tampered with
+        other = rule_fingerprint(compile_rule(scopes[0]['scope']['ruleset'][0]))
+        expect(lambda: decode_cursor(cursor, other)).to(raise_error(InvalidCursorError))
+        expect(lambda: decode_cursor('not a cursor', fingerprint)).to(raise_error(InvalidCursorError))
+        for last_key in ([], {'id': 'abc123'}, None, True, 1.5):
+            expect(lambda: decode_cursor(encode_cursor(last_key, fingerprint), fingerprint))\
+                .to(raise_error(InvalidCursorError))
+
+    def test_paginate_response(self, app, scopes):
+        with app.app_context():
+            test_scope = scopes[len(scopes) - 1]['scope']['ruleset'][0]['rule']
+            pages = []
+            results, cursor = paginate_response(test_scope, User, limit=1)
+            pages.extend(results)
+            while cursor is not None:
+                results, cursor = paginate_response(test_scope, User, limit=1, cursor=cursor)
+                pages.extend(results)
+
+            # paging never exposes the restricted primary key and visits every permitted row once
+            expected = process_response(test_scope, User)
+            expect(len(pages)).to(equal(len(expected)))
+            for result in pages:
+                expect(expected).to(contain(result))
@@ -0,0 +1,130 @@
+"""Test Compiled Scope Policies."""
+
+import json
+from datetime import datetime, timedelta
+from expects import expect, be, be_none, equal, be_true, be_false
+
+from strawman.middleware import PolicyCache, RuleIndex, PolicySnapshot, SnapshotStore, compile_policy, compile_rule,\
+    write_snapshot, current_generation, merge_rules
+from strawman.middleware.auth_middleware import walk_rules
+from strawman.middleware.matcher import literal_prefix
+
+
+class TestCompiledPolicy(object):
+    def test_compile_rule(self, scopes):
+        rule = compile_rule(scopes[len(scopes) - 1]['scope']['ruleset'][0])
+        expect(rule.matches('http://localhost:8000/users/abc123')).to(be_true)
+        expect(rule.matches('http://localhost:8000/programs')).to(be_false)
+        expect(rule.allows('DELETE')).to(be_true)
+        expect(rule.restricted_response_fields).to(equal(frozenset(['id'])))
+        expect(rule.redacted_fields[0]).to(equal(('ssn', '*')))
+        expect(rule.access_policies).to(equal(('age < 18',)))
+
+        # rules without any allowed methods deny everything
+        rule = compile_rule(scopes[3]['scope']['ruleset'][0])
+        expect(rule.allows('GET')).to(be_false)
+
+    def test_policy_cache_versions(self, scopes):
+        cache = PolicyCache()
+        version = datetime.utcnow()
+        rules = json.dumps(scopes[0]['scope'])
+        policy = cache.load('role-1', version, rules)
+        expect(policy.scope).to(equal('all:full-access'))
+        expect(cache.load('role-1', version, rules)).to(be(policy))
+
+        # a newer version of the role replaces the compiled entry
+        newer = cache.load('role-1', version + timedelta(seconds=1), scopes[1]['scope'])
+        expect(newer.scope).to(equal('programs:read-only'))
+        expect(cache.get('role-1', version)).to(be_none)
+        expect(len(cache)).to(equal(1))
+
+        cache.invalidate('role-1')
+        expect(len(cache)).to(equal(0))
+
+    def test_compile_policy_accepts_documents(self, scopes):
+        policy = compile_policy('role-2', None, scopes[2]['scope'])
+        expect(len(policy.rules)).to(equal(1))
+        expect(policy.rules[0].restricted_request_fields).to(equal(frozenset(['ssn'])))
+
+
+class TestMergeRules(object):
+    def test_merge_rules(self, scopes):
+        read_only, redaction, complex_rule = [compile_rule(scopes[index]['scope']['ruleset'][0])
+                                              for index in (1, 2, len(scopes) - 1)]
+        expect(merge_rules([read_only])).to(be(read_only))
+
+        merged = merge_rules([read_only, redaction, complex_rule])
+        expect(merged.source).to(equal(merge_rules([complex_rule, read_only, redaction]).source))
+        expect(merged.restricted_response_fields).to(equal(
+            read_only.restricted_response_fields | redaction.restricted_response_fields |
+            complex_rule.restricted_response_fields))
+        expect(set(merged.redacted_fields)).to(equal(set(redaction.redacted_fields + complex_rule.redacted_fields)))
+        expect(set(merged.access_policies)).to(equal(set(complex_rule.access_policies)))
+        expect(merged.allowed_methods).to(equal(frozenset(['GET'])))
+
+    def test_contradictory_rules_deny(self, scopes):
+        policies = [compile_policy(scope['name'], None, scope['scope']) for scope in scopes[:2]]
+        for ordered in (policies, policies[::-1]):
+            expect(walk_rules(ordered, 'http://localhost:8000/users', 'DELETE')).to(equal((False, None)))
+            allowed, rule = walk_rules(ordered, 'http://localhost:8000/users', 'GET')
+            expect(allowed).to(be_true)
+            expect(rule.restricted_response_fields).to(equal(frozenset(['ssn'])))
+
+
+class TestPolicySnapshot(object):
+    def test_write_and_map(self, scopes, tmp_path):
+        version = datetime(2019, 8, 21, 12, 0)
+        roles = [('role-{}'.format(index), version, json.dumps(scope['scope'])) for index, scope in enumerate(scopes)]
+        path = write_snapshot(str(tmp_path), roles)
+        expect(current_generation(str(tmp_path))).to(equal(1))
+
+        snapshot = PolicySnapshot(path)
+        expect(len(snapshot)).to(equal(len(scopes)))
+        expect(snapshot.rules('role-1', version)).to(equal(scopes[1]['scope']))
+        expect(snapshot.rules('role-1', version + timedelta(seconds=1))).to(be_none)
+        expect(snapshot.rules('unknown-role')).to(be_none)
+        snapshot.close()
+
+    def test_generation_swap(self, scopes, tmp_path):
+        version = datetime(2019, 8, 21, 12, 0)
+        directory = str(tmp_path)
+        write_snapshot(directory, [('role-1', version, scopes[0]['scope']), ('role-2', version, scopes[1]['scope'])])
+        cache = PolicyCache(snapshots=SnapshotStore(directory, check_interval=0))
+
+        # misses are compiled from the snapshot when it holds the requested version
+        policy = cache.get('role-1', version)
+        expect(policy.scope).to(equal('all:full-access'))
+        expect(cache.get('role-2', version).scope).to(equal('programs:read-only'))
+
+        # roles changed in the next generation are evicted, unchanged roles are kept
+        newer = version + timedelta(seconds=1)
+        write_snapshot(directory, [('role-1', version, scopes[0]['scope']), ('role-2', newer, scopes[2]['scope'])])
+        expect(cache.get('role-1', version)).to(be(policy))
+        expect(cache.get('role-2', version)).to(be_none)
+        expect(cache.get('role-2', newer).scope).to(equal('get:participants-redaction'))
+
+
+class TestRuleIndex(object):
+    def test_literal_prefix(self):
+        expect(literal_prefix('http://localhost:8000/users')).to(equal(('http://localhost:8000/users', '')))
+        expect(literal_prefix('http://localhost:8000/users/[\\w]+')).to(
+            equal(('http://localhost:8000/users/', '[\\w]+')))
+        expect(literal_prefix('users\\.json?')).to(equal(('users.jso', 'n?')))
+        expect(literal_prefix('[\\S]+')).to(equal(('', '[\\S]+')))
+
+    def test_match_in_declaration_order(self, scopes):
+        policies = [compile_policy(scope['name'], None, scope['scope']) for scope in scopes]
+        index = RuleIndex(policies)
+        for url in ['http://localhost:8000/users', 'http://localhost:8000/users/abc123', 'http://other/']:
+            expected = [(scope_index, rule) for scope_index, policy in enumerate(policies)
+                        for rule in policy.rules if rule.pattern.match(url)]
+            expect(index.match(url)).to(equal(expected))
+
+    def test_group_references_are_not_combined(self):
+        rules = [{'resource': 'x(z)', 'allowed_methods': ['GET']},
+                 {'resource': 'x(a)?(?(1)b|c)', 'allowed_methods': ['GET']},
+                 {'resource': 'x(a)\\1', 'allowed_methods': ['GET']}]
+        index = RuleIndex([compile_policy('role-1', None, {'scope': 'test', 'ruleset': rules})])
+        for url in ['xab', 'xac', 'xc', 'xaa', 'xz']:
+            expected = [position for position, (_, rule) in enumerate(index.entries) if rule.pattern.match(url)]
+            expect(list(index.match_positions(url))).to(equal(expected))
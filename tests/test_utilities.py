@@ -0,0 +1,156 @@
+"""Test Utilities."""
+
+import json
+from datetime import datetime
+from flask import Response
+from expects import expect, be_none, equal, be_true, be_false, contain, start_with, have_len
+
+from strawman.utilities import LRUCache, ResponseBody, Timings
+from strawman.utilities.responses import encode_envelope, json_default
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(object):
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        expect(cache.get('a')).to(equal(1))
+        cache.set('c', 3)
+
+        # 'b' was the least recently used entry
+        expect(cache.get('b')).to(be_none)
+        expect(cache.get('a')).to(equal(1))
+        expect(cache.stats()).to(equal(
+            {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 1, 'evictions': 1, 'expirations': 0}))
+
+    def test_ttl_expiry(self):
+        timer = FakeTimer()
+        cache = LRUCache(maxsize=10, ttl=5, timer=timer)
+        cache.set('token', ('client', ()))
+        timer.now = 4.9
+        expect(cache.get('token')).to(equal(('client', ())))
+        timer.now = 5.0
+        expect(cache.get('token')).to(be_none)
+        expect(cache.expirations).to(equal(1))
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.set('token', 'value')
+        expect(cache.invalidate('token')).to(be_true)
+        expect(cache.invalidate('token')).to(be_false)
+        expect('token' in cache).to(be_false)
+
+    def test_invalidate_where(self):
+        cache = LRUCache()
+        cache.set('token-1', ('client-1', ()))
+        cache.set('token-2', ('client-2', ()))
+        cache.set('token-3', ('client-1', ()))
+        expect(cache.invalidate_where(lambda token, entry: entry[0] == 'client-1')).to(equal(2))
+        expect(len(cache)).to(equal(1))
+        expect('token-2' in cache).to(be_true)
+
+
+class TestTimings(object):
+    def test_disabled_spans(self, app):
+        timings = Timings(enabled=False)
+        with app.test_request_context():
+            with timings.span('sql'):
+                pass
+            expect(timings.server_timing()).to(be_none)
+        expect(timings.histograms).to(equal({}))
+
+    def test_spans(self, app):
+        timings = Timings(enabled=True, buckets=(0.5, 1.0))
+        with app.test_request_context():
+            timings.record('sql', 0.25)
+            timings.record('sql', 0.75)
+            with timings.span('redact'):
+                pass
+            expect(timings.server_timing()).to(start_with('sql;dur=1000.000, redact;dur='))
+
+        metrics = timings.render().splitlines()
+        expect(metrics).to(contain('strawman_phase_duration_seconds_bucket{phase="sql",le="0.5"} 1'))
+        expect(metrics).to(contain('strawman_phase_duration_seconds_bucket{phase="sql",le="+Inf"} 2'))
+        expect(metrics).to(contain('strawman_phase_duration_seconds_count{phase="redact"} 1'))
+
+    def test_streamed_spans(self, app):
+        timings = Timings(enabled=True)
+
+        def generate():
+            with timings.span('sql'):
+                pass
+            yield 'streamed'
+
+        with app.test_request_context():
+            with timings.span('token'):
+                pass
+            response = timings.add_server_timing(Response(generate()))
+
+            # the header only reports phases completed before the body is streamed
+            expect(response.headers['Server-Timing']).to(start_with('token;dur='))
+            expect(response.headers['Server-Timing']).not_to(contain('sql'))
+            expect(response.get_data(as_text=True)).to(equal('streamed'))
+        expect(timings.histograms['sql'].count).to(equal(1))
+
+    def test_metrics_endpoint(self, client):
+        response = client.get('/metrics')
+        expect(response.status_code).to(equal(200))
+        expect(response.get_data(as_text=True)).to(contain('# TYPE strawman_phase_duration_seconds histogram'))
+
+
+class TestResponseBody(object):
+    def test_envelopes_are_independent(self):
+        response_body = ResponseBody()
+        for _ in range(3):
+            body, code = response_body.get_one_response(result={'id': '1'})
+        expect(body['messages']).to(equal(['Successfully retrieved resource.']))
+        body['messages'].append('Changed.')
+        expect(response_body.not_found_response('1')[0]['messages']).to(have_len(1))
+        expect(response_body.get_all_response([])[0]['messages']).to(have_len(1))
+
+    def test_encode_envelope(self):
+        response_body = ResponseBody()
+        results = [{'id': str(index), 'date_registered': datetime(2019, 8, 21)} for index in range(3)]
+        bodies = [
+            response_body.get_all_response(results),
+            response_body.get_page_response(results, next_cursor='abc'),
+            response_body.get_one_response(results[0], request={'id': '0'}),
+            response_body.not_found_response('0'),
+            response_body.custom_response(status='Unauthorized', code=401, messages=['Denied.']),
+            response_body.exception_response('IntegrityError', request={'id': '0'}),
+            response_body.successful_creation_response('user', '0', request={'id': '0'}),
+            response_body.successful_update_response('user', '0'),
+            response_body.successful_delete_response('user', '0')
+        ]
+        for body, code in bodies:
+            expect(code).to(equal(body['code']))
+            expect(encode_envelope(body)).to(equal(json.dumps(body, default=json_default)))
+
+        # bodies changed after they were built are encoded in full
+        body, code = response_body.not_found_response('0')
+        body['status'] = 'Gone'
+        body['details'] = []
+        expect(json.loads(encode_envelope(body))).to(equal({
+            'status': 'Gone', 'code': 404, 'messages': ['No resource with identifier \'0\' found.'], 'details': []}))
+
+    def test_stream_all_response(self, app):
+        results = [{'id': str(index), 'date_registered': datetime(2019, 8, 21)} for index in range(3)]
+        with app.test_request_context():
+            response = ResponseBody().stream_all_response(iter(results))
+            body = json.loads(response.get_data(as_text=True))
+            expect(body['status']).to(equal('OK'))
+            expect(body['messages']).to(equal(['Successfully retrieved resources.']))
+            expect(body['response'][2]).to(equal({'id': '2', 'date_registered': '2019-08-21T00:00:00'}))
+
+            response = ResponseBody().stream_all_response(iter(results), ndjson=True)
+            expect(response.mimetype).to(equal('application/x-ndjson'))
+            lines = response.get_data(as_text=True).splitlines()
+            expect([json.loads(line)['id'] for line in lines]).to(equal(['0', '1', '2']))